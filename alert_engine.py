@@ -0,0 +1,211 @@
+import numpy as np
+from collections import namedtuple
+
+# --- Codes ---
+# Alert types and states are stored as small integer codes so a whole alert
+# book can be evaluated with array operations instead of string comparisons.
+
+ALERT_TYPES = ("Price Rises Above", "Price Falls Below", "Price Drops From Recent High", "Price Rises From Recent Low")
+RISES_ABOVE, FALLS_BELOW, DROPS_FROM_HIGH, RISES_FROM_LOW = range(4)
+
+STATES = (None, "watching_for_peak", "watching_for_drop", "watching_for_trough", "watching_for_rise")
+NO_STATE, WATCHING_FOR_PEAK, WATCHING_FOR_DROP, WATCHING_FOR_TROUGH, WATCHING_FOR_RISE = range(5)
+
+UNKNOWN = -1
+
+_TYPE_CODES = {name: code for code, name in enumerate(ALERT_TYPES)}
+_STATE_CODES = {name: code for code, name in enumerate(STATES)}
+_STATE_CODES[""] = NO_STATE
+
+Trigger = namedtuple("Trigger", ["alert", "stock", "current_price", "benchmark_price"])
+# previous_state/previous_benchmark are the values the change was computed from
+StateChange = namedtuple("StateChange", ["alert_id", "current_state", "last_benchmark_price", "initialized", "previous_state", "previous_benchmark"])
+CycleResult = namedtuple("CycleResult", ["evaluated", "triggers", "state_changes", "deactivated"])
+
+def _to_float(value):
+    return np.nan if value is None else float(value)
+
+class AlertBook:
+    """
+    Holds a set of alerts in columnar arrays and evaluates them against a price vector.
+
+    evaluate() produces exactly the transitions of alerter.process_alert, including the
+    watching_for_peak -> watching_for_drop (and trough -> rise) fall-through, for every
+    alert in one NumPy pass. The book keeps its arrays up to date, so repeated calls
+    behave like repeated process_alert calls on freshly loaded rows.
+    """
+
+    def __init__(self, alerts_with_stocks):
+        """
+        Args:
+            alerts_with_stocks (list): (alert, stock) pairs as returned by
+                database.get_active_alerts_with_stocks().
+        """
+        self.alerts = [alert for alert, _ in alerts_with_stocks]
+        self.stocks = [stock for _, stock in alerts_with_stocks]
+
+        self.alert_ids = np.array([alert[0] for alert in self.alerts], dtype=np.int64)
+        self.type_codes = np.array([_TYPE_CODES.get(alert[2], UNKNOWN) for alert in self.alerts], dtype=np.int8)
+        self.thresholds = np.array([_to_float(alert[3]) for alert in self.alerts], dtype=np.float64)
+        self.targets = np.array([_to_float(alert[4]) for alert in self.alerts], dtype=np.float64)
+        self.active = np.array([bool(alert[5]) for alert in self.alerts], dtype=bool)
+        self.benchmarks = np.array([_to_float(alert[6]) for alert in self.alerts], dtype=np.float64)
+        self.states = np.array([_STATE_CODES.get(alert[7], UNKNOWN) for alert in self.alerts], dtype=np.int8)
+
+        rows_by_ticker = {}
+        for row, stock in enumerate(self.stocks):
+            rows_by_ticker.setdefault(stock[1], []).append(row)
+        self._rows_by_ticker = {ticker: np.array(rows, dtype=np.intp) for ticker, rows in rows_by_ticker.items()}
+        self._ticker_positions = {ticker: position for position, ticker in enumerate(self._rows_by_ticker)}
+        self.ticker_index = np.empty(len(self.alerts), dtype=np.intp)
+        for ticker, rows in self._rows_by_ticker.items():
+            self.ticker_index[rows] = self._ticker_positions[ticker]
+
+    def __len__(self):
+        return len(self.alerts)
+
+    def tickers(self):
+        """Returns the tickers that have at least one alert in the book."""
+        return list(self._rows_by_ticker)
+
+    def evaluate(self, prices):
+        """
+        Evaluates every alert whose ticker has a price.
+
+        Args:
+            prices (dict): Maps tickers to their current price.
+
+        Returns:
+            CycleResult: the number of alerts evaluated, the triggers in book order,
+                the state changes to persist, and the IDs of target alerts to deactivate.
+        """
+        price_by_ticker = np.full(len(self._ticker_positions), np.nan)
+        row_groups = []
+        for ticker, ticker_price in prices.items():
+            position = self._ticker_positions.get(ticker)
+            if position is not None:
+                price_by_ticker[position] = ticker_price
+                row_groups.append(self._rows_by_ticker[ticker])
+        if not row_groups:
+            return CycleResult(0, [], [], [])
+        if len(row_groups) == len(self._ticker_positions):
+            rows = np.arange(len(self.alerts))
+        else:
+            rows = np.sort(np.concatenate(row_groups))
+        price = price_by_ticker[self.ticker_index[rows]]
+
+        alert_type = self.type_codes[rows]
+        threshold = self.thresholds[rows]
+        target = self.targets[rows]
+        state = self.states[rows]
+        benchmark = self.benchmarks[rows]
+        live = self.active[rows] & ~np.isnan(price)
+
+        new_state = state.copy()
+        new_benchmark = benchmark.copy()
+        notify_benchmark = np.full(len(rows), np.nan)
+
+        # Target alerts fire once and are then deactivated
+        above = live & (alert_type == RISES_ABOVE) & (price >= target)
+        below = live & (alert_type == FALLS_BELOW) & (price <= target)
+        deactivate = above | below
+        notify_benchmark[deactivate] = target[deactivate]
+
+        # Percentage alerts without a state start watching from the current price
+        dynamic = live & (alert_type != RISES_ABOVE) & (alert_type != FALLS_BELOW)
+        initialize = dynamic & (state == NO_STATE)
+        new_state[initialize] = np.where(alert_type[initialize] == DROPS_FROM_HIGH, WATCHING_FOR_PEAK, WATCHING_FOR_TROUGH)
+        new_benchmark[initialize] = price[initialize]
+        running = dynamic & ~initialize
+
+        with np.errstate(invalid='ignore'):
+            # Price Drops From Recent High
+            drops = running & (alert_type == DROPS_FROM_HIGH)
+            peak = drops & (state == WATCHING_FOR_PEAK)
+            new_peak = peak & (price > benchmark)
+            falling = peak & ~new_peak  # Falls through to the drop check below
+            check_drop = falling | (drops & (state == WATCHING_FOR_DROP))
+            drop_trigger = benchmark * (1 - threshold / 100)
+            drop_hit = check_drop & (price <= drop_trigger)
+            drop_reset = check_drop & ~drop_hit & (price > benchmark)
+
+            # Price Rises From Recent Low
+            rises = running & (alert_type == RISES_FROM_LOW)
+            trough = rises & (state == WATCHING_FOR_TROUGH)
+            new_trough = trough & (price < benchmark)
+            rising = trough & ~new_trough  # Falls through to the rise check below
+            check_rise = rising | (rises & (state == WATCHING_FOR_RISE))
+            rise_trigger = benchmark * (1 + threshold / 100)
+            rise_hit = check_rise & (price >= rise_trigger)
+            rise_reset = check_rise & ~rise_hit & (price < benchmark)
+
+        new_benchmark[new_peak | new_trough] = price[new_peak | new_trough]
+        new_state[falling] = WATCHING_FOR_DROP
+        new_state[rising] = WATCHING_FOR_RISE
+        hit = drop_hit | rise_hit
+        notify_benchmark[hit] = benchmark[hit]
+        new_state[drop_hit | drop_reset] = WATCHING_FOR_PEAK
+        new_state[rise_hit | rise_reset] = WATCHING_FOR_TROUGH
+        reset = hit | drop_reset | rise_reset
+        new_benchmark[reset] = price[reset]
+
+        # Rows process_alert cannot evaluate (missing benchmark or threshold) raise there
+        # and are left untouched, so leave them untouched here too.
+        broken = (running & np.isnan(benchmark) & (peak | trough | check_drop | check_rise)) | \
+                 ((check_drop | check_rise) & np.isnan(threshold))
+        new_state[broken] = state[broken]
+        new_benchmark[broken] = benchmark[broken]
+        fired = (deactivate | hit) & ~broken
+
+        same_benchmark = (new_benchmark == benchmark) | (np.isnan(new_benchmark) & np.isnan(benchmark))
+        changed = (new_state != state) | ~same_benchmark
+
+        self.states[rows] = new_state
+        self.benchmarks[rows] = new_benchmark
+        self.active[rows[deactivate]] = False
+
+        triggers = [
+            Trigger(self.alerts[row], self.stocks[row], float(price[i]), float(notify_benchmark[i]))
+            for i, row in zip(np.flatnonzero(fired), rows[fired])
+        ]
+        state_changes = [
+            StateChange(int(self.alert_ids[row]), STATES[new_state[i]], float(new_benchmark[i]), bool(initialize[i]),
+                        self.alerts[row][7], self.alerts[row][6])
+            for i, row in zip(np.flatnonzero(changed), rows[changed])
+        ]
+        deactivated = [int(alert_id) for alert_id in self.alert_ids[rows[deactivate]]]
+        return CycleResult(int(live.sum()), triggers, state_changes, deactivated)
+
+    def trigger_distances(self, prices):
+        """
+        Returns, per ticker, the fractional distance from its price to the nearest trigger.
+
+        Uses the current benchmarks, so call it after evaluate() for the same prices.
+        Tickers whose only alerts have no benchmark yet report a distance of 0.
+
+        Args:
+            prices (dict): Maps tickers to their current price.
+
+        Returns:
+            dict: Maps each ticker in both the book and `prices` to a distance (0.01 = 1%).
+        """
+        price_by_ticker = np.full(len(self._ticker_positions), np.nan)
+        for ticker, ticker_price in prices.items():
+            position = self._ticker_positions.get(ticker)
+            if position is not None:
+                price_by_ticker[position] = ticker_price
+
+        price = price_by_ticker[self.ticker_index]
+        direction = np.where(self.type_codes == DROPS_FROM_HIGH, -1.0, 1.0)
+        is_target = (self.type_codes == RISES_ABOVE) | (self.type_codes == FALLS_BELOW)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            trigger = np.where(is_target, self.targets, self.benchmarks * (1 + direction * self.thresholds / 100))
+            distance = np.abs(price - trigger) / price
+        usable = self.active & ~np.isnan(price)
+        distance[usable & np.isnan(distance)] = 0.0
+        distance[~usable] = np.inf
+
+        nearest = np.full(len(self._ticker_positions), np.inf)
+        np.minimum.at(nearest, self.ticker_index, distance)
+        return {ticker: float(nearest[position]) for ticker, position in self._ticker_positions.items()
+                if not np.isnan(price_by_ticker[position]) and np.isfinite(nearest[position])}
@@ -0,0 +1,149 @@
+import bisect
+import math
+import threading
+import database as db
+
+TARGET_ALERT_TYPES = ("Price Rises Above", "Price Falls Below")
+
+class TargetIndex:
+    """
+    Per-ticker sorted index of "Price Rises Above" / "Price Falls Below" targets.
+
+    Each ticker keeps two lists of (target_price, alert_id) sorted by price, one per
+    direction, so the alerts crossed by a new price are found with a bisect and the
+    cost of a check scales with the number of alerts that fire. The index is kept in
+    sync with the database through database.add_alert_listener.
+    """
+
+    def __init__(self):
+        self._above = {}  # ticker -> sorted [(target, alert_id)], fires when price >= target
+        self._below = {}  # ticker -> sorted [(target, alert_id)], fires when price <= target
+        self._entries = {}  # alert_id -> (ticker, stock_id, alert_type, target)
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._pending = None  # Changes received while load() reads the snapshot, else None
+
+    def load(self):
+        """Builds the index from the database and starts following alert changes."""
+        # Follow changes before reading the snapshot, so none made in between is lost;
+        # they are replayed on top of it
+        with self._lock:
+            self._pending = []
+        db.add_alert_listener(self.on_alert_change)
+        try:
+            rows = db.get_active_alerts_with_stocks(alert_types=TARGET_ALERT_TYPES)
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            self._above.clear()
+            self._below.clear()
+            self._entries.clear()
+            for alert, stock in rows:
+                self._insert(alert, stock)
+            pending, self._pending = self._pending, None
+            self._loaded = True
+        for event, object_id in pending:
+            self.on_alert_change(event, object_id)
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def _side(self, alert_type):
+        return self._above if alert_type == "Price Rises Above" else self._below
+
+    def _insert(self, alert, stock):
+        """Adds an alert row if it is an active target alert. Caller holds the lock."""
+        alert_id, stock_id, alert_type, _, target_price, is_active = alert[:6]
+        if not is_active or alert_type not in TARGET_ALERT_TYPES or target_price is None:
+            return
+        ticker = stock[1]
+        bisect.insort(self._side(alert_type).setdefault(ticker, []), (target_price, alert_id))
+        self._entries[alert_id] = (ticker, stock_id, alert_type, target_price)
+
+    def _remove(self, alert_id):
+        """Removes an alert from the index if present. Caller holds the lock."""
+        entry = self._entries.pop(alert_id, None)
+        if entry is None:
+            return
+        ticker, _, alert_type, target_price = entry
+        side = self._side(alert_type)
+        targets = side.get(ticker, [])
+        position = bisect.bisect_left(targets, (target_price, alert_id))
+        if position < len(targets) and targets[position] == (target_price, alert_id):
+            del targets[position]
+        if not targets:
+            side.pop(ticker, None)
+
+    def on_alert_change(self, event, object_id):
+        """Listener for database alert changes; see database.add_alert_listener."""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((event, object_id))
+                return
+        if event == "stock_deleted":
+            with self._lock:
+                for alert_id in [a for a, entry in self._entries.items() if entry[1] == object_id]:
+                    self._remove(alert_id)
+            return
+
+        row = db.get_alert_with_stock(object_id) if event == "saved" else None
+        with self._lock:
+            self._remove(object_id)
+            if row is not None:
+                self._insert(*row)
+
+    def tickers(self):
+        """Returns the tickers that have at least one indexed target alert."""
+        with self._lock:
+            return list(set(self._above) | set(self._below))
+
+    def nearest_distance(self, ticker, price):
+        """Returns the fractional distance from a price to the ticker's nearest target, or None."""
+        with self._lock:
+            nearest = []
+            above = self._above.get(ticker)
+            if above:
+                position = bisect.bisect_right(above, (price, math.inf))
+                if position < len(above):
+                    nearest.append(above[position][0])
+            below = self._below.get(ticker)
+            if below:
+                position = bisect.bisect_left(below, (price, -math.inf))
+                if position > 0:
+                    nearest.append(below[position - 1][0])
+        if not nearest or not price:
+            return None
+        return min(abs(price - target) for target in nearest) / price
+
+    def crossed(self, ticker, price):
+        """
+        Returns the IDs of the alerts a price has crossed for a ticker, without removing them.
+
+        The caller removes each one with discard() once it is deactivated in the database,
+        so an alert whose deactivation fails stays indexed and fires again.
+
+        Returns:
+            list: Alert IDs in ascending order.
+        """
+        with self._lock:
+            crossed = []
+            above = self._above.get(ticker)
+            if above:
+                end = bisect.bisect_right(above, (price, math.inf))
+                crossed += [alert_id for _, alert_id in above[:end]]
+            below = self._below.get(ticker)
+            if below:
+                start = bisect.bisect_left(below, (price, -math.inf))
+                crossed += [alert_id for _, alert_id in below[start:]]
+            return sorted(crossed)
+
+    def discard(self, alert_id):
+        """Removes an alert from the index if present."""
+        with self._lock:
+            self._remove(alert_id)
+
+# Shared index used by the alerter
+target_index = TargetIndex()
@@ -1,12 +1,33 @@
 import time
 import threading
 import database as db
-import yfinance_client as yf_client
-import notifier
+import quote_cache
+import poll_scheduler
+from alert_engine import AlertBook
+from alert_index import target_index
+import notification_dispatcher
+import price_history
+import ticker_metadata
+import metrics
+import settings
 import queue
+import atexit
+from logging_setup import TRACE
+import logging
+
+logger = logging.getLogger(__name__)
 
 # Queue for sending alerts to the UI thread
 ui_alert_queue = queue.Queue()
+# Cleared when no UI drains ui_alert_queue (the headless daemon), so it cannot grow forever
+ui_alerts_enabled = True
+
+CYCLE_SECONDS = metrics.registry.histogram("stockalert_alerter_cycle_seconds", "Duration of alert check cycles.", ("engine",))
+TICKERS_POLLED = metrics.registry.counter("stockalert_alerter_tickers_polled_total", "Tickers polled by the alerter.")
+ALERTS_EVALUATED = metrics.registry.counter("stockalert_alerts_evaluated_total", "Alert evaluations.")
+ALERTS_TRIGGERED = metrics.registry.counter("stockalert_alerts_triggered_total", "Alerts that triggered.")
+UI_QUEUE_DEPTH = metrics.registry.gauge("stockalert_ui_alert_queue_depth", "Alerts waiting for the UI thread.")
+UI_QUEUE_DEPTH.set_function(ui_alert_queue.qsize)
 
 # --- Currency Formatting ---
 
@@ -21,73 +42,317 @@ def get_currency_symbol(currency_code):
     }
     return symbols.get(currency_code, f"{currency_code} ")
 
+# --- Alert State Write-Behind ---
+
+# Seconds between flushes of staged alert states when no cycle boundary flushes them first
+ALERT_STATE_FLUSH_INTERVAL = 30
+
+# alert_id -> (current_state, last_benchmark_price, expected_state, expected_benchmark) not yet
+# written. The expected values are the row's state in the database when the change was made;
+# the flush only writes rows that still hold them, so a state computed before the alert was
+# replaced, reset or deleted from the UI never overwrites the new row.
+_staged_alert_states = {}
+_alert_state_lock = threading.Lock()
+_last_alert_state_flush = time.monotonic()
+
+def stage_alert_state(alert_id, current_state, last_benchmark_price, previous_state=None, previous_benchmark=None):
+    """
+    Records an alert's new state in memory. It reaches the database on the next flush.
+
+    Calls where the state and benchmark match the previous values are ignored.
+
+    Args:
+        previous_state, previous_benchmark: The values in the alert row the change was
+            computed from.
+    """
+    if (current_state, last_benchmark_price) == (previous_state, previous_benchmark):
+        return
+    with _alert_state_lock:
+        staged = _staged_alert_states.get(alert_id)
+        # A state staged earlier was computed from the database row; later ones from that state
+        expected = staged[2:] if staged else (previous_state, previous_benchmark)
+        _staged_alert_states[alert_id] = (current_state, last_benchmark_price) + expected
+
+def apply_staged_state(alert):
+    """Returns the alert row with any state that is staged but not yet flushed applied to it."""
+    with _alert_state_lock:
+        staged = _staged_alert_states.get(alert[0])
+    if staged is None:
+        return alert
+    return alert[:6] + (staged[1], staged[0])
+
+def discard_staged_state(alert_id):
+    """Forgets an alert's unflushed state, e.g. after the alert was replaced or deleted."""
+    with _alert_state_lock:
+        _staged_alert_states.pop(alert_id, None)
+
+def flush_alert_states():
+    """Writes every staged alert state to the database in a single transaction."""
+    global _last_alert_state_flush
+    with _alert_state_lock:
+        states = [(alert_id,) + staged for alert_id, staged in _staged_alert_states.items()]
+        _staged_alert_states.clear()
+        _last_alert_state_flush = time.monotonic()
+    if not states:
+        return
+    try:
+        written = db.update_alert_states(states)
+        if written < len(states):
+            logger.debug("Skipped %d alert states whose alerts changed since.", len(states) - written)
+    except Exception as e:
+        logger.error("Error flushing alert states: %s", e)
+        # Put them back unless a newer state was staged in the meantime
+        with _alert_state_lock:
+            for alert_id, *staged in states:
+                _staged_alert_states.setdefault(alert_id, tuple(staged))
+
+def maybe_flush_alert_states():
+    """Flushes staged alert states if ALERT_STATE_FLUSH_INTERVAL has passed since the last flush."""
+    if time.monotonic() - _last_alert_state_flush >= ALERT_STATE_FLUSH_INTERVAL:
+        flush_alert_states()
+
+# Checkpoint whatever is still in memory when the process exits normally
+atexit.register(flush_alert_states)
+
 # --- Alerter Logic ---
 
+DYNAMIC_ALERT_TYPES = ("Price Drops From Recent High", "Price Rises From Recent Low")
+
 debug_fake_price = None
 alerter_thread_instance = None
 
+# Set to cut the alerter's wait short, e.g. when a fake price is injected
+_wake_event = threading.Event()
+# Set to end the alerter loop after its current cycle
+_stop_event = threading.Event()
+# active is True on a thread while it writes on the alerter's behalf
+_own_writes = threading.local()
+
 def inject_fake_price(ticker, price):
     """Injects a fake price for a specific ticker for one check cycle."""
     global debug_fake_price
-    print(f"[DEBUG] Injecting fake price for {ticker}: {price}")
+    logger.info("Injecting fake price for %s: %s", ticker, price)
     debug_fake_price = {"ticker": ticker, "price": price}
+    _wake_event.set()
+
+def _wait(seconds):
+    """
+    Sleeps for up to `seconds`, returning early if the alerter is woken.
+
+    Only a wake that ended the wait is cleared. One that arrives later (during the
+    next cycle, or right as the wait times out) stays set and ends the next wait at once.
+    """
+    if _wake_event.wait(seconds):
+        _wake_event.clear()
+
+def _on_alert_change(event, object_id):
+    """
+    Alert listener: picks up alerts added, changed or removed from the UI without waiting out the sleep.
+
+    A replaced or deleted alert also loses any state staged for it before the change.
+    The alerter's own writes are ignored, so a trigger does not cause an extra cycle.
+    """
+    if getattr(_own_writes, "active", False):
+        return
+    if event in ("saved", "deleted"):
+        discard_staged_state(object_id)
+    _wake_event.set()
+
+def _on_setting_changed(key, value, old):
+    """Settings subscriber: runs a cycle right away so new intervals or providers apply now."""
+    if key == "alerter_engine":
+        logger.info("The alerter engine changes to '%s' after a restart.", value)
+        return
+    _wake_event.set()
+
+settings.subscribe(_on_setting_changed, keys=poll_scheduler.INTERVAL_SETTINGS + quote_cache.PROVIDER_SETTINGS + ("alerter_engine",))
+db.add_alert_listener(_on_alert_change)
+
+def _deactivate_alert(alert_id):
+    """Deactivates an alert that fired, without waking the alerter for its own change."""
+    _own_writes.active = True
+    try:
+        db.update_alert_status(alert_id, False)
+    finally:
+        _own_writes.active = False
+
+def handle_fake_price():
+    """Processes an injected debug price against the first active alert for its ticker."""
+    global debug_fake_price
+    logger.debug("Prioritizing fake price check.")
+    fake_ticker = debug_fake_price.get("ticker")
+    fake_price = debug_fake_price.get("price")
+    # Only the first active alert for the fake ticker is tested, as before
+    matches = db.get_active_alerts_with_stocks(ticker=fake_ticker)
+    alert_to_check, stock_to_check = matches[0] if matches else (None, None)
+
+    if stock_to_check and alert_to_check:
+        logger.info("Processing injected price %s for %s.", fake_price, fake_ticker)
+        process_alert(apply_staged_state(alert_to_check), stock_to_check, fake_price)
+        flush_alert_states()
+    else:
+        logger.warning("Could not find an active alert for ticker %s.", fake_ticker)
+
+    debug_fake_price = None # Reset after use
+
+def prepare_cycle(scheduler):
+    """
+    Loads the alert book for a check cycle and picks the tickers to poll.
+
+    Returns:
+        tuple: (AlertBook of the percentage alerts, list of due tickers whose market is open)
+    """
+    if not target_index.loaded:
+        target_index.load()
+    # Target alerts live in the sorted index; only percentage alerts go through the book
+    alerts_with_stocks = db.get_active_alerts_with_stocks(alert_types=DYNAMIC_ALERT_TYPES)
+    book = AlertBook([(apply_staged_state(alert), stock) for alert, stock in alerts_with_stocks])
+    scheduler.set_alert_tickers(book.tickers() + target_index.tickers())
+
+    # Only poll the tickers the scheduler says are due (alerts and dashboard alike),
+    # and leave closed markets alone until they open again
+    provider = quote_cache.get_provider()
+    provider.begin_cycle()  # Every fetch of this cycle sees the same replay instant
+    due = []
+    for ticker in scheduler.due_tickers():
+        if provider.is_market_open(ticker):
+            due.append(ticker)
+        else:
+            scheduler.defer(ticker, provider.seconds_until_open(ticker))
+    return book, due
+
+def evaluate_prices(book, prices, notify=None):
+    """
+    Evaluates the book and the target index against fetched prices.
+
+    Args:
+        book (AlertBook): The cycle's percentage alerts.
+        prices (dict): Maps tickers to their current price.
+        notify (callable, optional): Called like send_notification for each trigger.
+
+    Returns:
+        tuple: (alerts evaluated, alerts triggered)
+    """
+    result = book.evaluate(prices)
+    apply_cycle_result(result, notify)
+    targets_hit = check_target_alerts(prices, notify)
+    ALERTS_EVALUATED.inc(result.evaluated + targets_hit)
+    ALERTS_TRIGGERED.inc(len(result.triggers) + targets_hit)
+    return result.evaluated, len(result.triggers) + targets_hit
+
+def record_polls(scheduler, book, tickers, prices):
+    """Tells the scheduler how each polled ticker went, so it can plan the next poll."""
+    distances = book.trigger_distances(prices)
+    for ticker in tickers:
+        if ticker not in prices:
+            scheduler.record_failure(ticker)
+            continue
+        target_distance = target_index.nearest_distance(ticker, prices[ticker])
+        candidates = [d for d in (distances.get(ticker), target_distance) if d is not None]
+        scheduler.record(ticker, prices[ticker], min(candidates) if candidates else None)
+
+def next_wait(scheduler):
+    """Returns how long to sleep until the next ticker is due, at most the max interval."""
+    wait = scheduler.seconds_until_next_due()
+    return scheduler.max_interval if wait is None else min(max(wait, 0.5), scheduler.max_interval)
+
+def run_alert_cycle(scheduler=None):
+    """
+    Runs one check cycle: fetches the due tickers, evaluates their alerts and records the polls.
+
+    Returns:
+        tuple: (tickers polled, alerts evaluated, alerts triggered)
+    """
+    scheduler = scheduler or poll_scheduler.shared_scheduler
+    started = time.perf_counter()
+    book, due = prepare_cycle(scheduler)
+    if not due:
+        return 0, 0, 0
+
+    logger.debug("Checking for alerts on %d tickers...", len(due))
+    TICKERS_POLLED.inc(len(due))
+    live_prices = quote_cache.get_current_prices(due)
+    prices = {ticker: data['price'] for ticker, data in live_prices.items()}
+
+    evaluated = triggered = 0
+    try:
+        evaluated, triggered = evaluate_prices(book, prices)
+        logger.info("Evaluated %d alerts, %d triggered.", evaluated, triggered)
+    except Exception as e:
+        logger.exception("Error evaluating alerts: %s", e)
+
+    record_polls(scheduler, book, due, prices)
+    # Checkpoint the cycle's state changes in one transaction
+    flush_alert_states()
+    CYCLE_SECONDS.observe(time.perf_counter() - started, engine="threaded")
+    return len(due), evaluated, triggered
 
 def check_alerts():
     """The main loop for the alerter thread."""
-    global debug_fake_price
-    while True:
+    scheduler = poll_scheduler.shared_scheduler
+    scheduler.configure()
+    while not _stop_event.is_set():
         # --- Debug Price Injection Check ---
         if debug_fake_price:
             # If a fake price is present, process it immediately
             # This ensures the test happens right away, not after the next sleep cycle
-            print("[DEBUG] Prioritizing fake price check.")
-            fake_ticker = debug_fake_price.get("ticker")
-            fake_price = debug_fake_price.get("price")
-            alerts = db.get_all_alerts()
-            stock_to_check = None
-            alert_to_check = None
-
-            # Find the specific stock and alert for the fake ticker
-            for alert in alerts:
-                stock = db.get_stock_by_id(alert[1])
-                if stock and stock[1] == fake_ticker:
-                    stock_to_check = stock
-                    alert_to_check = alert
-                    break
-            
-            if stock_to_check and alert_to_check:
-                print(f"[DEBUG] Processing injected price {fake_price} for {fake_ticker}.")
-                process_alert(alert_to_check, stock_to_check, fake_price)
-            else:
-                print(f"[DEBUG] Could not find an active alert for ticker {fake_ticker}.")
-
-            debug_fake_price = None # Reset after use
+            handle_fake_price()
             # Continue to the regular check after handling the fake price
             continue
 
-        print("Checking for alerts...")
-        alerts = db.get_all_alerts()
-        if not alerts:
-            time.sleep(60) # Wait for a minute if there are no alerts
-            continue
+        run_alert_cycle(scheduler)
 
-        stock_ids = list(set(alert[1] for alert in alerts))
-        stocks_by_id = {stock[0]: stock for stock in [db.get_stock_by_id(sid) for sid in stock_ids]}
-        tickers = [s[1] for s in stocks_by_id.values() if s]
-        live_prices = yf_client.get_current_prices(tickers)
+        # Sleep until the next ticker is due; re-check the alert list at least every max interval
+        _wait(next_wait(scheduler))
 
-        for alert in alerts:
+def apply_cycle_result(result, notify=None):
+    """Sends the notifications and persists the state changes of an AlertBook evaluation."""
+    notify = notify or send_notification
+    trace = logger.isEnabledFor(TRACE)
+    for change in result.state_changes:
+        stage_alert_state(change.alert_id, change.current_state, change.last_benchmark_price, change.previous_state, change.previous_benchmark)
+        if change.initialized and trace:
+            logger.log(TRACE, "Initialized alert %s to state: %s with benchmark: %s", change.alert_id, change.current_state, change.last_benchmark_price)
+
+    for trigger in result.triggers:
+        try:
+            notify(trigger.stock, trigger.alert[2], trigger.current_price, trigger.benchmark_price)
+        except Exception as e:
+            logger.error("Error sending notification for alert %s: %s", trigger.alert[0], e)
+
+    for alert_id in result.deactivated:
+        _deactivate_alert(alert_id)
+
+def check_target_alerts(prices, notify=None):
+    """
+    Fires the target alerts crossed by the given prices, using the sorted target index.
+
+    Returns:
+        int: The number of alerts that fired.
+    """
+    notify = notify or send_notification
+    fired = 0
+    for ticker, current_price in prices.items():
+        for alert_id in target_index.crossed(ticker, current_price):
+            row = db.get_alert_with_stock(alert_id)
+            if row is None or not row[0][5]:
+                target_index.discard(alert_id)
+                continue
+            alert, stock = row
+            # Deactivate first: if the write fails the alert stays active and indexed, and
+            # fires on a later cycle instead of being lost or notified twice
             try:
-                stock = stocks_by_id.get(alert[1])
-                if stock:
-                    current_price_data = live_prices.get(stock[1])
-                    if current_price_data:
-                        current_price = current_price_data['price']
-                        process_alert(alert, stock, current_price)
+                _deactivate_alert(alert_id)
             except Exception as e:
-                print(f"Error processing alert {alert[0]}: {e}")
-
-        time.sleep(60) # Wait for a minute before the next check
+                logger.error("Error deactivating alert %s, retrying next cycle: %s", alert_id, e)
+                continue
+            target_index.discard(alert_id)
+            try:
+                notify(stock, alert[2], current_price, alert[4])
+            except Exception as e:
+                logger.error("Error sending notification for alert %s: %s", alert_id, e)
+            fired += 1
+    return fired
 
 def process_alert(alert, stock, current_price):
     """Processes a single alert using pre-fetched data."""
@@ -99,62 +364,72 @@ def process_alert(alert, stock, current_price):
     if alert_type == "Price Rises Above":
         if target_price is not None and current_price >= target_price:
             send_notification(stock, alert_type, current_price, target_price)
-            db.update_alert_status(alert_id, False)
+            _deactivate_alert(alert_id)
         return
     elif alert_type == "Price Falls Below":
         if target_price is not None and current_price <= target_price:
             send_notification(stock, alert_type, current_price, target_price)
-            db.update_alert_status(alert_id, False)
+            _deactivate_alert(alert_id)
         return
 
     if not current_state:
+        previous_state, previous_benchmark = current_state, last_benchmark_price
         if alert_type == "Price Drops From Recent High":
             current_state = "watching_for_peak"
             last_benchmark_price = current_price
         else: # Price Rises From Recent Low
             current_state = "watching_for_trough"
             last_benchmark_price = current_price
-        db.update_alert_state(alert_id, current_state, last_benchmark_price)
-        print(f"[STATE] Initialized alert {alert_id} for {stock[1]} to state: {current_state} with benchmark: {last_benchmark_price}")
+        stage_alert_state(alert_id, current_state, last_benchmark_price, previous_state, previous_benchmark)
+        if logger.isEnabledFor(TRACE):
+            logger.log(TRACE, "Initialized alert %s for %s to state: %s with benchmark: %s", alert_id, stock[1], current_state, last_benchmark_price)
         return
 
-    print(f"[PROCESS] Alert:{alert_id}, Stock:{stock[1]}, Type:{alert_type}, State:{current_state}, CurrentPrice:{current_price}, Benchmark:{last_benchmark_price}")
+    trace = logger.isEnabledFor(TRACE)
+    if trace:
+        logger.log(TRACE, "Alert:%s, Stock:%s, Type:%s, State:%s, CurrentPrice:%s, Benchmark:%s", alert_id, stock[1], alert_type, current_state, current_price, last_benchmark_price)
+
+    # Only the final state of this tick is staged; unchanged alerts are never written
+    previous_state, previous_benchmark = current_state, last_benchmark_price
+    new_state, new_benchmark = current_state, last_benchmark_price
 
     if alert_type == "Price Drops From Recent High":
         if current_state == "watching_for_peak":
             if current_price > last_benchmark_price:
-                db.update_alert_state(alert_id, "watching_for_peak", current_price)
+                new_benchmark = current_price
             else: # Price has started to drop
-                db.update_alert_state(alert_id, "watching_for_drop", last_benchmark_price)
                 # Fall through to check if this drop is significant enough to trigger
-                current_state = "watching_for_drop"
+                current_state = new_state = "watching_for_drop"
 
         if current_state == "watching_for_drop":
             trigger_price = last_benchmark_price * (1 - threshold_percent / 100)
-            print(f"[EVAL] {stock[1]}: Current {current_price} <= Trigger {trigger_price:.2f}?")
+            if trace:
+                logger.log(TRACE, "%s: Current %s <= Trigger %.2f?", stock[1], current_price, trigger_price)
             if current_price <= trigger_price:
                 send_notification(stock, alert_type, current_price, last_benchmark_price)
-                db.update_alert_state(alert_id, "watching_for_peak", current_price)
+                new_state, new_benchmark = "watching_for_peak", current_price
             elif current_price > last_benchmark_price: # A new peak is forming
-                db.update_alert_state(alert_id, "watching_for_peak", current_price)
+                new_state, new_benchmark = "watching_for_peak", current_price
 
     elif alert_type == "Price Rises From Recent Low":
         if current_state == "watching_for_trough":
             if current_price < last_benchmark_price:
-                db.update_alert_state(alert_id, "watching_for_trough", current_price)
+                new_benchmark = current_price
             else: # Price has started to rise
-                db.update_alert_state(alert_id, "watching_for_rise", last_benchmark_price)
                 # Fall through to check if this rise is significant enough to trigger
-                current_state = "watching_for_rise"
+                current_state = new_state = "watching_for_rise"
 
         if current_state == "watching_for_rise":
             trigger_price = last_benchmark_price * (1 + threshold_percent / 100)
-            print(f"[EVAL] {stock[1]}: Current {current_price} >= Trigger {trigger_price:.2f}?")
+            if trace:
+                logger.log(TRACE, "%s: Current %s >= Trigger %.2f?", stock[1], current_price, trigger_price)
             if current_price >= trigger_price:
                 send_notification(stock, alert_type, current_price, last_benchmark_price)
-                db.update_alert_state(alert_id, "watching_for_trough", current_price)
+                new_state, new_benchmark = "watching_for_trough", current_price
             elif current_price < last_benchmark_price: # A new trough is forming
-                db.update_alert_state(alert_id, "watching_for_trough", current_price)
+                new_state, new_benchmark = "watching_for_trough", current_price
+
+    stage_alert_state(alert_id, new_state, new_benchmark, previous_state, previous_benchmark)
 
 def send_notification(stock, alert_type, current_price, benchmark_price):
     """Sends a notification for a triggered alert."""
@@ -171,34 +446,56 @@ def send_notification(stock, alert_type, current_price, benchmark_price):
     elif alert_type == "Price Falls Below":
         message = f"{full_name} ({ticker}) has fallen below your target of {symbol}{benchmark_price:,.2f} and is currently at {symbol}{current_price:,.2f}."
 
-    print(f"[NOTIFICATION] Triggered for {ticker}. Sending alert.")
-    ui_alert_queue.put({"title": title, "message": message})
+    logger.info("Alert triggered for %s. Sending notification.", ticker)
+    if ui_alerts_enabled:
+        ui_alert_queue.put({"title": title, "message": message})
 
-    notification_service = db.get_setting("notification_service")
+    notification_service = settings.get("notification_service")
     if not notification_service or notification_service == "None":
-        print("[NOTIFICATION] No mobile service configured.")
+        logger.debug("No mobile notification service configured.")
         return
 
-    if notification_service == "Pushover":
-        user_key = db.get_setting("pushover_user_key")
-        api_token = db.get_setting("pushover_api_token")
-        if user_key and api_token:
-            print(f"Sending Pushover notification: {title} - {message}")
-            notifier.send_pushover_notification(user_key, api_token, title, message)
-        else:
-            print("Pushover notification failed: User Key or API Token not set.")
+    # Delivery happens on the dispatcher's workers; this only writes the outbox row
+    logger.info("Queueing %s notification: %s - %s", notification_service, title, message)
+    notification_dispatcher.dispatcher.enqueue(notification_service, title, message)
 
-    elif notification_service == "Pushbullet":
-        api_token = db.get_setting("pushbullet_api_token")
-        if api_token:
-            print(f"Sending Pushbullet notification: {title} - {message}")
-            notifier.send_pushbullet_notification(api_token, title, message)
-        else:
-            print("Pushbullet notification failed: Access Token not set.")
+def start_alerter_thread(engine=None):
+    """
+    Starts the alerter thread.
 
-def start_alerter_thread():
-    """Starts the alerter thread."""
+    Args:
+        engine (str, optional): "threaded" for the check_alerts loop or "asyncio" for the
+            event-loop engine in async_alerter. Defaults to the alerter_engine setting.
+    """
     global alerter_thread_instance
+    _stop_event.clear()
+    notification_dispatcher.dispatcher.start()
+    ticker_metadata.start()
+    if settings.get("price_history_enabled", "True") == "True":
+        # Every quote fetched for the alerter (or the dashboard) goes into the history store
+        price_history.start()
     if alerter_thread_instance is None:
-        alerter_thread_instance = threading.Thread(target=check_alerts, daemon=True)
+        engine = engine or settings.get("alerter_engine") or "threaded"
+        if engine == "asyncio":
+            import async_alerter
+            target = async_alerter.run_in_thread
+        else:
+            target = check_alerts
+        alerter_thread_instance = threading.Thread(target=target, daemon=True)
         alerter_thread_instance.start()
+
+def stop_alerter_thread(timeout=None):
+    """
+    Ends the alerter loop after its current cycle and writes out the staged alert states.
+
+    Returns:
+        bool: True if the thread stopped within `timeout` seconds.
+    """
+    global alerter_thread_instance
+    _stop_event.set()
+    _wake_event.set()
+    thread, alerter_thread_instance = alerter_thread_instance, None
+    if thread is not None:
+        thread.join(timeout)
+    flush_alert_states()
+    return thread is None or not thread.is_alive()
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+import alerter
+import poll_scheduler
+import quote_cache
+
+logger = logging.getLogger(__name__)
+
+# Seconds one quote request may take before the cycle goes on without it
+FETCH_TIMEOUT = 10
+# Tickers per quote request; smaller chunks let fast tickers be evaluated sooner
+FETCH_CHUNK_SIZE = 10
+# Quote requests in flight at once
+FETCH_CONCURRENCY = 8
+
+class AsyncAlerter:
+    """
+    Event-loop alternative to alerter.check_alerts.
+
+    Each cycle fetches the due tickers in small concurrent chunks, each with its own
+    timeout, and evaluates every chunk as soon as it arrives, so one slow ticker no
+    longer holds back the alerts of the others. Notifications are handed to background
+    tasks. Blocking work (HTTP, SQLite, notifier calls) runs in worker threads; the
+    event loop itself only schedules.
+    """
+
+    def __init__(self, scheduler=None, fetch_timeout=FETCH_TIMEOUT, chunk_size=FETCH_CHUNK_SIZE, concurrency=FETCH_CONCURRENCY):
+        self.scheduler = scheduler or poll_scheduler.shared_scheduler
+        self.fetch_timeout = fetch_timeout
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        # One fetch thread per concurrency slot (see _fetch_chunk)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="alerter-fetch")
+        self._notifications = set()
+        self._limit = None
+
+    async def _fetch_chunk(self, tickers):
+        """Fetches one chunk of tickers. Returns (tickers, {ticker: price}); empty on failure."""
+        loop = asyncio.get_running_loop()
+        await self._limit.acquire()
+        future = loop.run_in_executor(self._executor, quote_cache.get_current_prices, tickers)
+        # A timed-out request keeps running in its thread, so the slot is released when the
+        # thread is done, not when we stop waiting. Each slot has a thread of its own, so the
+        # timeout starts once the request actually runs, not while it queues.
+        future.add_done_callback(self._fetch_done)
+        try:
+            quotes = await asyncio.wait_for(asyncio.shield(future), self.fetch_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Timed out fetching %s; retrying next cycle.", ", ".join(tickers))
+            quotes = {}
+        except Exception as e:
+            logger.error("Error fetching %s: %s", ", ".join(tickers), e)
+            quotes = {}
+        return tickers, {ticker: data['price'] for ticker, data in quotes.items()}
+
+    def _fetch_done(self, future):
+        self._limit.release()
+        if not future.cancelled():
+            future.exception()  # Already logged if awaited; keeps asyncio from reporting it again
+
+    def _notify(self, stock, alert_type, current_price, benchmark_price):
+        """Sends a notification in the background; called from the event loop thread."""
+        task = asyncio.create_task(asyncio.to_thread(alerter.send_notification, stock, alert_type, current_price, benchmark_price))
+        self._notifications.add(task)
+        task.add_done_callback(self._notification_done)
+
+    def _evaluate_chunk(self, book, tickers, prices, loop):
+        """Evaluates one chunk on a worker thread; notifications are scheduled on the loop."""
+        def notify(*args):
+            loop.call_soon_threadsafe(self._notify, *args)
+        try:
+            evaluated, triggered = alerter.evaluate_prices(book, prices, notify)
+        except Exception as e:
+            logger.exception("Error evaluating alerts: %s", e)
+            evaluated = triggered = 0
+        alerter.record_polls(self.scheduler, book, tickers, prices)
+        return evaluated, triggered
+
+    def _notification_done(self, task):
+        self._notifications.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Error sending notification: %s", task.exception())
+
+    async def run_cycle(self):
+        """Runs one check cycle. Returns (alerts evaluated, alerts triggered)."""
+        started = time.perf_counter()
+        book, due = await asyncio.to_thread(alerter.prepare_cycle, self.scheduler)
+        if not due:
+            return 0, 0
+
+        logger.debug("Checking for alerts on %d tickers...", len(due))
+        alerter.TICKERS_POLLED.inc(len(due))
+        chunks = [due[i:i + self.chunk_size] for i in range(0, len(due), self.chunk_size)]
+        loop = asyncio.get_running_loop()
+        evaluated = triggered = 0
+        for arrival in asyncio.as_completed([self._fetch_chunk(chunk) for chunk in chunks]):
+            tickers, prices = await arrival
+            # Evaluation reads and writes SQLite, so it stays off the loop; chunks are
+            # still evaluated one at a time, as they arrive
+            chunk_evaluated, chunk_triggered = await asyncio.to_thread(self._evaluate_chunk, book, tickers, prices, loop)
+            evaluated += chunk_evaluated
+            triggered += chunk_triggered
+
+        logger.info("Evaluated %d alerts, %d triggered.", evaluated, triggered)
+        # Checkpoint the cycle's state changes in one transaction
+        await asyncio.to_thread(alerter.flush_alert_states)
+        alerter.CYCLE_SECONDS.observe(time.perf_counter() - started, engine="asyncio")
+        return evaluated, triggered
+
+    async def run(self):
+        """The main loop of the asyncio engine."""
+        self._limit = asyncio.Semaphore(self.concurrency)
+        self.scheduler.configure()
+        try:
+            while not alerter._stop_event.is_set():
+                if alerter.debug_fake_price:
+                    await asyncio.to_thread(alerter.handle_fake_price)
+                    continue
+                try:
+                    await self.run_cycle()
+                except Exception as e:
+                    logger.exception("Error in alerter cycle: %s", e)
+                await asyncio.to_thread(alerter._wait, alerter.next_wait(self.scheduler))
+        finally:
+            # Don't wait for requests that already timed out; their threads end on their own
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+def run_in_thread():
+    """Thread target: runs the asyncio engine in a fresh event loop on the calling thread."""
+    asyncio.run(AsyncAlerter().run())
@@ -0,0 +1,285 @@
+import argparse
+import json
+import time
+from collections import namedtuple
+import numpy as np
+from alert_engine import AlertBook
+
+DROP_ALERT = "Price Drops From Recent High"
+RISE_ALERT = "Price Rises From Recent Low"
+TARGET_ALERTS = ("Price Rises Above", "Price Falls Below")
+
+# Ticks searched at once for the next trigger; the window grows while nothing triggers
+# and otherwise follows the gap between recent triggers
+INITIAL_WINDOW = 256
+
+BacktestAlert = namedtuple("BacktestAlert", ["ticker", "alert_type", "threshold_percent", "target_price"])
+BacktestTrigger = namedtuple("BacktestTrigger", ["alert", "timestamp", "price", "benchmark_price"])
+
+# --- Price Series ---
+
+def bar_prices(frame, intrabar=False):
+    """
+    Turns OHLC bars into the price ticks fed to the alerts.
+
+    Args:
+        frame (pandas.DataFrame): Bars indexed by timestamp, with a 'close' (or 'price') column
+            and, for intrabar, 'open', 'high' and 'low'.
+        intrabar (bool): Expand each bar into four ticks: open, low, high, close for an up
+            bar and open, high, low, close for a down bar, so intrabar extremes are seen.
+
+    Returns:
+        tuple: (timestamps, prices) as NumPy arrays, with missing prices dropped.
+    """
+    index = frame.index
+    if getattr(index, "tz", None) is not None:
+        # Naive UTC datetime64 values; converting aware timestamps to NumPy is very slow
+        frame = frame.set_axis(index.tz_convert("UTC").tz_localize(None))
+    close_column = "close" if "close" in frame.columns else "price"
+    if intrabar and {"open", "high", "low"} <= set(frame.columns):
+        bars = frame[["open", "high", "low", close_column]].dropna()
+        opens, highs, lows, closes = (bars[column].to_numpy(dtype=np.float64) for column in bars.columns)
+        up = closes >= opens
+        prices = np.column_stack([opens, np.where(up, lows, highs), np.where(up, highs, lows), closes]).ravel()
+        timestamps = np.repeat(bars.index.to_numpy(), 4)
+        return timestamps, prices
+    series = frame[close_column].dropna()
+    return series.index.to_numpy(), series.to_numpy(dtype=np.float64)
+
+# --- Trigger Search ---
+
+def _running_extreme_triggers(prices, factor):
+    """
+    Finds the ticks where a price falls to `factor` times its running maximum.
+
+    The running maximum restarts at the triggering price after every trigger, which
+    is what process_alert does with last_benchmark_price for a positive threshold.
+    The search runs in growing windows of vectorized cumulative maxima, so the Python
+    overhead is per trigger, not per tick.
+
+    Returns:
+        tuple: (indices of the triggering ticks, benchmark before each trigger)
+    """
+    indices, benchmarks = [], []
+    n = len(prices)
+    if n == 0:
+        return np.array(indices, dtype=np.intp), np.array(benchmarks)
+    benchmark = prices[0]  # The first tick only initializes the alert
+    position = 1
+    window = INITIAL_WINDOW
+    while position < n:
+        end = min(n, position + window)
+        segment = prices[position:end]
+        prior = np.empty_like(segment)
+        prior[0] = benchmark
+        np.maximum.accumulate(segment[:-1], out=prior[1:])
+        np.maximum(prior, benchmark, out=prior)
+        hits = np.flatnonzero(segment <= prior * factor)
+        if hits.size == 0:
+            benchmark = max(prior[-1], segment[-1])
+            position = end
+            window *= 2
+            continue
+        hit = hits[0]
+        indices.append(position + hit)
+        benchmarks.append(prior[hit])
+        benchmark = segment[hit]
+        position += hit + 1
+        window = max(INITIAL_WINDOW, 4 * (hit + 1))
+    return np.array(indices, dtype=np.intp), np.array(benchmarks)
+
+def _stepped_triggers(prices, alert_type, threshold_percent, target_price):
+    """Feeds the prices one tick at a time through an AlertBook; exact for any threshold."""
+    alert = (0, 0, alert_type, threshold_percent, target_price, 1, None, None)
+    book = AlertBook([(alert, (0, "", None, 0, 0, ""))])
+    indices, benchmarks = [], []
+    for i, price in enumerate(prices):
+        result = book.evaluate({"": float(price)})
+        if result.triggers:
+            indices.append(i)
+            benchmarks.append(result.triggers[0].benchmark_price)
+    return np.array(indices, dtype=np.intp), np.array(benchmarks)
+
+def find_triggers(prices, alert_type, threshold_percent=None, target_price=None):
+    """
+    Returns where an alert would have triggered on a price series.
+
+    Args:
+        prices (numpy.ndarray): Prices in time order.
+        alert_type (str): One of the four alert types.
+        threshold_percent (float, optional): For the percentage alert types.
+        target_price (float, optional): For the target alert types.
+
+    Returns:
+        tuple: (indices of the triggering ticks, benchmark price reported for each)
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    if alert_type in TARGET_ALERTS:
+        if target_price is None:
+            return np.array([], dtype=np.intp), np.array([])
+        crossed = prices >= target_price if alert_type == "Price Rises Above" else prices <= target_price
+        # Target alerts deactivate after firing once
+        first = np.flatnonzero(crossed)[:1]
+        return first, np.full(len(first), float(target_price))
+
+    if threshold_percent is None:
+        return np.array([], dtype=np.intp), np.array([])
+    if threshold_percent <= 0 or not np.all(prices > 0):
+        # The running-extreme shortcut assumes a positive threshold and positive prices
+        return _stepped_triggers(prices, alert_type, threshold_percent, target_price)
+    if alert_type == DROP_ALERT:
+        return _running_extreme_triggers(prices, 1 - threshold_percent / 100)
+    if alert_type == RISE_ALERT:
+        # A rise from the running minimum is a drop of the negated series from its running maximum
+        indices, benchmarks = _running_extreme_triggers(-prices, 1 + threshold_percent / 100)
+        return indices, -benchmarks
+    raise ValueError(f"Unknown alert type: {alert_type}")
+
+# --- Backtest ---
+
+class BacktestResult:
+    """The triggers of a backtest run, with per-alert summaries."""
+
+    def __init__(self, triggers, tick_counts, elapsed):
+        self.triggers = triggers
+        self.tick_counts = tick_counts  # ticker -> number of ticks replayed
+        self.elapsed = elapsed
+
+    def counts(self):
+        """Returns {alert: number of triggers}."""
+        counts = {}
+        for trigger in self.triggers:
+            counts[trigger.alert] = counts.get(trigger.alert, 0) + 1
+        return counts
+
+    def summary(self, alerts):
+        """Returns one dict per alert with its trigger count and first and last trigger times."""
+        by_alert = {}
+        for trigger in self.triggers:
+            by_alert.setdefault(trigger.alert, []).append(trigger)
+        rows = []
+        for alert in alerts:
+            fired = by_alert.get(alert, [])
+            rows.append({
+                "ticker": alert.ticker,
+                "alert_type": alert.alert_type,
+                "threshold_percent": alert.threshold_percent,
+                "target_price": alert.target_price,
+                "ticks": self.tick_counts.get(alert.ticker, 0),
+                "triggers": len(fired),
+                "first_trigger": str(fired[0].timestamp) if fired else None,
+                "last_trigger": str(fired[-1].timestamp) if fired else None,
+            })
+        return rows
+
+def run_backtest(bars, alerts, intrabar=False):
+    """
+    Replays historical bars through the alert state machine, entirely in memory.
+
+    Every alert starts fresh (no state) at its ticker's first tick, exactly as a newly
+    created alert would, and nothing is written to the database.
+
+    Args:
+        bars (dict): Maps tickers to pandas DataFrames of bars (see bar_prices). Trigger
+            timestamps of time zone aware bars are reported in UTC.
+        alerts (list): BacktestAlert tuples.
+        intrabar (bool): See bar_prices.
+
+    Returns:
+        BacktestResult
+    """
+    started = time.perf_counter()
+    ticks = {}
+    triggers = []
+    for alert in alerts:
+        if alert.ticker not in bars:
+            continue
+        if alert.ticker not in ticks:
+            ticks[alert.ticker] = bar_prices(bars[alert.ticker], intrabar)
+        timestamps, prices = ticks[alert.ticker]
+        indices, benchmarks = find_triggers(prices, alert.alert_type, alert.threshold_percent, alert.target_price)
+        triggers += [BacktestTrigger(alert, timestamps[i], float(prices[i]), float(b)) for i, b in zip(indices, benchmarks)]
+    triggers.sort(key=lambda trigger: trigger.timestamp)
+    return BacktestResult(triggers, {ticker: len(prices) for ticker, (_, prices) in ticks.items()}, time.perf_counter() - started)
+
+def sweep_thresholds(bars, alert_type, thresholds, intrabar=False):
+    """
+    Backtests one alert type at several thresholds on every ticker.
+
+    Returns:
+        BacktestResult: For all (ticker, threshold) combinations.
+    """
+    alerts = [BacktestAlert(ticker, alert_type, float(threshold), None) for ticker in bars for threshold in thresholds]
+    return run_backtest(bars, alerts, intrabar)
+
+# --- Data Loading ---
+
+def load_csv(path):
+    """
+    Loads bars from a CSV in long format.
+
+    The file needs 'timestamp' and 'ticker' columns and either 'close' or 'price'; 'open',
+    'high' and 'low' are used for intrabar runs. This is also the replay file format.
+
+    Returns:
+        dict: Maps tickers to DataFrames indexed by timestamp.
+    """
+    import pandas as pd
+    frame = pd.read_csv(path)
+    frame.columns = [column.lower() for column in frame.columns]
+    frame["timestamp"] = pd.to_datetime(frame["timestamp"], utc=True)
+    return {str(ticker): group.set_index("timestamp").sort_index() for ticker, group in frame.groupby("ticker")}
+
+def download(tickers, period="1mo", interval="1m"):
+    """Downloads bars from Yahoo Finance with yfinance. Returns the same shape as load_csv."""
+    import yfinance_client
+    yf = yfinance_client.load_yfinance()
+    data = yf.download(tickers, period=period, interval=interval, group_by="ticker", progress=False, auto_adjust=False)
+    bars = {}
+    for ticker in tickers:
+        frame = data[ticker] if len(tickers) > 1 else data.droplevel(1, axis=1) if data.columns.nlevels > 1 else data
+        frame = frame.rename(columns=str.lower).dropna(how="all")
+        if not frame.empty:
+            bars[ticker] = frame
+    return bars
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest percentage alerts on historical prices.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--csv", help="Bars in long format (timestamp, ticker, close or price, optional open/high/low)")
+    source.add_argument("--tickers", nargs="+", help="Download bars for these tickers from Yahoo Finance")
+    parser.add_argument("--period", default="1mo", help="yfinance download period (default 1mo)")
+    parser.add_argument("--interval", default="1m", help="yfinance bar interval (default 1m)")
+    parser.add_argument("--type", choices=["drop", "rise"], default="drop", help="Alert type to test")
+    parser.add_argument("--thresholds", nargs="+", type=float, default=[1, 2, 3, 5, 10], help="Threshold percentages to sweep")
+    parser.add_argument("--intrabar", action="store_true", help="Include each bar's high and low, not only the close")
+    parser.add_argument("--triggers", action="store_true", help="Also list every trigger")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args(argv)
+
+    bars = load_csv(args.csv) if args.csv else download(args.tickers, args.period, args.interval)
+    alert_type = DROP_ALERT if args.type == "drop" else RISE_ALERT
+    result = sweep_thresholds(bars, alert_type, args.thresholds, args.intrabar)
+    alerts = [BacktestAlert(ticker, alert_type, float(threshold), None) for ticker in bars for threshold in args.thresholds]
+    summary = result.summary(alerts)
+
+    if args.json:
+        output = {"elapsed_seconds": result.elapsed, "summary": summary}
+        if args.triggers:
+            output["triggers"] = [{"ticker": t.alert.ticker, "threshold_percent": t.alert.threshold_percent,
+                                   "timestamp": str(t.timestamp), "price": t.price, "benchmark_price": t.benchmark_price}
+                                  for t in result.triggers]
+        print(json.dumps(output, indent=2))
+        return
+
+    print(f"{alert_type}: {sum(result.tick_counts.values()):,} ticks over {len(bars)} tickers in {result.elapsed:.2f}s")
+    print(f"{'Ticker':<12}{'Threshold':>10}{'Triggers':>10}  First / last trigger")
+    for row in summary:
+        span = f"{row['first_trigger']} / {row['last_trigger']}" if row["triggers"] else "-"
+        print(f"{row['ticker']:<12}{row['threshold_percent']:>9}%{row['triggers']:>10}  {span}")
+    if args.triggers:
+        for t in result.triggers:
+            print(f"{t.timestamp}  {t.alert.ticker:<10} {t.alert.threshold_percent}%  price {t.price:,.2f}  benchmark {t.benchmark_price:,.2f}")
+
+if __name__ == "__main__":
+    main()
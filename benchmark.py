@@ -0,0 +1,313 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# The application modules are imported inside run_portfolio_benchmark, after APPDATA
+# points at a temporary folder, so the user's real database is never touched.
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+# A stock holds at most one alert of each of the four types (add_alert replaces per type)
+ALERTS_PER_STOCK = 4
+# Alert types in the order stocks take them; each stock starts one further along, so
+# every type is equally common whatever the number of alerts per stock
+BENCHMARK_ALERT_TYPES = ("Price Drops From Recent High", "Price Rises From Recent Low", "Price Rises Above", "Price Falls Below")
+# Tickers fetched one by one through the (throttled) chart endpoint
+CHART_SAMPLE = 200
+
+# --- Stand-in Services ---
+
+# Listing fields the stand-in reports for every symbol, as Yahoo does for a US stock
+STAND_IN_LISTING = {"currency": "USD", "fullExchangeName": "NasdaqGS", "exchangeTimezoneName": "America/New_York"}
+
+class StandInServer:
+    """
+    Local HTTP stand-in for the Yahoo chart/quote endpoints and the Pushover/Pushbullet APIs.
+
+    Every response is delayed by `latency` seconds and fails with a 500 with probability
+    `error_rate`. Prices follow a seeded random walk per ticker, so runs are repeatable.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._prices = {}
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.errors = 0
+        self._server = None
+
+    def _next_price(self, ticker):
+        with self._lock:
+            price = self._prices.get(ticker, 100.0) * math.exp(self._random.gauss(0, 0.02))
+            self._prices[ticker] = price
+            return round(price, 4)
+
+    def _should_fail(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            failed = self._random.random() < self.error_rate
+            self.errors += failed
+            return failed
+
+    def start(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, endpoint, body):
+                if stand_in.latency:
+                    time.sleep(stand_in.latency)
+                if stand_in._should_fail(endpoint):
+                    self.send_response(500)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path.startswith("/v8/finance/chart/"):
+                    ticker = url.path.rsplit("/", 1)[1]
+                    meta = {"symbol": ticker, "regularMarketPrice": stand_in._next_price(ticker), "longName": f"{ticker} Corp", **STAND_IN_LISTING}
+                    self._reply("chart", {"chart": {"result": [{"meta": meta}], "error": None}})
+                elif url.path == "/v7/finance/quote":
+                    symbols = parse_qs(url.query).get("symbols", [""])[0].split(",")
+                    result = [{"symbol": s, "regularMarketPrice": stand_in._next_price(s), "longName": f"{s} Corp", **STAND_IN_LISTING} for s in symbols if s]
+                    self._reply("quote", {"quoteResponse": {"result": result, "error": None}})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if self.path == "/1/messages.json":
+                    self._reply("pushover", {"status": 1})
+                elif self.path == "/v2/pushes":
+                    self._reply("pushbullet", {"active": True})
+                else:
+                    self.send_error(404)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+# --- Benchmarks ---
+
+def _timed(results, name, func, count=1):
+    """Runs func once, records how long it took and returns its result."""
+    started = time.perf_counter()
+    value = func()
+    elapsed = time.perf_counter() - started
+    results.append({"name": name, "seconds": round(elapsed, 6), "count": count,
+                    "per_op_ms": round(elapsed * 1000 / count, 4) if count else None})
+    return value
+
+def run_portfolio_benchmark(stocks, alerts_per_stock, latency, error_rate, cycles, seed):
+    """
+    Benchmarks one synthetic portfolio. Expects APPDATA to point at an empty temporary folder.
+
+    Returns:
+        dict: The portfolio size, the timings and the stand-in request counts.
+    """
+    import alerter
+    import database as db
+    import notification_dispatcher
+    import notifier
+    import poll_scheduler
+    import portfolio
+    import price_providers
+    import quote_cache
+    import settings
+    import yfinance_client as yf_client
+
+    server = StandInServer(latency, error_rate, seed).start()
+    yf_client.CHART_URL = server.url + "/v8/finance/chart/{ticker}"
+    yf_client.QUOTE_URL = server.url + "/v7/finance/quote"
+    notifier.PUSHOVER_URL = server.url + "/1/messages.json"
+    notifier.PUSHBULLET_URL = server.url + "/v2/pushes"
+
+    class AlwaysOpenYahoo(price_providers.YahooPriceProvider):
+        # Results must not depend on the time of day the benchmark runs
+        def is_market_open(self, ticker):
+            return True
+
+    quote_cache.use_provider(AlwaysOpenYahoo())
+    rng = random.Random(seed)
+    results = []
+    tickers = [f"SYN{i:05d}" for i in range(stocks)]
+    alerts_per_stock = max(0, min(alerts_per_stock, len(BENCHMARK_ALERT_TYPES)))
+
+    # --- Database ---
+    _timed(results, "db.initialize_database", db.initialize_database)
+    _timed(results, "db.add_stock", lambda: [db.add_stock(t, rng.randint(1, 100), round(rng.uniform(50, 150), 2), "USD") for t in tickers], stocks)
+    stock_ids = [s[0] for s in db.get_all_stocks()]
+    # Every timed fetch must reach the stand-in as fast as it answers, so keep the HTTP
+    # response cache and the Yahoo rate limit out of the way
+    settings.set_many({"http_cache_enabled": False, "yahoo_rate_limit": 0})
+
+    def add_alerts():
+        for position, stock_id in enumerate(stock_ids):
+            for offset in range(alerts_per_stock):
+                alert_type = BENCHMARK_ALERT_TYPES[(position + offset) % len(BENCHMARK_ALERT_TYPES)]
+                if alert_type == "Price Rises Above":
+                    db.add_alert(stock_id, alert_type, target_price=round(rng.uniform(100, 140), 2))
+                elif alert_type == "Price Falls Below":
+                    db.add_alert(stock_id, alert_type, target_price=round(rng.uniform(60, 100), 2))
+                else:
+                    db.add_alert(stock_id, alert_type, threshold_percent=rng.choice([1, 2, 5]))
+    _timed(results, "db.add_alert", add_alerts, len(stock_ids) * alerts_per_stock)
+    # Count what is actually stored, so per-alert timings divide by real rows
+    alert_count = len(db.get_active_alerts_with_stocks())
+
+    _timed(results, "db.get_all_stocks", db.get_all_stocks)
+    _timed(results, "db.get_all_stocks_with_alerts", db.get_all_stocks_with_alerts)
+    _timed(results, "db.get_all_alerts", db.get_all_alerts)
+    active = _timed(results, "db.get_active_alerts_with_stocks", db.get_active_alerts_with_stocks)
+    sample = tickers[:1000]
+    _timed(results, "db.get_stock_by_ticker", lambda: [db.get_stock_by_ticker(t) for t in sample], len(sample))
+    _timed(results, "db.get_alert_with_stock", lambda: [db.get_alert_with_stock(a[0]) for a, _ in active[:1000]], min(1000, len(active)))
+    _timed(results, "db.get_setting", lambda: [db.get_setting("dashboard_refresh_interval") for _ in range(1000)], 1000)
+    _timed(results, "db.save_setting", lambda: [db.save_setting("benchmark", str(i)) for i in range(100)], 100)
+    _timed(results, "settings.get", lambda: [settings.get("dashboard_refresh_interval") for _ in range(1000)], 1000)
+    _timed(results, "settings.set", lambda: [settings.set("benchmark", i) for i in range(100)], 100)
+    states = [(a[0], "watching_for_peak", 100.0, a[7], a[6]) for a, _ in active]
+    _timed(results, "db.update_alert_states", lambda: db.update_alert_states(states), len(states))
+    _timed(results, "db.update_alert_state", lambda: [db.update_alert_state(a[0], None, None) for a, _ in active[:100]], min(100, len(active)))
+
+    # --- Price Fetching ---
+    fetched = _timed(results, "yfinance_client.get_current_prices[batch]", lambda: yf_client.get_current_prices(tickers), stocks)
+    chart_tickers = tickers[:CHART_SAMPLE]
+    _timed(results, "yfinance_client.get_current_prices[chart]", lambda: yf_client.get_current_prices(chart_tickers, batch=False), len(chart_tickers))
+    quote_cache.shared_cache.invalidate()
+    _timed(results, "quote_cache.get_current_prices[cold]", lambda: quote_cache.get_current_prices(tickers), stocks)
+    _timed(results, "quote_cache.get_current_prices[warm]", lambda: quote_cache.get_current_prices(tickers), stocks)
+
+    # --- Alert Cycles ---
+    settings.set_many({"notification_service": "Pushover", "pushover_user_key": "benchmark", "pushover_api_token": "benchmark"})
+    notification_dispatcher.dispatcher.start()
+    scheduler = poll_scheduler.PollScheduler(min_interval=0, max_interval=0)
+    triggered = 0
+    for cycle in range(cycles):
+        # Every ticker is due every cycle and no quote is served from cache
+        quote_cache.shared_cache.invalidate()
+        # Target alerts that fired are deactivated, so count the active ones per cycle
+        active_count = len(db.get_active_alerts_with_stocks())
+        polled, evaluated, fired = _timed(results, f"alerter.run_alert_cycle[{cycle + 1}]", lambda: alerter.run_alert_cycle(scheduler), active_count)
+        triggered += fired
+    _timed(results, "alerter.flush_alert_states", alerter.flush_alert_states)
+    # Time until every notification due so far has been sent or scheduled for a retry
+    _timed(results, "notification_dispatcher.drain", lambda: notification_dispatcher.dispatcher.wait_idle(timeout=300), triggered)
+
+    # --- Dashboard ---
+    quote_cache.shared_cache.invalidate()
+    _timed(results, "portfolio.build_dashboard_snapshot[cold]", lambda: portfolio.build_dashboard_snapshot(300), stocks)
+    _timed(results, "portfolio.build_dashboard_snapshot[warm]", lambda: portfolio.build_dashboard_snapshot(300, max_age=float("inf")), stocks)
+
+    # --- Deletes ---
+    alert_ids = [a[0] for a, _ in db.get_active_alerts_with_stocks()][:100]
+    _timed(results, "db.delete_alert", lambda: [db.delete_alert(alert_id) for alert_id in alert_ids], len(alert_ids))
+    _timed(results, "db.delete_stock", lambda: [db.delete_stock(stock_id) for stock_id in stock_ids[:10]], min(10, stocks))
+
+    notification_dispatcher.dispatcher.stop()
+    outbox = db.get_notification_counts()
+    db.shutdown()
+    server.stop()
+    return {
+        "stocks": stocks,
+        "alerts": alert_count,
+        "prices_fetched": len(fetched),
+        "alerts_triggered": triggered,
+        "notification_outbox": outbox,
+        "results": results,
+        "stand_in": {"requests": server.requests, "errors": server.errors},
+    }
+
+def _run_isolated(stocks, args):
+    """Runs one portfolio size in a child process with its own temporary APPDATA."""
+    with tempfile.TemporaryDirectory(prefix="stockalert-bench-") as appdata, \
+            tempfile.NamedTemporaryFile("r", suffix=".json", delete=False) as output:
+        env = dict(os.environ, APPDATA=appdata)
+        command = [sys.executable, os.path.abspath(__file__), "--worker", str(stocks), "--worker-output", output.name,
+                   "--alerts-per-stock", str(args.alerts_per_stock), "--latency", str(args.latency),
+                   "--error-rate", str(args.error_rate), "--cycles", str(args.cycles), "--seed", str(args.seed)]
+        completed = subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        try:
+            if completed.returncode != 0:
+                return {"stocks": stocks, "error": completed.stderr.strip().splitlines()[-1:] or ["failed"]}
+            return json.load(output)
+        finally:
+            os.unlink(output.name)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark StockAlert against local stand-ins for Yahoo and the push services.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(DEFAULT_SIZES), help="Portfolio sizes in stocks")
+    parser.add_argument("--alerts-per-stock", type=int, default=ALERTS_PER_STOCK, help="Alerts per stock, one per type (at most 4)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every stand-in response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of stand-in responses that fail with a 500")
+    parser.add_argument("--cycles", type=int, default=3, help="Alert check cycles to time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-output", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker is not None:
+        run = run_portfolio_benchmark(args.worker, args.alerts_per_stock, args.latency, args.error_rate, args.cycles, args.seed)
+        with open(args.worker_output, "w") as f:
+            json.dump(run, f)
+        return
+
+    report = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "alerts_per_stock": min(args.alerts_per_stock, len(BENCHMARK_ALERT_TYPES)),
+            "latency": args.latency,
+            "error_rate": args.error_rate,
+            "cycles": args.cycles,
+            "seed": args.seed,
+        },
+        "runs": [],
+    }
+    for stocks in args.sizes:
+        print(f"Benchmarking {stocks} stocks...", file=sys.stderr)
+        report["runs"].append(_run_isolated(stocks, args))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
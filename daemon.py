@@ -0,0 +1,79 @@
+import argparse
+import logging
+import signal
+import threading
+import alerter
+import database as db
+import logging_setup
+import metrics
+import notification_dispatcher
+import price_history
+import quote_cache
+import settings
+
+# Headless entry point: runs the alerter and notifications without the GUI.
+# Nothing here may import customtkinter, tkinter, pystray or PIL, directly or through
+# another module, so it runs on a server without a display.
+
+logger = logging.getLogger(__name__)
+
+# Seconds each component gets to finish its current work on shutdown
+SHUTDOWN_TIMEOUT = 30
+
+_stop_event = threading.Event()
+
+def _on_stop_signal(signum, frame):
+    logger.info("Received %s, shutting down.", signal.Signals(signum).name)
+    _stop_event.set()
+
+def _on_reload_signal(signum, frame):
+    # Settings changed by another process (e.g. the GUI on the same database) apply now
+    logger.info("Received %s, reloading settings.", signal.Signals(signum).name)
+    threading.Thread(target=settings.reload, name="settings-reload", daemon=True).start()
+
+def start(engine=None):
+    """
+    Initializes the database and logging and starts the alerter and notification workers.
+
+    Args:
+        engine (str, optional): "threaded" or "asyncio". Defaults to the alerter_engine setting.
+    """
+    logging_setup.configure()
+    db.initialize_database()
+    logging_setup.configure_from_settings()
+    quote_cache.use_provider()
+    metrics.start_exporters()
+    # There is no window to show alerts in; mobile notifications still go out
+    alerter.ui_alerts_enabled = False
+    alerter.start_alerter_thread(engine)
+    logger.info("StockAlert daemon started (provider: %s).", quote_cache.get_provider().name)
+
+def shutdown(timeout=SHUTDOWN_TIMEOUT):
+    """Stops every component in dependency order, writing out what each has buffered."""
+    if not alerter.stop_alerter_thread(timeout):
+        logger.warning("The alerter did not finish its cycle within %ss.", timeout)
+    notification_dispatcher.dispatcher.stop(timeout)
+    price_history.stop()
+    metrics.stop_exporters()
+    logger.info("StockAlert daemon stopped.")
+    db.shutdown()
+    logging_setup.shutdown()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the StockAlert alerter without the GUI.")
+    parser.add_argument("--engine", choices=("threaded", "asyncio"), help="Alerter engine (default: the alerter_engine setting)")
+    args = parser.parse_args(argv)
+
+    signal.signal(signal.SIGINT, _on_stop_signal)
+    signal.signal(signal.SIGTERM, _on_stop_signal)
+    if hasattr(signal, "SIGHUP"):  # Not on Windows
+        signal.signal(signal.SIGHUP, _on_reload_signal)
+
+    start(args.engine)
+    # Wake up now and then so signals are handled promptly on every platform
+    while not _stop_event.wait(1):
+        pass
+    shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,236 @@
 import sqlite3
 import os
+import threading
+import queue
+import functools
+import logging
+import time
+from concurrent.futures import Future
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_db_path = None
+_local = threading.local()
+
+QUERY_SECONDS = metrics.registry.histogram("stockalert_db_query_seconds", "Time spent in database reads.", ("operation",))
+WRITE_SECONDS = metrics.registry.histogram("stockalert_db_write_seconds", "Time from submitting a write until it is committed, including queueing.", ("operation",))
+COMMIT_SECONDS = metrics.registry.histogram("stockalert_db_commit_seconds", "Time spent in COMMIT on the writer thread.")
+WRITE_BATCH_SIZE = metrics.registry.histogram("stockalert_db_write_batch_size", "Writes grouped into one transaction.", buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
 
 def get_db_path():
     """Returns the absolute path to the database file in the user's AppData folder."""
-    app_data_path = os.getenv('APPDATA')
-    if not app_data_path:
-        # Fallback for environments where APPDATA is not set
-        app_data_path = os.path.expanduser('~')
-    
-    db_dir = os.path.join(app_data_path, 'StockAlert')
-    os.makedirs(db_dir, exist_ok=True)
-    return os.path.join(db_dir, 'portfolio.db')
+    global _db_path
+    if _db_path is None:
+        app_data_path = os.getenv('APPDATA')
+        if not app_data_path:
+            # Fallback for environments where APPDATA is not set
+            app_data_path = os.path.expanduser('~')
+
+        db_dir = os.path.join(app_data_path, 'StockAlert')
+        os.makedirs(db_dir, exist_ok=True)
+        _db_path = os.path.join(db_dir, 'portfolio.db')
+    return _db_path
+
+def _open_connection():
+    """Opens a new connection with WAL journaling and tuned pragmas."""
+    # Autocommit mode: the writer thread manages its transactions explicitly,
+    # and readers never keep a transaction open between queries.
+    conn = sqlite3.connect(get_db_path(), timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")   # Safe with WAL, avoids an fsync per commit
+    conn.execute("PRAGMA cache_size=-16000")    # 16 MB page cache per connection
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
 
 def get_connection():
-    """Establishes and returns a database connection."""
-    return sqlite3.connect(get_db_path())
+    """Returns this thread's long-lived database connection, opening it on first use."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _open_connection()
+        _local.conn = conn
+    return conn
+
+def close_connection():
+    """Closes this thread's connection, if it has one."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+# --- Writer Thread ---
+
+class _DatabaseWriter:
+    """
+    Runs every write on one dedicated thread with its own connection.
+
+    Callers block until their write is committed and get its return value back.
+    Writes queued while a transaction is running are grouped into the next
+    transaction, each inside its own savepoint so one failure does not roll
+    back the others.
+    """
 
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        """Starts the writer thread if needed. Raises the error if it cannot open its connection."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                started = Future()
+                self._thread = threading.Thread(target=self._run, args=(started,), name="db-writer", daemon=True)
+                self._thread.start()
+                try:
+                    started.result()
+                except BaseException:
+                    # The thread has exited; the next write tries again
+                    self._thread = None
+                    raise
+
+    def submit(self, func, *args, **kwargs):
+        """Runs func(*args, **kwargs) on the writer thread and returns its result."""
+        if threading.current_thread() is self._thread:
+            # Nested write from inside another write; it joins the running transaction
+            return func(*args, **kwargs)
+        self._ensure_started()
+        future = Future()
+        self._queue.put((future, func, args, kwargs))
+        return future.result()
+
+    def shutdown(self):
+        """Finishes the queued writes and stops the writer thread."""
+        with self._lock:
+            thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+
+    def _run(self, started):
+        try:
+            conn = get_connection()
+        except BaseException as e:
+            started.set_exception(e)
+            return
+        started.set_result(None)
+        while True:
+            batch = [self._queue.get()]
+            # Drain whatever else is already waiting into the same transaction
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in batch
+            batch = [item for item in batch if item is not None]
+            if batch:
+                try:
+                    self._run_batch(conn, batch)
+                except sqlite3.Error as e:
+                    # Never leave a caller waiting forever if the transaction itself broke
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                    for future, _, _, _ in batch:
+                        if not future.done():
+                            future.set_exception(e)
+            if stop:
+                close_connection()
+                return
+
+    def _run_batch(self, conn, batch):
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.Error as e:
+            for future, _, _, _ in batch:
+                future.set_exception(e)
+            return
+
+        for future, func, args, kwargs in batch:
+            conn.execute("SAVEPOINT write_item")
+            try:
+                result = func(*args, **kwargs)
+                conn.execute("RELEASE write_item")
+                results.append((future, result, None))
+            except BaseException as e:
+                conn.execute("ROLLBACK TO write_item")
+                conn.execute("RELEASE write_item")
+                results.append((future, None, e))
+
+        WRITE_BATCH_SIZE.observe(len(batch))
+        try:
+            with COMMIT_SECONDS.time():
+                conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            conn.execute("ROLLBACK")
+            results = [(future, None, e) for future, _, _ in results]
+
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+_writer = _DatabaseWriter()
+
+def write_transaction(func):
+    """Decorator that runs a write function on the writer thread inside a transaction."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return _writer.submit(func, *args, **kwargs)
+        finally:
+            WRITE_SECONDS.observe(time.perf_counter() - started, operation=func.__name__)
+    return wrapper
+
+def read_query(func):
+    """Decorator that records how long a read function takes."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            QUERY_SECONDS.observe(time.perf_counter() - started, operation=func.__name__)
+    return wrapper
+
+def shutdown():
+    """Flushes pending writes, stops the writer thread and closes this thread's connection."""
+    _writer.shutdown()
+    close_connection()
+
+# --- Change Listeners ---
+
+_alert_listeners = []
+
+def add_alert_listener(callback):
+    """
+    Registers a callback for committed alert changes.
+
+    The callback is called as callback(event, object_id) on the thread that made the
+    change, where event is "saved" (alert added, replaced or status changed),
+    "deleted" (alert removed) or "stock_deleted" (a stock and all its alerts removed).
+    """
+    if callback not in _alert_listeners:
+        _alert_listeners.append(callback)
+
+def remove_alert_listener(callback):
+    """Unregisters a callback added with add_alert_listener."""
+    if callback in _alert_listeners:
+        _alert_listeners.remove(callback)
+
+def _notify_alert_listeners(event, object_id):
+    for callback in list(_alert_listeners):
+        try:
+            callback(event, object_id)
+        except Exception as e:
+            logger.exception("Error in alert listener for %s %s: %s", event, object_id, e)
+
+@write_transaction
 def initialize_database():
     """
     Initializes the database and creates the necessary tables if they don't exist.
@@ -40,14 +255,14 @@ def initialize_database():
     try:
         cursor.execute("SELECT currency FROM stocks LIMIT 1")
     except sqlite3.OperationalError:
-        print("Migrating database: Adding 'currency' column to stocks table.")
+        logger.info("Migrating database: Adding 'currency' column to stocks table.")
         cursor.execute("ALTER TABLE stocks ADD COLUMN currency TEXT")
 
     # Add full_name column to stocks table if it doesn't exist
     try:
         cursor.execute("SELECT full_name FROM stocks LIMIT 1")
     except sqlite3.OperationalError:
-        print("Migrating database: Adding 'full_name' column to stocks table.")
+        logger.info("Migrating database: Adding 'full_name' column to stocks table.")
         cursor.execute("ALTER TABLE stocks ADD COLUMN full_name TEXT")
 
 
@@ -71,9 +286,43 @@ def initialize_database():
     try:
         cursor.execute("SELECT target_price FROM alerts LIMIT 1")
     except sqlite3.OperationalError:
-        print("Migrating database: Adding 'target_price' column to alerts table.")
+        logger.info("Migrating database: Adding 'target_price' column to alerts table.")
         cursor.execute("ALTER TABLE alerts ADD COLUMN target_price REAL")
 
+    # Index used by the per-stock alert lookups and joins
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_alerts_stock_id ON alerts (stock_id)")
+
+    # Create notification outbox table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id INTEGER PRIMARY KEY,
+            service TEXT NOT NULL,
+            title TEXT,
+            message TEXT,
+            status TEXT NOT NULL DEFAULT 'pending', -- pending, sending, sent or failed
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            created_at REAL NOT NULL,
+            sent_at REAL,
+            last_error TEXT
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON notification_outbox (status, next_attempt_at)")
+    # Notifications claimed by a worker when the app last stopped never finished; send them again
+    cursor.execute("UPDATE notification_outbox SET status = 'pending' WHERE status = 'sending'")
+
+    # Create ticker metadata table, filled from the quotes the app fetches anyway
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ticker_metadata (
+            ticker TEXT PRIMARY KEY,
+            long_name TEXT,
+            exchange TEXT,
+            currency TEXT,
+            timezone TEXT,
+            last_verified REAL NOT NULL
+        )
+    """)
+
     # Create settings table (key-value store)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS settings (
@@ -82,19 +331,32 @@ def initialize_database():
         )
     """)
 
-    conn.commit()
-    conn.close()
-
     # Set default dashboard refresh interval if not already set
-    conn = get_connection()
-    cursor = conn.cursor()
     cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("dashboard_refresh_interval", "300")) # Default to 5 minutes (300 seconds)
     cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("minimize_to_tray", "True")) # Default to minimize to tray
-    conn.commit()
-    conn.close()
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("poll_min_interval", "15")) # Fastest per-ticker alert polling
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("poll_max_interval", "300")) # Slowest per-ticker alert polling
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("alerter_engine", "threaded")) # "threaded" or "asyncio"
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("price_provider", "yahoo")) # "yahoo", "replay" or "scripted"
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("replay_speed", "1.0")) # Replay seconds per real second; 0 steps one tick timestamp per alerter cycle
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("metrics_port", "0")) # Prometheus endpoint on 127.0.0.1; 0 = off
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("metrics_snapshot_interval", "60")) # Seconds between metrics.json snapshots; 0 = off
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("log_level", "INFO")) # TRACE adds per-alert evaluation lines
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("log_trace_sample_rate", "1.0")) # Fraction of TRACE lines kept
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("price_history_enabled", "True")) # Record fetched prices under history/
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("history_tick_retention_days", "7")) # Raw ticks, then rolled up into minute bars; 0 = keep
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("history_minute_retention_days", "90")) # Minute bars, then hour bars; 0 = keep
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("history_hour_retention_days", "730")) # Hour bars, then day bars (kept forever); 0 = keep
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("http_cache_enabled", "True")) # Cache Yahoo chart/quote responses in http_cache.sqlite
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("http_cache_chart_ttl", "15")) # Seconds a chart response is fresh
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("http_cache_quote_ttl", "15")) # Seconds a batch quote response is fresh
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("http_cache_stale_seconds", "30")) # Serve expired responses this long while refreshing in the background
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("yahoo_rate_limit", "5")) # Requests per second to each Yahoo host, shared by all workers (0 = unlimited)
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("yahoo_rate_burst", "10")) # Requests that may go out at once after an idle period
 
 # --- Stock Functions ---
 
+@write_transaction
 def add_stock(ticker, shares, purchase_price, currency):
     """Adds a new stock or merges it with an existing one."""
     conn = get_connection()
@@ -108,7 +370,6 @@ def add_stock(ticker, shares, purchase_price, currency):
         existing_shares, existing_price, existing_currency = existing_stock
 
         if existing_currency != currency:
-            conn.close()
             return "currency_mismatch"
 
         if shares > 0 and purchase_price > 0:
@@ -127,40 +388,82 @@ def add_stock(ticker, shares, purchase_price, currency):
                        (ticker, shares, purchase_price, currency))
         status = "added"
 
-    conn.commit()
-    conn.close()
     return status
 
+@write_transaction
 def update_stock_name(ticker, full_name):
     """Updates the full name of a stock."""
     conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("UPDATE stocks SET full_name = ? WHERE ticker = ?", (full_name, ticker))
-    conn.commit()
-    conn.close()
 
+@read_query
 def get_all_stocks():
     """Retrieves all stocks from the database."""
     conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id, ticker, full_name, shares, purchase_price, currency FROM stocks ORDER BY ticker")
     stocks = cursor.fetchall()
-    conn.close()
     return stocks
 
 def delete_stock(stock_id):
     """Deletes a stock and its associated alerts."""
+    _delete_stock(stock_id)
+    _notify_alert_listeners("stock_deleted", stock_id)
+
+@write_transaction
+def _delete_stock(stock_id):
     conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("DELETE FROM alerts WHERE stock_id = ?", (stock_id,))
     cursor.execute("DELETE FROM stocks WHERE id = ?", (stock_id,))
-    conn.commit()
-    conn.close()
+
+@read_query
+def get_stock_by_ticker(ticker):
+    """Retrieves a single stock by its ticker."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, ticker, full_name, shares, purchase_price, currency FROM stocks WHERE ticker = ?", (ticker,))
+    stock = cursor.fetchone()
+    return stock
+
+@read_query
+def get_all_stocks_with_alerts():
+    """
+    Retrieves every stock together with all of its alerts in a single query.
+
+    Returns:
+        list: (stock, alerts) pairs ordered by ticker. Stock rows match get_all_stocks()
+            and alert rows match get_stock_alerts().
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT s.id, s.ticker, s.full_name, s.shares, s.purchase_price, s.currency,
+               a.id, a.alert_type, a.threshold_percent, a.target_price, a.is_active, a.last_benchmark_price, a.current_state
+        FROM stocks s
+        LEFT JOIN alerts a ON a.stock_id = s.id
+        ORDER BY s.ticker, a.id
+    """)
+    stocks_with_alerts = []
+    for row in cursor.fetchall():
+        stock, alert = row[:6], row[6:]
+        if not stocks_with_alerts or stocks_with_alerts[-1][0][0] != stock[0]:
+            stocks_with_alerts.append((stock, []))
+        if alert[0] is not None:
+            stocks_with_alerts[-1][1].append(alert)
+    return stocks_with_alerts
 
 # --- Alert Functions ---
 
 def add_alert(stock_id, alert_type, threshold_percent=None, target_price=None):
     """Adds or replaces an alert for a stock and returns its ID."""
+    alert_id = _add_alert(stock_id, alert_type, threshold_percent, target_price)
+    _notify_alert_listeners("saved", alert_id)
+    return alert_id
+
+@write_transaction
+def _add_alert(stock_id, alert_type, threshold_percent, target_price):
     conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("""
@@ -172,35 +475,40 @@ def add_alert(stock_id, alert_type, threshold_percent=None, target_price=None):
     cursor.execute("SELECT id FROM alerts WHERE stock_id = ? AND alert_type = ?", (stock_id, alert_type))
     alert_id = cursor.fetchone()[0]
     
-    conn.commit()
-    conn.close()
     return alert_id
 
+@read_query
 def get_stock_alerts(stock_id):
     """Retrieves all alerts for a specific stock."""
     conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id, alert_type, threshold_percent, target_price, is_active, last_benchmark_price, current_state FROM alerts WHERE stock_id = ?", (stock_id,))
     alerts = cursor.fetchall()
-    conn.close()
     return alerts
 
 def update_alert_status(alert_id, is_active):
     """Updates the active status of an alert."""
+    _update_alert_status(alert_id, is_active)
+    _notify_alert_listeners("saved", alert_id)
+
+@write_transaction
+def _update_alert_status(alert_id, is_active):
     conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("UPDATE alerts SET is_active = ? WHERE id = ?", (1 if is_active else 0, alert_id))
-    conn.commit()
-    conn.close()
 
 def delete_alert(alert_id):
     """Deletes an alert."""
+    _delete_alert(alert_id)
+    _notify_alert_listeners("deleted", alert_id)
+
+@write_transaction
+def _delete_alert(alert_id):
     conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("DELETE FROM alerts WHERE id = ?", (alert_id,))
-    conn.commit()
-    conn.close()
 
+@read_query
 def get_stock_by_id(stock_id):
     """Retrieves a single stock by its ID."""
     conn = get_connection()
@@ -208,46 +516,259 @@ def get_stock_by_id(stock_id):
     # Select all columns explicitly to ensure order
     cursor.execute("SELECT id, ticker, full_name, shares, purchase_price, currency FROM stocks WHERE id = ?", (stock_id,))
     stock = cursor.fetchone()
-    conn.close()
     return stock
 
+@read_query
 def get_all_alerts():
     """Retrieves all active alerts from the database."""
     conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM alerts WHERE is_active = 1")
     alerts = cursor.fetchall()
-    conn.close()
     return alerts
 
+_ALERT_WITH_STOCK_QUERY = """
+    SELECT a.id, a.stock_id, a.alert_type, a.threshold_percent, a.target_price, a.is_active, a.last_benchmark_price, a.current_state,
+           s.id, s.ticker, s.full_name, s.shares, s.purchase_price, s.currency
+    FROM alerts a
+    JOIN stocks s ON s.id = a.stock_id
+"""
+
+@read_query
+def get_alert_with_stock(alert_id):
+    """Retrieves a single alert, active or not, joined with its stock as an (alert, stock) pair."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(_ALERT_WITH_STOCK_QUERY + " WHERE a.id = ?", (alert_id,))
+    row = cursor.fetchone()
+    return (row[:8], row[8:]) if row else None
+
+@read_query
+def get_active_alerts_with_stocks(ticker=None, alert_types=None):
+    """
+    Retrieves all active alerts joined with their stock in a single query.
+
+    Args:
+        ticker (str, optional): Only return alerts for this ticker.
+        alert_types (list, optional): Only return alerts of these types.
+
+    Returns:
+        list: (alert, stock) pairs. Alert rows match get_all_alerts() and stock rows
+            match get_stock_by_id().
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    query = _ALERT_WITH_STOCK_QUERY + " WHERE a.is_active = 1"
+    params = []
+    if ticker is not None:
+        query += " AND s.ticker = ?"
+        params.append(ticker)
+    if alert_types is not None:
+        query += f" AND a.alert_type IN ({', '.join('?' for _ in alert_types)})"
+        params.extend(alert_types)
+    cursor.execute(query + " ORDER BY a.id", params)
+    return [(row[:8], row[8:]) for row in cursor.fetchall()]
+
+@write_transaction
 def update_alert_state(alert_id, current_state, last_benchmark_price):
     """Updates the state and benchmark price of an alert."""
     conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("UPDATE alerts SET current_state = ?, last_benchmark_price = ? WHERE id = ?", 
                    (current_state, last_benchmark_price, alert_id))
-    conn.commit()
-    conn.close()
+
+@write_transaction
+def update_alert_states(states):
+    """
+    Updates the state and benchmark price of many alerts in one transaction.
+
+    A row is only updated if it still holds the expected state and benchmark, so a
+    state computed before the alert was replaced, reset or deleted is dropped.
+
+    Args:
+        states (list): (alert_id, current_state, last_benchmark_price, expected_state,
+            expected_benchmark) tuples.
+
+    Returns:
+        int: The number of rows updated.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.executemany("""
+        UPDATE alerts SET current_state = ?, last_benchmark_price = ?
+        WHERE id = ? AND current_state IS ? AND last_benchmark_price IS ?
+    """, [(current_state, last_benchmark_price, alert_id, expected_state, expected_benchmark)
+          for alert_id, current_state, last_benchmark_price, expected_state, expected_benchmark in states])
+    return cursor.rowcount
+
+# --- Notification Outbox Functions ---
+
+@write_transaction
+def enqueue_notification(service, title, message):
+    """Adds a notification to the outbox and returns its ID."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    now = time.time()
+    cursor.execute("INSERT INTO notification_outbox (service, title, message, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                   (service, title, message, now, now))
+    return cursor.lastrowid
+
+@write_transaction
+def claim_notifications(limit):
+    """
+    Marks up to `limit` due notifications as 'sending' and returns them.
+
+    Claims run on the writer thread, so two workers never claim the same row.
+
+    Returns:
+        list: (id, service, title, message, attempts) tuples, oldest first.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id, service, title, message, attempts FROM notification_outbox
+        WHERE status = 'pending' AND next_attempt_at <= ?
+        ORDER BY next_attempt_at, id LIMIT ?
+    """, (time.time(), limit))
+    rows = cursor.fetchall()
+    cursor.executemany("UPDATE notification_outbox SET status = 'sending', attempts = attempts + 1 WHERE id = ?",
+                       [(row[0],) for row in rows])
+    return rows
+
+@write_transaction
+def mark_notification_sent(notification_id):
+    """Records a successful delivery."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE notification_outbox SET status = 'sent', sent_at = ?, last_error = NULL WHERE id = ?",
+                   (time.time(), notification_id))
+
+@write_transaction
+def mark_notification_retry(notification_id, next_attempt_at, error):
+    """Puts a notification back in the queue for another attempt at `next_attempt_at`."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE notification_outbox SET status = 'pending', next_attempt_at = ?, last_error = ? WHERE id = ?",
+                   (next_attempt_at, error, notification_id))
+
+@write_transaction
+def mark_notification_failed(notification_id, error):
+    """Gives up on a notification."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE notification_outbox SET status = 'failed', last_error = ? WHERE id = ?", (error, notification_id))
+
+@write_transaction
+def reschedule_notifications():
+    """Makes every pending notification due now, e.g. after the credentials changed."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE notification_outbox SET next_attempt_at = ? WHERE status = 'pending'", (time.time(),))
+
+@write_transaction
+def prune_notifications(older_than):
+    """Deletes sent and failed notifications created before the `older_than` timestamp."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM notification_outbox WHERE status IN ('sent', 'failed') AND created_at < ?", (older_than,))
+
+@read_query
+def get_notification_counts():
+    """Returns a dict mapping each outbox status to its number of notifications."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT status, COUNT(*) FROM notification_outbox GROUP BY status")
+    return dict(cursor.fetchall())
+
+@read_query
+def count_due_notifications():
+    """Returns how many notifications are due now or being sent."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT COUNT(*) FROM notification_outbox
+        WHERE status = 'sending' OR (status = 'pending' AND next_attempt_at <= ?)
+    """, (time.time(),))
+    return cursor.fetchone()[0]
+
+# --- Ticker Metadata Functions ---
+
+@write_transaction
+def save_ticker_metadata(rows):
+    """
+    Inserts or updates ticker metadata and fills in missing stock names from it.
+
+    Args:
+        rows (list): (ticker, long_name, exchange, currency, timezone, last_verified) tuples.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.executemany("""
+        INSERT INTO ticker_metadata (ticker, long_name, exchange, currency, timezone, last_verified)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(ticker) DO UPDATE SET
+            long_name = COALESCE(excluded.long_name, long_name),
+            exchange = COALESCE(excluded.exchange, exchange),
+            currency = COALESCE(excluded.currency, currency),
+            timezone = COALESCE(excluded.timezone, timezone),
+            last_verified = excluded.last_verified
+    """, rows)
+    cursor.executemany("UPDATE stocks SET full_name = ? WHERE ticker = ? AND full_name IS NULL",
+                       [(row[1], row[0]) for row in rows if row[1]])
+
+@read_query
+def get_ticker_metadata(ticker):
+    """Retrieves (ticker, long_name, exchange, currency, timezone, last_verified), or None."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT ticker, long_name, exchange, currency, timezone, last_verified FROM ticker_metadata WHERE ticker = ?", (ticker,))
+    return cursor.fetchone()
+
+@read_query
+def get_all_ticker_metadata():
+    """Retrieves every ticker metadata row."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT ticker, long_name, exchange, currency, timezone, last_verified FROM ticker_metadata")
+    return cursor.fetchall()
 
 # --- Settings Functions ---
 
+@write_transaction
 def save_setting(key, value):
     """Saves a setting to the database."""
     conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
-    conn.commit()
-    conn.close()
 
+@write_transaction
+def save_settings(values):
+    """Saves several settings in one transaction."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.executemany("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", list(values.items()))
+
+@read_query
+def get_all_settings():
+    """Retrieves every setting as a dict."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT key, value FROM settings")
+    return dict(cursor.fetchall())
+
+@read_query
 def get_setting(key):
     """Retrieves a setting from the database."""
     conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT value FROM settings WHERE key = ?", (key,))
     result = cursor.fetchone()
-    conn.close()
     return result[0] if result else None
 
 if __name__ == '__main__':
+    import logging_setup
+    logging_setup.configure()
     initialize_database()
-    print(f"Database initialized successfully at {get_db_path()}")
+    logger.info("Database initialized successfully at %s", get_db_path())
+    shutdown()
+    logging_setup.shutdown()
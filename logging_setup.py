@@ -0,0 +1,123 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+
+# Per-alert trace lines (e.g. every evaluation of every alert) log at this level, below DEBUG
+TRACE = 5
+logging.addLevelName(TRACE, "TRACE")
+
+DEFAULT_LEVEL = "INFO"
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(threadName)s %(name)s: %(message)s"
+LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 5
+
+_listener = None
+_module_loggers = set()  # Loggers given their own level by the last configure()
+_follows_settings = False
+
+LOG_SETTINGS = ("log_level", "log_module_levels", "log_trace_sample_rate")
+
+class SamplingFilter(logging.Filter):
+    """Lets through only a random fraction of TRACE records; other levels always pass."""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > TRACE or self.rate >= 1:
+            return True
+        return random.random() < self.rate
+
+def _level(name):
+    if isinstance(name, int):
+        return name
+    return TRACE if str(name).upper() == "TRACE" else logging.getLevelName(str(name).upper())
+
+def configure(level=DEFAULT_LEVEL, log_dir=None, console=True, trace_sample_rate=1.0, module_levels=None):
+    """
+    Routes every logger through a queue to a rotating log file and the console.
+
+    Callers only pay for putting the record on a queue; formatting and I/O happen on
+    the listener thread. Calling it again replaces the previous configuration.
+
+    Args:
+        level (str or int): Root level, e.g. "INFO" or "TRACE".
+        log_dir (str, optional): Folder for stockalert.log. No file is written if None.
+        console (bool): Also log to stderr.
+        trace_sample_rate (float): Fraction of TRACE records to keep (0-1).
+        module_levels (dict, optional): Per-logger levels, e.g. {"alerter": "TRACE"}.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+    for name in _module_loggers:
+        logging.getLogger(name).setLevel(logging.NOTSET)
+    _module_loggers.clear()
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = []
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            os.path.join(log_dir, "stockalert.log"), maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS, encoding="utf-8")
+        handlers.append(file_handler)
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(trace_sample_rate))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(_level(level))
+    for name, module_level in (module_levels or {}).items():
+        logging.getLogger(name).setLevel(_level(module_level))
+        _module_loggers.add(name)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+def configure_from_settings(console=True):
+    """
+    Configures logging from the settings table.
+
+    Reads log_level, log_trace_sample_rate and log_module_levels (a JSON object of
+    logger name to level), and writes the log file next to the database. Logging is
+    reconfigured whenever one of those settings changes afterwards.
+    """
+    global _follows_settings
+    import database as db
+    import settings
+    try:
+        module_levels = json.loads(settings.get("log_module_levels") or "{}")
+    except ValueError:
+        module_levels = {}
+    configure(
+        level=settings.get("log_level") or DEFAULT_LEVEL,
+        log_dir=os.path.join(os.path.dirname(db.get_db_path()), "logs"),
+        console=console,
+        trace_sample_rate=settings.get_float("log_trace_sample_rate", 1.0),
+        module_levels=module_levels,
+    )
+    if not _follows_settings:
+        _follows_settings = True
+        settings.subscribe(lambda key, value, old: configure_from_settings(console), keys=LOG_SETTINGS)
+
+def shutdown():
+    """Writes out any queued records and stops the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(shutdown)
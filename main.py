@@ -1,12 +1,18 @@
 import customtkinter as ctk
 import database as db
-import yfinance_client as yf_client
+import quote_cache
+import portfolio
+import ticker_metadata
+import metrics
+import settings
+import logging_setup
+import logging
 import notifier as notifier
 import alerter
 import threading
 import time
-from tkinter import messagebox, ttk
-from collections import defaultdict
+from tkinter import messagebox
+from virtual_table import VirtualTable
 import queue
 import json
 from PIL import Image
@@ -24,6 +30,11 @@ def get_currency_symbol(currency_code):
     }
     return symbols.get(currency_code, f"{currency_code} ")
 
+logger = logging.getLogger(__name__)
+
+# How often the UI thread picks up finished dashboard refreshes, in milliseconds
+DASHBOARD_POLL_MS = 100
+
 class StockApp(ctk.CTk):
     is_running = False
     is_quitting = False
@@ -34,7 +45,21 @@ class StockApp(ctk.CTk):
         self.title("Stock Alert Dashboard")
         self.geometry("1200x800")
 
+        logging_setup.configure()
         db.initialize_database()
+        logging_setup.configure_from_settings()
+        self.dashboard_refresh_interval = settings.get_int("dashboard_refresh_interval", 300) or 300
+        quote_cache.use_provider()
+        ticker_metadata.start()
+        metrics.start_exporters()
+
+        # Dashboard refreshes run on a worker thread and hand their snapshot over through this queue
+        self.dashboard_queue = queue.Queue()
+        self._dashboard_lock = threading.Lock()
+        self._dashboard_refreshing = False
+        self._dashboard_rerun = False  # Another refresh was requested while one was running
+        self._dashboard_rerun_max_age = None
+        self._summary_texts = {}  # currency -> (value text, P/L text) currently shown
 
         self.tab_view = ctk.CTkTabview(self, anchor="nw")
         self.tab_view.pack(expand=True, fill="both", padx=10, pady=10)
@@ -61,9 +86,11 @@ class StockApp(ctk.CTk):
 
         alerter.start_alerter_thread()
         self.start_dashboard_refresh_thread()
+        settings.subscribe(self._on_refresh_interval_changed, keys=("dashboard_refresh_interval",))
 
         self.bind("<Control-Shift-D>", self.open_debug_window)
         self.check_ui_alert_queue()
+        self.check_dashboard_queue()
         self.protocol("WM_DELETE_WINDOW", self._on_closing)
 
         # System tray icon setup
@@ -98,8 +125,8 @@ class StockApp(ctk.CTk):
         should_minimize_to_tray = self.minimize_to_tray_switch.get()
 
         # Save this state to the database for future sessions
-        db.save_setting("minimize_to_tray", str(should_minimize_to_tray))
-        print(f"Minimize to tray setting: {should_minimize_to_tray}")
+        settings.set("minimize_to_tray", should_minimize_to_tray)
+        logger.debug("Minimize to tray setting: %s", should_minimize_to_tray)
 
         if should_minimize_to_tray:
             self.withdraw() # Hide the window instead of destroying it
@@ -113,23 +140,23 @@ class StockApp(ctk.CTk):
 
     def _save_column_settings(self):
         try:
-            widths = {col: self.stock_tree.column(col, 'width') for col in self.stock_tree['columns']}
-            db.save_setting('column_widths', json.dumps(widths))
-            print("Column settings saved.")
+            widths = {col: self.stock_tree.column(col, 'width') for col in self.stock_tree.columns}
+            settings.set('column_widths', json.dumps(widths))
+            logger.debug("Column settings saved.")
         except Exception as e:
-            print(f"Error saving column settings: {e}")
+            logger.error("Error saving column settings: %s", e)
 
     def _load_column_settings(self):
         try:
-            widths_json = db.get_setting('column_widths')
+            widths_json = settings.get('column_widths')
             if widths_json:
                 widths = json.loads(widths_json)
                 for col, width in widths.items():
-                    if col in self.stock_tree['columns']:
+                    if col in self.stock_tree.columns:
                         self.stock_tree.column(col, width=width)
-            print("Column settings loaded.")
+            logger.debug("Column settings loaded.")
         except Exception as e:
-            print(f"Error loading column settings: {e}")
+            logger.error("Error loading column settings: %s", e)
 
     def check_ui_alert_queue(self):
         try:
@@ -162,7 +189,7 @@ class StockApp(ctk.CTk):
                 return
             try:
                 percent_change = float(percent_str)
-                live_price_data = yf_client.get_current_prices([ticker])
+                live_price_data = quote_cache.get_current_prices([ticker])
                 if not live_price_data or ticker not in live_price_data:
                     messagebox.showerror("Error", f"Could not fetch current price for {ticker}.", parent=debug_window)
                     return
@@ -181,8 +208,9 @@ class StockApp(ctk.CTk):
         tab = self.tab_view.tab("Dashboard")
         
         columns = ("Name", "Ticker", "Shares", "Currency", "Purchase Price", "Current Price", "P/L", "P/L %")
-        self.stock_tree = ttk.Treeview(tab, columns=columns, show='headings')
-        
+        self.stock_tree = VirtualTable(tab, columns=columns)
+        self._add_filter_bar(tab, self.stock_tree)
+
         for col in columns:
             self.stock_tree.heading(col, text=col.replace("_", " ").title())
             self.stock_tree.column(col, anchor='w')
@@ -211,41 +239,104 @@ class StockApp(ctk.CTk):
         delete_button = ctk.CTkButton(button_frame, text="Remove Selected Stock", command=self.delete_selected_stock)
         delete_button.pack(side="left", padx=5)
 
-    def refresh_dashboard(self):
-        for item in self.stock_tree.get_children():
-            self.stock_tree.delete(item)
+    def _add_filter_bar(self, parent, table):
+        """Adds a filter entry above a VirtualTable. Filtering runs on the table's model."""
+        filter_frame = ctk.CTkFrame(parent)
+        filter_frame.pack(padx=10, pady=(10, 0), fill="x")
+        ctk.CTkLabel(filter_frame, text="Filter:").pack(side="left", padx=5)
+        column_optionmenu = ctk.CTkOptionMenu(filter_frame, values=["All Columns", *table.columns])
+        column_optionmenu.pack(side="left", padx=5)
+        filter_entry = ctk.CTkEntry(filter_frame, width=250, placeholder_text="Text, or e.g. >0 for numbers")
+        filter_entry.pack(side="left", padx=5)
+
+        def apply_filter(*_):
+            column = column_optionmenu.get()
+            table.set_filter(filter_entry.get(), None if column == "All Columns" else column)
+
+        column_optionmenu.configure(command=apply_filter)
+        filter_entry.bind("<KeyRelease>", apply_filter)
+
+    def refresh_dashboard(self, max_age=None):
+        """
+        Starts a dashboard refresh on a worker thread and returns immediately.
+
+        Safe to call from any thread. If a refresh is already running, one more runs
+        after it so the result reflects the latest request.
+
+        Args:
+            max_age (float, optional): Accept cached quotes up to this many seconds old.
+        """
+        with self._dashboard_lock:
+            if self._dashboard_refreshing:
+                if self._dashboard_rerun:
+                    # Keep the stricter of the two freshness requirements
+                    ages = [age or 0 for age in (self._dashboard_rerun_max_age, max_age)]
+                    max_age = min(ages) or None
+                self._dashboard_rerun, self._dashboard_rerun_max_age = True, max_age
+                return
+            self._dashboard_refreshing = True
+        threading.Thread(target=self._load_dashboard_data, args=(max_age,), daemon=True).start()
 
-        stocks = db.get_all_stocks()
-        if not stocks:
-            for frame in self.currency_frames.values():
-                frame.destroy()
-            self.currency_frames.clear()
-            self.summary_labels.clear()
-            self.last_refreshed_label.configure(text="Last Refreshed: Never")
-            return
+    def _load_dashboard_data(self, max_age):
+        """Data stage: fetches prices and computes P/L off the UI thread."""
+        while True:
+            try:
+                snapshot = portfolio.build_dashboard_snapshot(self.dashboard_refresh_interval, max_age=max_age)
+            except Exception as e:
+                logger.error("Error refreshing dashboard data: %s", e)
+                snapshot = None
+            self.dashboard_queue.put(snapshot)
+            with self._dashboard_lock:
+                if not self._dashboard_rerun:
+                    self._dashboard_refreshing = False
+                    return
+                max_age = self._dashboard_rerun_max_age
+                self._dashboard_rerun, self._dashboard_rerun_max_age = False, None
+
+    def check_dashboard_queue(self):
+        """Applies the newest finished dashboard snapshot, if any, on the UI thread."""
+        snapshot = pending = object()
+        try:
+            while True:
+                snapshot = self.dashboard_queue.get_nowait()
+        except queue.Empty:
+            pass
+        if snapshot is not pending:
+            try:
+                self._apply_dashboard_snapshot(snapshot)
+            except Exception as e:
+                logger.error("Error updating the dashboard: %s", e)
+        self.after(DASHBOARD_POLL_MS, self.check_dashboard_queue)
 
-        tickers_to_fetch = [s[1] for s in stocks if not s[2]]
-        if tickers_to_fetch:
-            live_data = yf_client.get_current_prices(tickers_to_fetch)
-            for ticker, data in live_data.items():
-                db.update_stock_name(ticker, data['full_name'])
-            stocks = db.get_all_stocks()
+    def _apply_dashboard_snapshot(self, snapshot):
+        """UI stage: updates only the visible rows and summary labels that changed, keyed by ticker."""
+        if snapshot is None:
+            return  # The fetch failed; keep showing the last data
 
-        tickers = [s[1] for s in stocks]
-        live_prices = yf_client.get_current_prices(tickers)
+        rows = {}
+        for currency, summary in snapshot.items():
+            symbol = get_currency_symbol(currency)
+            for p in summary.positions:
+                tag = 'positive' if p.pl > 0 else ('negative' if p.pl < 0 else '')
+                values = (p.full_name, p.ticker, p.shares, currency, f"{symbol}{p.purchase_price:,.2f}", f"{symbol}{p.current_price:,.2f}", f"{symbol}{p.pl:,.2f}", f"{p.pl_percent:,.2f}%")
+                rows[p.ticker] = (values, (tag,))
 
-        portfolio_by_currency = defaultdict(lambda: {"stocks": [], "total_value": 0, "initial_cost": 0})
-        for stock in stocks:
-            portfolio_by_currency[stock[5]]["stocks"].append(stock)
+        # The table re-renders only the visible rows whose values changed
+        self.stock_tree.set_rows(rows)
 
         # Destroy frames for currencies that are no longer present
         for currency in list(self.currency_frames.keys()):
-            if currency not in portfolio_by_currency:
+            if currency not in snapshot:
                 self.currency_frames[currency].destroy()
                 del self.currency_frames[currency]
                 del self.summary_labels[currency]
+                self._summary_texts.pop(currency, None)
+
+        if not snapshot:
+            self.last_refreshed_label.configure(text="Last Refreshed: Never")
+            return
 
-        for currency, data in portfolio_by_currency.items():
+        for currency, summary in snapshot.items():
             symbol = get_currency_symbol(currency)
             
             if currency not in self.currency_frames:
@@ -262,33 +353,23 @@ class StockApp(ctk.CTk):
                 pl_label.pack(side="left", padx=10)
                 
                 self.summary_labels[currency] = {"value": value_label, "pl": pl_label}
-            else:
-                currency_frame = self.currency_frames[currency]
-
-            total_value, initial_cost = 0, 0
-            for stock in data["stocks"]:
-                stock_id, ticker, full_name, shares, purchase_price, _ = stock
-                current_price = live_prices.get(ticker, {}).get('price', 0)
-                pl = (current_price - purchase_price) * shares if shares and shares > 0 else 0
-                pl_percent = (pl / (purchase_price * shares) * 100) if shares and shares > 0 and purchase_price > 0 else 0
-                tag = 'positive' if pl > 0 else ('negative' if pl < 0 else '')
-                self.stock_tree.insert("", "end", values=(full_name, ticker, shares, currency, f"{symbol}{purchase_price:,.2f}", f"{symbol}{current_price:,.2f}", f"{symbol}{pl:,.2f}", f"{pl_percent:,.2f}%"), tags=(tag,))
-                if shares and shares > 0:
-                    total_value += current_price * shares
-                    initial_cost += purchase_price * shares
-            total_pl = total_value - initial_cost
-            total_pl_percent = (total_pl / initial_cost * 100) if initial_cost > 0 else 0
-            self.summary_labels[currency]["value"].configure(text=f"Total Value: {symbol}{total_value:,.2f}")
-            self.summary_labels[currency]["pl"].configure(text=f"Total P/L: {symbol}{total_pl:,.2f} ({total_pl_percent:.2f}%)")
+
+            texts = (f"Total Value: {symbol}{summary.total_value:,.2f}",
+                     f"Total P/L: {symbol}{summary.total_pl:,.2f} ({summary.total_pl_percent:.2f}%)")
+            old_texts = self._summary_texts.get(currency, (None, None))
+            if texts[0] != old_texts[0]:
+                self.summary_labels[currency]["value"].configure(text=texts[0])
+            if texts[1] != old_texts[1]:
+                self.summary_labels[currency]["pl"].configure(text=texts[1])
+            self._summary_texts[currency] = texts
 
         self.last_refreshed_label.configure(text=f"Last Refreshed: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
     def delete_selected_stock(self):
-        selected_item = self.stock_tree.selection()
-        if not selected_item:
+        ticker = self.stock_tree.selected_key()
+        if not ticker:
             messagebox.showerror("Error", "Please select a stock to delete.")
             return
-        ticker = self.stock_tree.item(selected_item, "values")[1]
         stock = self.get_stock_by_ticker(ticker)
         if messagebox.askyesno("Confirm Deletion", "Are you sure you want to delete this stock and all its associated alerts?"):
             try:
@@ -331,6 +412,16 @@ class StockApp(ctk.CTk):
             messagebox.showerror("Error", "Shares and Purchase Price must be valid numbers.")
             return
 
+        # Usually answered from the metadata cache; a new ticker costs one quote request
+        metadata = ticker_metadata.lookup(ticker)
+        if metadata is None:
+            if not messagebox.askyesno("Unknown Ticker", f"Could not find {ticker} on Yahoo Finance. Add it anyway?"):
+                return
+        elif metadata.currency and metadata.currency != currency:
+            listing = f" on {metadata.exchange}" if metadata.exchange else ""
+            if messagebox.askyesno("Currency", f"{ticker} trades in {metadata.currency}{listing}, not {currency}. Use {metadata.currency}?"):
+                currency = metadata.currency
+
         status = db.add_stock(ticker, shares, purchase_price, currency)
 
         if status == "added":
@@ -348,11 +439,7 @@ class StockApp(ctk.CTk):
 
     def get_stock_by_ticker(self, ticker):
         """Helper function to find a stock by its ticker from the database."""
-        stocks = db.get_all_stocks()
-        for stock in stocks:
-            if stock[1] == ticker: # stock[1] is the ticker
-                return stock
-        return None
+        return db.get_stock_by_ticker(ticker)
 
     def setup_alerts_tab(self):
         tab = self.tab_view.tab("Alerts")
@@ -378,8 +465,10 @@ class StockApp(ctk.CTk):
         existing_alerts_frame = ctk.CTkFrame(tab)
         existing_alerts_frame.pack(pady=10, padx=10, fill="both", expand=True)
         ctk.CTkLabel(existing_alerts_frame, text="Your Alerts", font=("Arial", 16)).pack(pady=5)
-        self.alerts_tree = ttk.Treeview(existing_alerts_frame, columns=("Stock", "Alert Type", "Baseline Price", "Target Price", "Percent Change"), show='headings')
+        self.alerts_tree = VirtualTable(existing_alerts_frame, columns=("Stock", "Ticker", "Alert Type", "Baseline Price", "Target Price", "Percent Change"))
+        self._add_filter_bar(existing_alerts_frame, self.alerts_tree)
         self.alerts_tree.heading("Stock", text="Stock")
+        self.alerts_tree.heading("Ticker", text="Ticker")
         self.alerts_tree.heading("Alert Type", text="Alert Type")
         self.alerts_tree.heading("Baseline Price", text="Baseline Price")
         self.alerts_tree.heading("Target Price", text="Target Price")
@@ -392,11 +481,10 @@ class StockApp(ctk.CTk):
         self.refresh_alerts_tab()
 
     def delete_selected_alert(self):
-        selected_item = self.alerts_tree.selection()
-        if not selected_item:
+        alert_id = self.alerts_tree.selected_key()
+        if alert_id is None:
             messagebox.showerror("Error", "Please select an alert to delete.")
             return
-        alert_id = selected_item[0]
         try:
             db.delete_alert(alert_id)
             messagebox.showinfo("Success", "Alert deleted successfully.")
@@ -436,7 +524,7 @@ class StockApp(ctk.CTk):
                 return
             try:
                 target_price = float(target_price_str)
-                db.add_alert(stock[0], alert_type, target_price=target_price)
+                alert_id = db.add_alert(stock[0], alert_type, target_price=target_price)
             except ValueError:
                 messagebox.showerror("Error", "Target price must be a valid number.")
                 return
@@ -450,7 +538,7 @@ class StockApp(ctk.CTk):
                 alert_id = db.add_alert(stock[0], alert_type, threshold_percent=threshold)
                 
                 # Immediately set the initial state for percentage-based alerts
-                live_price_data = yf_client.get_current_prices([stock_ticker])
+                live_price_data = quote_cache.get_current_prices([stock_ticker])
                 if live_price_data and stock_ticker in live_price_data:
                     current_price = live_price_data[stock_ticker]['price']
                     initial_state = "watching_for_peak" if alert_type == "Price Drops From Recent High" else "watching_for_trough"
@@ -464,17 +552,16 @@ class StockApp(ctk.CTk):
         self.refresh_alerts_tab()
 
     def refresh_alerts_tab(self):
-        for item in self.alerts_tree.get_children(): self.alerts_tree.delete(item)
-        stocks = db.get_all_stocks()
-        stock_tickers = [s[1] for s in stocks]
+        stocks_with_alerts = db.get_all_stocks_with_alerts()
+        stock_tickers = [stock[1] for stock, _ in stocks_with_alerts]
         self.alert_stock_optionmenu.configure(values=stock_tickers if stock_tickers else ["No stocks added"])
         if stock_tickers:
             self.alert_stock_optionmenu.set(stock_tickers[0])
         else:
             self.alert_stock_optionmenu.set("")
 
-        for stock in stocks:
-            alerts = db.get_stock_alerts(stock[0])
+        rows = {}
+        for stock, alerts in stocks_with_alerts:
             for alert in alerts:
                 alert_id, alert_type, threshold_percent, target_price, is_active, last_benchmark_price, current_state = alert
                 
@@ -494,7 +581,8 @@ class StockApp(ctk.CTk):
                         target_price_display = f"{get_currency_symbol(stock[5])}{trigger_price:,.2f}"
                     percent_change_display = f"{threshold_percent}%"
 
-                self.alerts_tree.insert("", "end", iid=alert_id, values=(stock[2], alert_type, baseline_price_display, target_price_display, percent_change_display))
+                rows[alert_id] = ((stock[2], stock[1], alert_type, baseline_price_display, target_price_display, percent_change_display), ())
+        self.alerts_tree.set_rows(rows)
 
     def setup_settings_tab(self):
         tab = self.tab_view.tab("Settings")
@@ -546,33 +634,32 @@ class StockApp(ctk.CTk):
             messagebox.showerror("Error", "Refresh interval must be a valid positive integer.")
             return
         try:
-            db.save_setting("notification_service", service)
-            db.save_setting("dashboard_refresh_interval", str(refresh_interval))
+            values = {"notification_service": service, "dashboard_refresh_interval": refresh_interval}
             if service == "Pushover":
-                db.save_setting("pushover_user_key", self.pushover_user_key_entry.get())
-                db.save_setting("pushover_api_token", self.pushover_api_token_entry.get())
+                values["pushover_user_key"] = self.pushover_user_key_entry.get()
+                values["pushover_api_token"] = self.pushover_api_token_entry.get()
             elif service == "Pushbullet":
-                db.save_setting("pushbullet_api_token", self.pushbullet_token_entry.get())
+                values["pushbullet_api_token"] = self.pushbullet_token_entry.get()
+            # Subscribers (the refresh timer, the notification workers) pick up the changes
+            settings.set_many(values)
 
             messagebox.showinfo("Success", "Settings saved successfully.")
-            self.stop_dashboard_refresh_thread()
-            self.start_dashboard_refresh_thread()
         except Exception as e:
             messagebox.showerror("Error", f"Failed to save settings: {e}")
 
     def load_settings(self):
-        service = db.get_setting("notification_service")
+        service = settings.get("notification_service")
         if service: self.notification_service_optionmenu.set(service)
-        pushover_user_key = db.get_setting("pushover_user_key")
+        pushover_user_key = settings.get("pushover_user_key")
         if pushover_user_key: self.pushover_user_key_entry.insert(0, pushover_user_key)
-        pushover_api_token = db.get_setting("pushover_api_token")
+        pushover_api_token = settings.get("pushover_api_token")
         if pushover_api_token: self.pushover_api_token_entry.insert(0, pushover_api_token)
-        pushbullet_token = db.get_setting("pushbullet_api_token")
+        pushbullet_token = settings.get("pushbullet_api_token")
         if pushbullet_token: self.pushbullet_token_entry.insert(0, pushbullet_token)
-        refresh_interval = db.get_setting("dashboard_refresh_interval")
+        refresh_interval = settings.get("dashboard_refresh_interval")
         if refresh_interval: self.refresh_interval_entry.insert(0, refresh_interval)
 
-        minimize_to_tray = db.get_setting("minimize_to_tray")
+        minimize_to_tray = settings.get("minimize_to_tray")
         # Default to "True" if the setting is not found in the database
         if minimize_to_tray is None: 
             minimize_to_tray = "True"
@@ -584,18 +671,25 @@ class StockApp(ctk.CTk):
 
     def start_dashboard_refresh_thread(self):
         self.stop_event = threading.Event()
-        interval = int(db.get_setting("dashboard_refresh_interval") or 300)
+        interval = settings.get_int("dashboard_refresh_interval", 300) or 300
+        self.dashboard_refresh_interval = interval
         self.dashboard_refresh_thread = threading.Thread(target=self._dashboard_refresh_loop, args=(interval, self.stop_event), daemon=True)
         self.dashboard_refresh_thread.start()
 
     def _dashboard_refresh_loop(self, interval, stop_event):
         while not stop_event.wait(interval):
-            print("Refreshing dashboard data...")
-            self.refresh_dashboard()
+            logger.debug("Refreshing dashboard data...")
+            self.refresh_dashboard(max_age=interval)
 
     def stop_dashboard_refresh_thread(self):
         if hasattr(self, 'stop_event'): self.stop_event.set()
 
+    def _on_refresh_interval_changed(self, key, value, old):
+        """Settings subscriber: restarts the refresh timer with the new interval."""
+        logger.info("Dashboard refresh interval changed from %s to %s seconds.", old, value)
+        self.stop_dashboard_refresh_thread()
+        self.start_dashboard_refresh_thread()
+
 if __name__ == "__main__":
     app = StockApp()
     app.mainloop()
\ No newline at end of file
@@ -0,0 +1,292 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DEFAULT_SNAPSHOT_INTERVAL = 60
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+class _Metric:
+    """Base for metrics with optional labels. Each distinct label set is its own series."""
+
+    type_name = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+class Counter(_Metric):
+    """A value that only goes up, such as the number of failed fetches."""
+
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._series.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(key, value) for key, value in self._series.items()]
+
+class Gauge(_Metric):
+    """A value that can go up and down. set_function() makes it read a value when exported."""
+
+    type_name = "gauge"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+    def set_function(self, function):
+        """Reads the (unlabelled) gauge from function() every time it is exported."""
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            try:
+                return [((), self._function())]
+            except Exception:
+                return []
+        with self._lock:
+            return [(key, value) for key, value in self._series.items()]
+
+class Histogram(_Metric):
+    """Counts observations, e.g. latencies in seconds, into cumulative buckets."""
+
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes how long the with-block took."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        """Returns (label values, cumulative bucket counts, sum, count) per series."""
+        with self._lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        samples = []
+        for key, counts, total, count in series:
+            cumulative, running = [], 0
+            for bucket_count in counts:
+                running += bucket_count
+                cumulative.append(running)
+            samples.append((key, cumulative, total, count))
+        return samples
+
+class MetricsRegistry:
+    """Holds every metric of the process and renders them for export."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.type_name}")
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter, name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def render_prometheus(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            if isinstance(metric, Histogram):
+                bounds = [_format_value(bound) for bound in metric.buckets] + ["+Inf"]
+                for key, cumulative, total, count in metric.samples():
+                    for bound, bucket_count in zip(bounds, cumulative):
+                        labels = _format_labels(metric.labelnames, key, 'le="' + bound + '"')
+                        lines.append(f"{metric.name}_bucket{labels} {bucket_count}")
+                    lines.append(f"{metric.name}_sum{_format_labels(metric.labelnames, key)} {_format_value(total)}")
+                    lines.append(f"{metric.name}_count{_format_labels(metric.labelnames, key)} {count}")
+            else:
+                for key, value in metric.samples():
+                    lines.append(f"{metric.name}{_format_labels(metric.labelnames, key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Returns every metric as a JSON-serializable dict."""
+        result = {}
+        for metric in self.metrics():
+            if isinstance(metric, Histogram):
+                samples = [{"labels": dict(zip(metric.labelnames, key)), "count": count, "sum": total,
+                            "buckets": {str(bound): c for bound, c in zip(list(metric.buckets) + ["+Inf"], cumulative)}}
+                           for key, cumulative, total, count in metric.samples()]
+            else:
+                samples = [{"labels": dict(zip(metric.labelnames, key)), "value": value} for key, value in metric.samples()]
+            result[metric.name] = {"type": metric.type_name, "help": metric.help, "samples": samples}
+        return {"timestamp": time.time(), "metrics": result}
+
+# Shared registry for the whole application
+registry = MetricsRegistry()
+
+# --- Exporters ---
+
+_http_server = None
+_snapshot_thread = None
+_snapshot_stop = threading.Event()
+
+def start_http_server(port, host="127.0.0.1"):
+    """Serves the registry in Prometheus text format at http://host:port/metrics."""
+    global _http_server
+    if _http_server is not None:
+        return _http_server
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    _http_server = ThreadingHTTPServer((host, port), Handler)
+    _http_server.daemon_threads = True
+    threading.Thread(target=_http_server.serve_forever, daemon=True).start()
+    return _http_server
+
+def write_snapshot(path):
+    """Writes a JSON snapshot of the registry, replacing the file atomically."""
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(temp_path, path)
+
+def start_snapshot_writer(path, interval=DEFAULT_SNAPSHOT_INTERVAL):
+    """Writes a JSON snapshot to `path` every `interval` seconds on a daemon thread."""
+    global _snapshot_thread
+    if _snapshot_thread is not None:
+        return
+
+    def run():
+        while not _snapshot_stop.wait(interval):
+            try:
+                write_snapshot(path)
+            except OSError as e:
+                logger.error("Error writing metrics snapshot: %s", e)
+
+    _snapshot_stop.clear()
+    _snapshot_thread = threading.Thread(target=run, daemon=True)
+    _snapshot_thread.start()
+
+def stop_exporters():
+    """Stops the HTTP endpoint and the snapshot writer."""
+    global _http_server, _snapshot_thread
+    if _http_server is not None:
+        _http_server.shutdown()
+        _http_server.server_close()
+        _http_server = None
+    if _snapshot_thread is not None:
+        _snapshot_stop.set()
+        _snapshot_thread = None
+
+def start_exporters():
+    """
+    Starts the exporters configured in settings.
+
+    metrics_port enables the HTTP endpoint on 127.0.0.1 (0 disables it), and
+    metrics_snapshot_interval sets how often metrics.json is written next to the
+    database (0 disables it).
+    """
+    import database as db  # database itself records metrics, so import it lazily
+    import settings
+    port = settings.get_int("metrics_port", 0)
+    if port:
+        try:
+            start_http_server(port)
+        except OSError as e:
+            logger.error("Could not start the metrics endpoint on port %s: %s", port, e)
+    interval = settings.get_float("metrics_snapshot_interval", 0)
+    if interval > 0:
+        start_snapshot_writer(os.path.join(os.path.dirname(db.get_db_path()), "metrics.json"), interval)
@@ -0,0 +1,177 @@
+import logging
+import random
+import threading
+import time
+import database as db
+import metrics
+import notifier
+import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+# Notifications a worker claims from the outbox at a time
+CLAIM_BATCH = 5
+MAX_ATTEMPTS = 6
+# Retry delays grow as BACKOFF_BASE * 2^(attempt-1), up to BACKOFF_MAX seconds, with jitter
+BACKOFF_BASE = 5
+BACKOFF_MAX = 600
+# How often idle workers look for retries that have become due
+POLL_INTERVAL = 5
+# Sent and failed notifications are kept this long for inspection
+RETENTION_SECONDS = 7 * 24 * 3600
+
+CREDENTIAL_SETTINGS = ("pushover_user_key", "pushover_api_token", "pushbullet_api_token")
+
+DISPATCHED = metrics.registry.counter("stockalert_notifications_dispatched_total", "Outbox delivery attempts by outcome.", ("service", "result"))
+OUTBOX_PENDING = metrics.registry.gauge("stockalert_notification_outbox_pending", "Notifications waiting in the outbox.")
+
+class NotificationConfigError(Exception):
+    """A notification that cannot succeed on retry, e.g. an unknown service or a missing credential."""
+
+class NotificationDispatcher:
+    """
+    Delivers notifications from the persistent outbox on a pool of worker threads.
+
+    Producers only insert a row with enqueue(); workers claim due rows, send them with
+    notifier's pooled sessions and record the outcome. A sender returning False schedules
+    a retry with exponential backoff until MAX_ATTEMPTS; an unknown service or a missing
+    credential fails the notification right away.
+    Rows survive restarts, so nothing triggered is lost if the app exits mid-send.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.workers = workers
+        self._threads = []
+        self._stop = threading.Event()
+        self._wake = threading.Condition()
+        self._generation = 0  # Bumped on every enqueue so a waiting worker never misses one
+
+    def start(self):
+        """Starts the worker threads if they are not running yet."""
+        if any(thread.is_alive() for thread in self._threads):
+            return
+        try:
+            db.prune_notifications(time.time() - RETENTION_SECONDS)
+        except Exception as e:
+            logger.error("Error pruning the notification outbox: %s", e)
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._run, name=f"notifier-{i}", daemon=True) for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=None):
+        """Stops the workers after the notifications they are sending."""
+        self._stop.set()
+        with self._wake:
+            self._wake.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def enqueue(self, service, title, message):
+        """Adds a notification to the outbox and wakes a worker. Never touches the network."""
+        notification_id = db.enqueue_notification(service, title, message)
+        with self._wake:
+            self._generation += 1
+            self._wake.notify()
+        return notification_id
+
+    def wait_idle(self, timeout=None):
+        """Blocks until nothing is due or being sent. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while db.count_due_notifications():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._wake:
+                generation = self._generation
+            try:
+                claimed = db.claim_notifications(CLAIM_BATCH)
+            except Exception as e:
+                logger.error("Error reading the notification outbox: %s", e)
+                claimed = []
+            if claimed:
+                credentials = self._credentials()
+                for row in claimed:
+                    self._deliver(row, credentials)
+                continue
+            with self._wake:
+                if self._generation == generation and not self._stop.is_set():
+                    self._wake.wait(POLL_INTERVAL)
+
+    def _credentials(self):
+        """Reads the push service credentials once per claimed batch."""
+        return {key: settings.get(key) for key in CREDENTIAL_SETTINGS}
+
+    def on_credentials_changed(self, key, value, old):
+        """Retries waiting notifications right away with the new credentials."""
+        try:
+            db.reschedule_notifications()
+        except Exception as e:
+            logger.error("Error rescheduling notifications: %s", e)
+            return
+        with self._wake:
+            self._generation += 1
+            self._wake.notify_all()
+
+    def _send(self, service, title, message, credentials):
+        """
+        Sends one notification. Returns None on success or an error description.
+
+        Raises:
+            NotificationConfigError: If the service is unknown or its credentials are not set.
+        """
+        if service == "Pushover":
+            user_key, api_token = credentials["pushover_user_key"], credentials["pushover_api_token"]
+            if not (user_key and api_token):
+                raise NotificationConfigError("User Key or API Token not set")
+            return None if notifier.send_pushover_notification(user_key, api_token, title, message) else "Pushover request failed"
+        if service == "Pushbullet":
+            api_token = credentials["pushbullet_api_token"]
+            if not api_token:
+                raise NotificationConfigError("Access Token not set")
+            return None if notifier.send_pushbullet_notification(api_token, title, message) else "Pushbullet request failed"
+        raise NotificationConfigError(f"Unknown notification service {service}")
+
+    def _deliver(self, row, credentials):
+        notification_id, service, title, message, attempts = row
+        attempts += 1  # claim_notifications counted this attempt
+        permanent = False
+        try:
+            error = self._send(service, title, message, credentials)
+        except NotificationConfigError as e:
+            error, permanent = str(e), True
+        except Exception as e:
+            error = str(e)
+
+        try:
+            if error is None:
+                db.mark_notification_sent(notification_id)
+                DISPATCHED.inc(service=service, result="sent")
+                logger.info("Sent %s notification %s: %s", service, notification_id, title)
+            elif permanent:
+                # Retrying cannot help until the configuration changes
+                db.mark_notification_failed(notification_id, error)
+                DISPATCHED.inc(service=service, result="failed")
+                logger.error("Cannot send %s notification %s: %s", service, notification_id, error)
+            elif attempts >= MAX_ATTEMPTS:
+                db.mark_notification_failed(notification_id, error)
+                DISPATCHED.inc(service=service, result="failed")
+                logger.error("Giving up on %s notification %s after %d attempts: %s", service, notification_id, attempts, error)
+            else:
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+                db.mark_notification_retry(notification_id, time.time() + delay, error)
+                DISPATCHED.inc(service=service, result="retry")
+                logger.warning("%s notification %s failed (%s); retrying in %.0fs.", service, notification_id, error, delay)
+        except Exception as e:
+            logger.error("Error recording the outcome of notification %s: %s", notification_id, e)
+
+# Shared dispatcher used by the alerter
+dispatcher = NotificationDispatcher()
+OUTBOX_PENDING.set_function(lambda: db.get_notification_counts().get("pending", 0))
+settings.subscribe(dispatcher.on_credentials_changed, keys=CREDENTIAL_SETTINGS)
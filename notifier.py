@@ -1,5 +1,35 @@
 
+import time
+import logging
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SEND_SECONDS = metrics.registry.histogram("stockalert_notification_send_seconds", "Latency of push notification requests.", ("service",))
+SEND_FAILURES = metrics.registry.counter("stockalert_notification_failures_total", "Push notifications that were not delivered.", ("service",))
+
+PUSHOVER_URL = "https://api.pushover.net/1/messages.json"
+PUSHBULLET_URL = "https://api.pushbullet.com/v2/pushes"
+# Seconds to wait for a push API before counting the attempt as failed
+REQUEST_TIMEOUT = 10
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Returns the shared keep-alive session for the push APIs, creating it on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=8)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
 
 def send_pushover_notification(user_key, api_token, title, message):
     """
@@ -15,17 +45,22 @@ def send_pushover_notification(user_key, api_token, title, message):
         bool: True if the notification was sent successfully, False otherwise.
     """
     try:
-        url = "https://api.pushover.net/1/messages.json"
+        url = PUSHOVER_URL
         payload = {
             "token": api_token,
             "user": user_key,
             "title": title,
             "message": message
         }
-        response = requests.post(url, data=payload, timeout=10)
+        started = time.perf_counter()
+        response = get_session().post(url, data=payload, timeout=REQUEST_TIMEOUT)
+        SEND_SECONDS.observe(time.perf_counter() - started, service="pushover")
+        if response.status_code != 200:
+            SEND_FAILURES.inc(service="pushover")
         return response.status_code == 200
     except Exception as e:
-        print(f"Error sending Pushover notification: {e}")
+        SEND_FAILURES.inc(service="pushover")
+        logger.error("Error sending Pushover notification: %s", e)
         return False
 
 def send_pushbullet_notification(access_token, title, body):
@@ -41,7 +76,7 @@ def send_pushbullet_notification(access_token, title, body):
         bool: True if the notification was sent successfully, False otherwise.
     """
     try:
-        url = "https://api.pushbullet.com/v2/pushes"
+        url = PUSHBULLET_URL
         headers = {
             "Access-Token": access_token,
             "Content-Type": "application/json"
@@ -51,8 +86,13 @@ def send_pushbullet_notification(access_token, title, body):
             "title": title,
             "body": body
         }
-        response = requests.post(url, headers=headers, json=payload, timeout=10)
+        started = time.perf_counter()
+        response = get_session().post(url, headers=headers, json=payload, timeout=REQUEST_TIMEOUT)
+        SEND_SECONDS.observe(time.perf_counter() - started, service="pushbullet")
+        if response.status_code != 200:
+            SEND_FAILURES.inc(service="pushbullet")
         return response.status_code == 200
     except Exception as e:
-        print(f"Error sending Pushbullet notification: {e}")
+        SEND_FAILURES.inc(service="pushbullet")
+        logger.error("Error sending Pushbullet notification: %s", e)
         return False
@@ -0,0 +1,152 @@
+import math
+import threading
+import time
+import settings
+
+DEFAULT_MIN_INTERVAL = 15
+DEFAULT_MAX_INTERVAL = 300
+# Weight of the newest observation in the per-ticker volatility estimate
+VOLATILITY_SMOOTHING = 0.3
+# Fraction of the expected time-to-trigger we are willing to wait between polls
+SAFETY_FACTOR = 0.25
+# Volatility assumed for a ticker whose price has not moved, so it never backs off blindly
+MIN_VOLATILITY = 1e-4
+
+INTERVAL_SETTINGS = ("poll_min_interval", "poll_max_interval")
+
+class _TickerSchedule:
+    __slots__ = ("next_due", "last_price", "last_seen", "volatility")
+
+    def __init__(self):
+        self.next_due = 0.0
+        self.last_price = None
+        self.last_seen = None
+        self.volatility = None  # EWMA of |log return| per sqrt(second)
+
+class PollScheduler:
+    """
+    Decides when each ticker should be polled next.
+
+    Tickers close to an alert trigger, or moving quickly, are polled as often as
+    min_interval allows; quiet tickers far from every trigger back off towards
+    max_interval. Other consumers such as the dashboard register "watches" that
+    cap a ticker's interval, so one fetch serves everyone.
+    """
+
+    def __init__(self, min_interval=DEFAULT_MIN_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._schedules = {}
+        self._alert_tickers = set()
+        self._watches = {}  # consumer -> (set of tickers, interval)
+        self._lock = threading.Lock()
+
+    def configure(self):
+        """Loads the min/max polling intervals from the settings table."""
+        self.min_interval = settings.get_float("poll_min_interval", DEFAULT_MIN_INTERVAL) or DEFAULT_MIN_INTERVAL
+        self.max_interval = max(self.min_interval, settings.get_float("poll_max_interval", DEFAULT_MAX_INTERVAL) or DEFAULT_MAX_INTERVAL)
+
+    def set_alert_tickers(self, tickers):
+        """Sets the tickers that currently have active alerts."""
+        with self._lock:
+            self._alert_tickers = set(tickers)
+            self._prune()
+
+    def set_watch(self, consumer, tickers, interval):
+        """Asks for the given tickers to be polled at least every `interval` seconds."""
+        with self._lock:
+            self._watches[consumer] = (set(tickers), interval)
+            self._prune()
+
+    def remove_watch(self, consumer):
+        with self._lock:
+            self._watches.pop(consumer, None)
+            self._prune()
+
+    def _tracked(self):
+        tickers = set(self._alert_tickers)
+        for watched, _ in self._watches.values():
+            tickers |= watched
+        return tickers
+
+    def _prune(self):
+        """Drops schedules for tickers nobody needs any more. Caller holds the lock."""
+        tracked = self._tracked()
+        for ticker in [t for t in self._schedules if t not in tracked]:
+            del self._schedules[ticker]
+
+    def _watch_interval(self, ticker):
+        intervals = [interval for watched, interval in self._watches.values() if ticker in watched]
+        return min(intervals) if intervals else None
+
+    def due_tickers(self, now=None):
+        """Returns the tracked tickers whose next poll is due, including ones never polled."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return [t for t in self._tracked() if self._schedules.get(t, _TickerSchedule()).next_due <= now]
+
+    def seconds_until_next_due(self, now=None):
+        """Returns how long until the next ticker is due, or None if nothing is tracked."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tracked = self._tracked()
+            if not tracked:
+                return None
+            return max(0.0, min(self._schedules[t].next_due if t in self._schedules else now for t in tracked) - now)
+
+    def record(self, ticker, price, distance=None, now=None):
+        """
+        Records a fetched price and schedules the ticker's next poll.
+
+        Args:
+            ticker (str): The ticker that was polled.
+            price (float): The price that was fetched.
+            distance (float, optional): Fractional distance from the price to the nearest
+                alert trigger (0.01 = 1%). None if the ticker has no alerts.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            schedule = self._schedules.setdefault(ticker, _TickerSchedule())
+            if schedule.last_price and price and schedule.last_seen is not None and now > schedule.last_seen:
+                move = abs(math.log(price / schedule.last_price)) / math.sqrt(now - schedule.last_seen)
+                if schedule.volatility is None:
+                    schedule.volatility = move
+                else:
+                    schedule.volatility += VOLATILITY_SMOOTHING * (move - schedule.volatility)
+            schedule.last_price = price
+            schedule.last_seen = now
+
+            if ticker not in self._alert_tickers:
+                interval = math.inf  # Only watched; the watch decides
+            elif distance is None:
+                interval = self.max_interval
+            elif schedule.volatility is None:
+                # No volatility estimate yet: poll again soon to learn one
+                interval = self.min_interval
+            else:
+                # Diffusion estimate of how long a move of `distance` takes
+                interval = SAFETY_FACTOR * (distance / max(schedule.volatility, MIN_VOLATILITY)) ** 2
+                interval = min(max(interval, self.min_interval), self.max_interval)
+
+            watch_interval = self._watch_interval(ticker)
+            if watch_interval is not None:
+                interval = min(interval, watch_interval)
+            if math.isinf(interval):
+                interval = self.max_interval
+            schedule.next_due = now + interval
+
+    def defer(self, ticker, seconds, now=None):
+        """Pushes a ticker's next poll back by `seconds`, e.g. until its market opens."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._schedules.setdefault(ticker, _TickerSchedule()).next_due = now + seconds
+
+    def record_failure(self, ticker, now=None):
+        """Schedules a retry for a ticker whose fetch failed."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._schedules.setdefault(ticker, _TickerSchedule()).next_due = now + self.min_interval
+
+# Shared schedule for the alerter and the dashboard
+shared_scheduler = PollScheduler()
+settings.subscribe(lambda key, value, old: shared_scheduler.configure(), keys=INTERVAL_SETTINGS)
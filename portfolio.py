@@ -0,0 +1,66 @@
+from collections import namedtuple
+import database as db
+import poll_scheduler
+import quote_cache
+
+# One dashboard row and one per-currency total, ready to be rendered
+PositionRow = namedtuple("PositionRow", ["stock_id", "ticker", "full_name", "shares", "currency", "purchase_price", "current_price", "pl", "pl_percent"])
+CurrencySummary = namedtuple("CurrencySummary", ["currency", "positions", "total_value", "initial_cost", "total_pl", "total_pl_percent"])
+
+def fetch_dashboard_prices(tickers, watch_interval, max_age=None):
+    """
+    Fetches the dashboard's prices through the shared quote cache.
+
+    Registers the tickers as the dashboard's watch with the poll scheduler, and accepts
+    any cached quote for tickers whose market is closed.
+    """
+    # The alerter's poll schedule keeps these fresh, so a timed refresh is normally served from cache
+    poll_scheduler.shared_scheduler.set_watch("dashboard", tickers, watch_interval)
+    # Prices cannot move while a market is closed, so any cached quote will do for those
+    provider = quote_cache.get_provider()
+    closed = {t for t in tickers if not provider.is_market_open(t)}
+    open_tickers = [t for t in tickers if t not in closed]
+    closed_tickers = [t for t in tickers if t in closed]
+    live_prices = quote_cache.get_current_prices(open_tickers, max_age=max_age)
+    live_prices.update(quote_cache.get_current_prices(closed_tickers, max_age=float('inf')))
+    return live_prices
+
+def build_dashboard_snapshot(watch_interval, max_age=None):
+    """
+    Prepares everything the dashboard shows, without touching any widgets.
+
+    Args:
+        watch_interval (int): The dashboard refresh interval, in seconds.
+        max_age (float, optional): Accept cached quotes up to this many seconds old.
+
+    Returns:
+        dict: Maps each currency to a CurrencySummary, in the order stocks were added.
+            Empty if there are no stocks.
+    """
+    stocks = db.get_all_stocks()
+    if not stocks:
+        poll_scheduler.shared_scheduler.remove_watch("dashboard")
+        return {}
+
+    # Names come from the stocks table, which the ticker metadata cache fills from ordinary
+    # quote fetches; a stock added since then takes the name carried by this refresh's quote
+    live_prices = fetch_dashboard_prices([s[1] for s in stocks], watch_interval, max_age)
+
+    positions_by_currency = {}
+    for stock_id, ticker, full_name, shares, purchase_price, currency in stocks:
+        quote = live_prices.get(ticker, {})
+        current_price = quote.get('price', 0)
+        full_name = full_name or quote.get('full_name') or ticker
+        pl = (current_price - purchase_price) * shares if shares and shares > 0 else 0
+        pl_percent = (pl / (purchase_price * shares) * 100) if shares and shares > 0 and purchase_price > 0 else 0
+        positions_by_currency.setdefault(currency, []).append(
+            PositionRow(stock_id, ticker, full_name, shares, currency, purchase_price, current_price, pl, pl_percent))
+
+    snapshot = {}
+    for currency, positions in positions_by_currency.items():
+        total_value = sum(p.current_price * p.shares for p in positions if p.shares and p.shares > 0)
+        initial_cost = sum(p.purchase_price * p.shares for p in positions if p.shares and p.shares > 0)
+        total_pl = total_value - initial_cost
+        total_pl_percent = (total_pl / initial_cost * 100) if initial_cost > 0 else 0
+        snapshot[currency] = CurrencySummary(currency, positions, total_value, initial_cost, total_pl, total_pl_percent)
+    return snapshot
@@ -0,0 +1,480 @@
+import atexit
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import namedtuple
+from datetime import datetime, timezone
+from urllib.parse import quote, unquote
+import numpy as np
+import database as db
+import quote_cache
+import settings
+
+logger = logging.getLogger(__name__)
+
+# --- Storage Layout ---
+# Prices live outside portfolio.db, under history/<ticker>/ next to it, in one
+# append-only file per period and tier:
+#
+#   ticks-YYYY-MM-DD.bin   every observed price (timestamp, price, source)
+#   minute-YYYY-MM.bin     1-minute OHLC bars rolled up from expired ticks
+#   hour-YYYY.bin          1-hour bars rolled up from expired minute bars
+#   day.bin                1-day bars rolled up from expired hour bars, kept forever
+#
+# A file is a sequence of segments. Each segment holds a run of rows: timestamps
+# in milliseconds, delta-encoded, and float64 columns, each byte-shuffled so the
+# slowly changing high bytes sit together, all zlib-compressed. Every instant is
+# stored in exactly one tier, so queries merge the tiers without double counting.
+
+# Seconds between writes of buffered ticks to disk
+FLUSH_INTERVAL = 60
+# Buffered ticks that force a write before FLUSH_INTERVAL
+FLUSH_TICKS = 10000
+# Seconds between roll-up and retention passes
+COMPACT_INTERVAL = 3600
+
+RESOLUTIONS = {"minute": 60, "hour": 3600, "day": 86400}
+# tier -> (coarser tier it rolls up into, retention setting, default retention in days)
+ROLLUPS = {
+    "ticks": ("minute", "history_tick_retention_days", 7),
+    "minute": ("hour", "history_minute_retention_days", 90),
+    "hour": ("day", "history_hour_retention_days", 730),
+}
+_TIER_RESOLUTIONS_MS = {"minute": 60_000, "hour": 3_600_000, "day": 86_400_000}
+
+_MAGIC = b"SAH1"
+_HEADER = struct.Struct("<4sBBII")  # magic, kind, source length, row count, payload length
+_TICKS, _BARS = 0, 1
+_DAY_MS = 86_400_000
+
+Ticks = namedtuple("Ticks", ["timestamps", "prices", "sources"])
+Bars = namedtuple("Bars", ["timestamps", "open", "high", "low", "close", "count"])
+
+# --- Encoding ---
+
+def _shuffle(values):
+    """Groups the bytes of 8-byte values by significance, which compresses far better."""
+    return np.ascontiguousarray(values).view(np.uint8).reshape(-1, 8).T.tobytes()
+
+def _unshuffle(data, count, dtype):
+    return np.frombuffer(data, np.uint8).reshape(8, count).T.copy().view(dtype).ravel()
+
+def encode_segment(kind, source, timestamps_ms, columns):
+    """
+    Encodes one segment.
+
+    Args:
+        kind (int): _TICKS (one price column) or _BARS (open, high, low, close, count).
+        source (str): Where the rows came from, e.g. the price provider's name.
+        timestamps_ms (numpy.ndarray): Sorted epoch milliseconds.
+        columns (list): float64 arrays, one per column, as long as timestamps_ms.
+
+    Returns:
+        bytes: The segment, ready to append to a history file.
+    """
+    timestamps_ms = np.asarray(timestamps_ms, dtype="<i8")
+    deltas = np.diff(timestamps_ms, prepend=np.int64(0))  # The first delta is the absolute time
+    raw = _shuffle(deltas) + b"".join(_shuffle(np.asarray(column, dtype="<f8")) for column in columns)
+    payload = zlib.compress(raw, 6)
+    source_bytes = source.encode("utf-8")[:255]
+    return _HEADER.pack(_MAGIC, kind, len(source_bytes), len(timestamps_ms), len(payload)) + source_bytes + payload
+
+def decode_segments(data):
+    """Yields (kind, source, timestamps_ms, columns) for each segment, ignoring a torn tail."""
+    offset = 0
+    while offset + _HEADER.size <= len(data):
+        magic, kind, source_length, count, payload_length = _HEADER.unpack_from(data, offset)
+        source_start = offset + _HEADER.size
+        end = source_start + source_length + payload_length
+        if magic != _MAGIC or end > len(data):
+            logger.warning("Ignoring %d unreadable bytes at the end of a price history file.", len(data) - offset)
+            return
+        source = data[source_start:source_start + source_length].decode("utf-8", "replace")
+        raw = zlib.decompress(data[source_start + source_length:end])
+        width = count * 8
+        timestamps = np.cumsum(_unshuffle(raw[:width], count, "<i8"))
+        columns = [_unshuffle(raw[start:start + width], count, "<f8") for start in range(width, len(raw), width)]
+        yield kind, source, timestamps, columns
+        offset = end
+
+# --- Files and Periods ---
+
+def _utc(ms):
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+
+def _to_ms(moment):
+    """Accepts epoch seconds or a datetime and returns epoch milliseconds."""
+    if isinstance(moment, datetime):
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        return int(moment.timestamp() * 1000)
+    return int(moment * 1000)
+
+def _file_name(tier, ms):
+    moment = _utc(ms)
+    if tier == "ticks":
+        return moment.strftime("ticks-%Y-%m-%d.bin")
+    if tier == "minute":
+        return moment.strftime("minute-%Y-%m.bin")
+    if tier == "hour":
+        return moment.strftime("hour-%Y.bin")
+    return "day.bin"
+
+def _file_range(name):
+    """Returns the [start, end) epoch milliseconds a history file covers, from its name."""
+    tier, _, stamp = name[:-len(".bin")].partition("-")
+    if tier == "ticks":
+        start = datetime.strptime(stamp, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+        return _to_ms(start), _to_ms(start) + _DAY_MS
+    if tier == "minute":
+        start = datetime.strptime(stamp, "%Y-%m").replace(tzinfo=timezone.utc)
+        end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+        return _to_ms(start), _to_ms(end)
+    if tier == "hour":
+        start = datetime(int(stamp), 1, 1, tzinfo=timezone.utc)
+        return _to_ms(start), _to_ms(start.replace(year=start.year + 1))
+    return -2**62, 2**62
+
+def _tier_of(name):
+    return name.partition("-")[0] if "-" in name else name[:-len(".bin")]
+
+def _split_by_file(tier, timestamps_ms):
+    """Maps each file name to the slice of sorted timestamps that belongs in it."""
+    days = timestamps_ms // _DAY_MS
+    boundaries = np.flatnonzero(np.diff(days)) + 1
+    groups = {}
+    for start, end in zip(np.r_[0, boundaries], np.r_[boundaries, len(days)]):
+        name = _file_name(tier, int(timestamps_ms[start]))
+        first, _ = groups.get(name, (start, end))
+        groups[name] = (first, end)  # Days of one file are contiguous in sorted input
+    return groups
+
+def aggregate(timestamps_ms, open_, high, low, close, count, resolution_ms):
+    """Merges sorted bars into bars of `resolution_ms`, aligned to UTC multiples of it."""
+    if len(timestamps_ms) == 0:
+        return Bars(*(np.empty(0, dtype=dtype) for dtype in (np.int64,) + (np.float64,) * 5))
+    buckets = timestamps_ms // resolution_ms * resolution_ms
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(buckets)] - 1
+    return Bars(buckets[starts], open_[starts], np.maximum.reduceat(high, starts),
+                np.minimum.reduceat(low, starts), close[ends], np.add.reduceat(count, starts))
+
+# --- Store ---
+
+class PriceHistory:
+    """
+    Per-ticker price history with tiered roll-ups and retention.
+
+    record() only appends to an in-memory buffer, so recording costs the fetching
+    thread no I/O. A background thread (start_background) writes buffered ticks as
+    one compressed segment per ticker every FLUSH_INTERVAL, and runs compact() every
+    COMPACT_INTERVAL to roll files that have aged past their tier's retention into
+    the next coarser tier. Queries read only the files whose period overlaps the
+    requested range.
+    """
+
+    def __init__(self, root=None):
+        self._root = root
+        self._pending = {}  # (ticker, source) -> ([timestamps_ms], [prices])
+        self._pending_count = 0
+        self._last_recorded = {}  # (ticker, source) -> timestamp_ms of the last quote buffered
+        self._lock = threading.Lock()  # Guards the buffer
+        self._io_lock = threading.RLock()  # Serializes file writes, compaction and reads
+        self._last_compact = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()  # Set when the buffer reaches FLUSH_TICKS
+
+    @property
+    def root(self):
+        if self._root is None:
+            self._root = os.path.join(os.path.dirname(db.get_db_path()), "history")
+        return self._root
+
+    def _ticker_dir(self, ticker):
+        return os.path.join(self.root, quote(ticker, safe=""))
+
+    # --- Recording ---
+
+    def record(self, ticker, price, timestamp=None, source="unknown"):
+        """Buffers one observed price. `timestamp` is epoch seconds (default now)."""
+        if price is None:
+            return
+        ms = _to_ms(time.time() if timestamp is None else timestamp)
+        with self._lock:
+            timestamps, prices = self._pending.setdefault((ticker, source), ([], []))
+            timestamps.append(ms)
+            prices.append(float(price))
+            self._pending_count += 1
+            full = self._pending_count >= FLUSH_TICKS
+        if full:
+            self._wake.set()
+
+    def record_quotes(self, quotes, timestamp=None, source="unknown"):
+        """
+        Buffers a batch of quotes as returned by get_current_prices (ticker -> {'price': ...}).
+
+        Each quote is stamped with its own 'time' if it has one, else with `timestamp`
+        (default now). A quote whose time has not advanced since the last one recorded
+        for its ticker, such as a cached response or a closed market, is skipped.
+        """
+        default_ms = _to_ms(time.time() if timestamp is None else timestamp)
+        with self._lock:
+            for ticker, data in quotes.items():
+                price = data.get("price")
+                if price is None:
+                    continue
+                moment = data.get("time")
+                ms = default_ms if moment is None else _to_ms(moment)
+                key = (ticker, source)
+                if ms <= self._last_recorded.get(key, -2**62):
+                    continue
+                self._last_recorded[key] = ms
+                timestamps, prices = self._pending.setdefault(key, ([], []))
+                timestamps.append(ms)
+                prices.append(float(price))
+                self._pending_count += 1
+            full = self._pending_count >= FLUSH_TICKS
+        if full:
+            self._wake.set()
+
+    # --- Background Writer ---
+
+    def start_background(self):
+        """Starts the thread that flushes the buffer and compacts the files."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="price-history", daemon=True)
+        self._thread.start()
+
+    def stop_background(self, timeout=None):
+        """Stops the background thread after its current pass. Does not flush."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(FLUSH_INTERVAL)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception("Error writing price history: %s", e)
+            if self._last_compact is None or time.monotonic() - self._last_compact >= COMPACT_INTERVAL:
+                self._last_compact = time.monotonic()
+                try:
+                    self.compact()
+                except Exception as e:
+                    logger.exception("Error compacting price history: %s", e)
+
+    def flush(self):
+        """Writes every buffered tick to its ticker's tick files."""
+        with self._lock:
+            pending, self._pending, self._pending_count = self._pending, {}, 0
+        if not pending:
+            return
+        with self._io_lock:
+            for (ticker, source), (timestamps, prices) in pending.items():
+                timestamps = np.asarray(timestamps, dtype=np.int64)
+                prices = np.asarray(prices, dtype=np.float64)
+                order = np.argsort(timestamps, kind="stable")
+                try:
+                    self._append(ticker, "ticks", _TICKS, source, timestamps[order], [prices[order]])
+                except OSError as e:
+                    logger.error("Could not write price history for %s: %s", ticker, e)
+
+    def _append(self, ticker, tier, kind, source, timestamps_ms, columns):
+        """Appends sorted rows to the files of a tier. Caller holds the I/O lock."""
+        directory = self._ticker_dir(ticker)
+        os.makedirs(directory, exist_ok=True)
+        for name, (start, end) in _split_by_file(tier, timestamps_ms).items():
+            segment = encode_segment(kind, source, timestamps_ms[start:end], [column[start:end] for column in columns])
+            with open(os.path.join(directory, name), "ab") as history_file:
+                history_file.write(segment)
+
+    # --- Roll-Ups and Retention ---
+
+    def compact(self, now=None):
+        """
+        Rolls files older than their tier's retention into the next tier and deletes them.
+
+        A file is rolled up once its whole period is past the retention cut-off, so a
+        minute file goes in one piece when the last day of its month expires.
+        """
+        now_ms = _to_ms(time.time() if now is None else now)
+        self.flush()
+        if not os.path.isdir(self.root):
+            return
+        with self._io_lock:
+            for directory_name in os.listdir(self.root):
+                ticker = unquote(directory_name)
+                for tier, (coarser, setting, default_days) in ROLLUPS.items():
+                    days = settings.get_float(setting, default_days)
+                    if days <= 0:
+                        continue  # Keep this tier forever
+                    cutoff = now_ms - int(days * _DAY_MS)
+                    for name in self._files(ticker, tier):
+                        if _file_range(name)[1] > cutoff:
+                            continue
+                        path = os.path.join(self._ticker_dir(ticker), name)
+                        timestamps, open_, high, low, close, count, sources = self._read_bars(path)
+                        bars = aggregate(timestamps, open_, high, low, close, count, _TIER_RESOLUTIONS_MS[coarser])
+                        if len(bars.timestamps):
+                            self._append(ticker, coarser, _BARS, ",".join(sorted(sources)), bars.timestamps, list(bars[1:]))
+                        os.remove(path)
+                        logger.debug("Rolled %s/%s up into %s bars.", ticker, name, coarser)
+
+    def _files(self, ticker, tier=None, start_ms=None, end_ms=None):
+        """Lists a ticker's history files, optionally of one tier and overlapping a range."""
+        directory = self._ticker_dir(ticker)
+        if not os.path.isdir(directory):
+            return []
+        names = []
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".bin") or (tier is not None and _tier_of(name) != tier):
+                continue
+            file_start, file_end = _file_range(name)
+            if (start_ms is not None and file_end <= start_ms) or (end_ms is not None and file_start >= end_ms):
+                continue
+            names.append(name)
+        return names
+
+    def _read_bars(self, path):
+        """Reads a file of any tier as sorted bars; ticks become single-tick bars."""
+        with open(path, "rb") as history_file:
+            data = history_file.read()
+        parts, sources = [], set()
+        for kind, source, timestamps, columns in decode_segments(data):
+            if source:
+                sources.update(source.split(","))
+            if kind == _TICKS:
+                price = columns[0]
+                parts.append((timestamps, price, price, price, price, np.ones(len(price))))
+            else:
+                parts.append((timestamps, *columns))
+        if not parts:
+            empty = np.empty(0)
+            return np.empty(0, dtype=np.int64), empty, empty, empty, empty, empty, sources
+        merged = [np.concatenate(column) for column in zip(*parts)]
+        order = np.argsort(merged[0], kind="stable")
+        return (*(column[order] for column in merged), sources)
+
+    # --- Queries ---
+
+    def get_ticks(self, ticker, start=None, end=None, source=None):
+        """
+        Returns the raw ticks still kept for a ticker, oldest first.
+
+        Args:
+            ticker (str): The ticker.
+            start, end (float or datetime, optional): Epoch seconds or datetimes bounding
+                the range [start, end).
+            source (str, optional): Only ticks recorded from this source.
+
+        Returns:
+            Ticks: timestamps (epoch seconds), prices and sources, as NumPy arrays.
+        """
+        start_ms = None if start is None else _to_ms(start)
+        end_ms = None if end is None else _to_ms(end)
+        parts = []
+        with self._io_lock:
+            for name in self._files(ticker, "ticks", start_ms, end_ms):
+                with open(os.path.join(self._ticker_dir(ticker), name), "rb") as history_file:
+                    data = history_file.read()
+                for _, segment_source, timestamps, columns in decode_segments(data):
+                    parts.append((timestamps, columns[0], segment_source))
+        with self._lock:
+            for (pending_ticker, pending_source), (timestamps, prices) in self._pending.items():
+                if pending_ticker == ticker:
+                    parts.append((np.asarray(timestamps, dtype=np.int64), np.asarray(prices, dtype=np.float64), pending_source))
+
+        if source is not None:
+            parts = [part for part in parts if part[2] == source]
+        if not parts:
+            return Ticks(np.empty(0), np.empty(0), np.empty(0, dtype=object))
+        timestamps = np.concatenate([part[0] for part in parts])
+        prices = np.concatenate([part[1] for part in parts])
+        sources = np.concatenate([np.full(len(part[0]), part[2], dtype=object) for part in parts])
+        keep = np.ones(len(timestamps), dtype=bool)
+        if start_ms is not None:
+            keep &= timestamps >= start_ms
+        if end_ms is not None:
+            keep &= timestamps < end_ms
+        order = np.argsort(timestamps[keep], kind="stable")
+        return Ticks(timestamps[keep][order] / 1000.0, prices[keep][order], sources[keep][order])
+
+    def get_bars(self, ticker, start=None, end=None, resolution="minute"):
+        """
+        Returns OHLC bars for a ticker, merged from every tier that covers the range.
+
+        Where only coarser data is left (e.g. hour bars for last year), those bars are
+        returned as they are rather than split up.
+
+        Args:
+            ticker (str): The ticker.
+            start, end (float or datetime, optional): Range [start, end), as for get_ticks.
+            resolution (str or int): "minute", "hour", "day" or a bar length in seconds.
+
+        Returns:
+            Bars: timestamps (epoch seconds of each bar's start), open, high, low, close
+                and count (ticks per bar), as NumPy arrays.
+        """
+        resolution_ms = int(RESOLUTIONS.get(resolution, resolution) * 1000)
+        start_ms = None if start is None else _to_ms(start)
+        end_ms = None if end is None else _to_ms(end)
+        parts = []
+        with self._io_lock:
+            for name in self._files(ticker, None, start_ms, end_ms):
+                timestamps, open_, high, low, close, count, _ = self._read_bars(os.path.join(self._ticker_dir(ticker), name))
+                parts.append((timestamps, open_, high, low, close, count))
+        with self._lock:
+            for (pending_ticker, _), (timestamps, prices) in self._pending.items():
+                if pending_ticker == ticker:
+                    price = np.asarray(prices, dtype=np.float64)
+                    parts.append((np.asarray(timestamps, dtype=np.int64), price, price, price, price, np.ones(len(price))))
+
+        if not parts:
+            bars = aggregate(np.empty(0, dtype=np.int64), *(np.empty(0),) * 5, resolution_ms)
+        else:
+            merged = [np.concatenate(column) for column in zip(*parts)]
+            keep = np.ones(len(merged[0]), dtype=bool)
+            if start_ms is not None:
+                keep &= merged[0] >= start_ms
+            if end_ms is not None:
+                keep &= merged[0] < end_ms
+            order = np.argsort(merged[0][keep], kind="stable")
+            bars = aggregate(*(column[keep][order] for column in merged), resolution_ms)
+        return bars._replace(timestamps=bars.timestamps / 1000.0)
+
+    def tickers(self):
+        """Returns the tickers that have stored history."""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(unquote(name) for name in os.listdir(self.root))
+
+# Shared store fed by the quote cache
+store = PriceHistory()
+atexit.register(store.flush)
+
+def _on_fetch(quotes, fetched_at):
+    store.record_quotes(quotes, fetched_at, quote_cache.get_provider().name)
+
+def start():
+    """Starts recording every quote fetched through the shared quote cache."""
+    store.start_background()
+    quote_cache.shared_cache.add_fetch_listener(_on_fetch)
+
+def stop():
+    """Stops recording and writes out the buffered ticks."""
+    quote_cache.shared_cache.remove_fetch_listener(_on_fetch)
+    store.stop_background()
+    store.flush()
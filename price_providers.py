@@ -0,0 +1,285 @@
+import threading
+import time
+from collections import deque
+import logging
+import numpy as np
+import settings
+import ticker_metadata
+import trading_calendar
+import yfinance_client as yf_client
+
+logger = logging.getLogger(__name__)
+
+# Rows the replay provider reads from its file at a time
+REPLAY_CHUNK_ROWS = 100_000
+
+class PriceProvider:
+    """
+    Source of current prices for the quote cache, and through it the alerter and the dashboard.
+
+    Subclasses implement get_current_prices() with the same contract as
+    yfinance_client.get_current_prices: a dict mapping each ticker that has a price to
+    {'price': ..., 'full_name': ...}, plus the quote's 'time' in epoch seconds if the
+    source knows it. Tickers without a price are simply left out.
+    """
+
+    name = None
+    # Seconds the quote cache may serve a price from this provider; None keeps the cache default
+    cache_ttl = None
+
+    def get_current_prices(self, tickers):
+        raise NotImplementedError
+
+    def is_market_open(self, ticker):
+        """Returns True if prices for the ticker can currently change."""
+        return True
+
+    def seconds_until_open(self, ticker):
+        return 0.0
+
+    def begin_cycle(self):
+        """Called by the alerter at the start of every check cycle, before it fetches."""
+
+class YahooPriceProvider(PriceProvider):
+    """Live prices from Yahoo Finance, following real exchange hours."""
+
+    name = "yahoo"
+
+    def get_current_prices(self, tickers):
+        return yf_client.get_current_prices(tickers)
+
+    def is_market_open(self, ticker):
+        # The exchange time zone Yahoo reported places tickers whose suffix is not recognised
+        return trading_calendar.is_market_open(ticker, timezone_name=ticker_metadata.timezone_for(ticker))
+
+    def seconds_until_open(self, ticker):
+        return trading_calendar.seconds_until_open(ticker, timezone_name=ticker_metadata.timezone_for(ticker))
+
+class ScriptedPriceProvider(PriceProvider):
+    """
+    In-memory prices set from code, for tests and load generation.
+
+    set_price() fixes a ticker's price; push() queues a sequence of prices that are
+    served one per fetch, after which the last one sticks.
+    """
+
+    name = "scripted"
+    cache_ttl = 0
+
+    def __init__(self, prices=None):
+        """
+        Args:
+            prices (dict, optional): Initial prices, mapping tickers to floats.
+        """
+        self._prices = {}
+        self._names = {}
+        self._scripts = {}
+        self._lock = threading.Lock()
+        for ticker, price in (prices or {}).items():
+            self.set_price(ticker, price)
+
+    def set_price(self, ticker, price, full_name=None):
+        with self._lock:
+            self._prices[ticker] = float(price)
+            self._scripts.pop(ticker, None)
+            if full_name:
+                self._names[ticker] = full_name
+
+    def push(self, ticker, prices):
+        """Queues prices for a ticker; each fetch consumes the next one."""
+        with self._lock:
+            self._scripts.setdefault(ticker, deque()).extend(float(price) for price in prices)
+
+    def remove(self, ticker):
+        with self._lock:
+            self._prices.pop(ticker, None)
+            self._scripts.pop(ticker, None)
+
+    def get_current_prices(self, tickers):
+        prices = {}
+        with self._lock:
+            for ticker in tickers:
+                script = self._scripts.get(ticker)
+                if script:
+                    self._prices[ticker] = script.popleft()
+                if ticker in self._prices:
+                    prices[ticker] = {'price': self._prices[ticker], 'full_name': self._names.get(ticker, ticker)}
+        return prices
+
+class ReplayPriceProvider(PriceProvider):
+    """
+    Replays timestamped ticks for many tickers from a CSV or Parquet file.
+
+    The file needs 'timestamp', 'ticker' and 'price' columns, may have a 'full_name'
+    column, and must be sorted by timestamp. It is streamed in chunks of
+    REPLAY_CHUNK_ROWS rows, so memory stays flat however long the file is. Each fetch
+    returns, per ticker, the last tick at or before the replay clock, with that tick's
+    timestamp as the quote 'time'. With a positive speed the clock starts at the first
+    fetch and runs `speed` times faster than real time; with speed <= 0 it is in step
+    mode and moves to the next tick timestamp once per alerter cycle (see begin_cycle),
+    so a run goes exactly as fast as the pipeline consuming it and every fetch within a
+    cycle sees the same instant.
+    """
+
+    name = "replay"
+    cache_ttl = 0
+
+    def __init__(self, path, speed=1.0):
+        """
+        Args:
+            path (str): A .csv or .parquet file of ticks, sorted by timestamp.
+            speed (float): Replay seconds per real second, or <= 0 for step mode.
+        """
+        self.path = path
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._check_columns(path)
+        self.rewind()
+
+    def _check_columns(self, path):
+        if path.lower().endswith(".parquet"):
+            columns = self._parquet_columns(path)
+        else:
+            import pandas as pd  # Installed with yfinance
+            columns = pd.read_csv(path, nrows=0).columns
+        missing = {"timestamp", "ticker", "price"} - set(columns)
+        if missing:
+            raise ValueError(f"Replay file {path} is missing columns: {', '.join(sorted(missing))}")
+        self._has_names = "full_name" in columns
+
+    @staticmethod
+    def _parquet_columns(path):
+        try:
+            import pyarrow.parquet as pq  # Needs pyarrow or fastparquet
+        except ImportError:
+            import fastparquet
+            return fastparquet.ParquetFile(path).columns
+        return pq.ParquetFile(path).schema_arrow.names
+
+    def _read_chunks(self):
+        """Yields the file as DataFrames of at most REPLAY_CHUNK_ROWS rows."""
+        columns = ["timestamp", "ticker", "price"] + (["full_name"] if self._has_names else [])
+        if self.path.lower().endswith(".parquet"):
+            try:
+                import pyarrow.parquet as pq
+            except ImportError:
+                # fastparquet streams by row group, however large the writer made them
+                import fastparquet
+                yield from fastparquet.ParquetFile(self.path).iter_row_groups(columns=columns)
+                return
+            for batch in pq.ParquetFile(self.path).iter_batches(batch_size=REPLAY_CHUNK_ROWS, columns=columns):
+                yield batch.to_pandas()
+        else:
+            import pandas as pd
+            yield from pd.read_csv(self.path, usecols=columns, chunksize=REPLAY_CHUNK_ROWS)
+
+    def _next_chunk(self):
+        """Loads the next chunk into (seconds, tickers, prices). Returns False at the end of the file."""
+        import pandas as pd
+        for frame in self._chunks:
+            frame = frame.dropna(subset=["timestamp", "ticker", "price"])
+            if frame.empty:
+                continue
+            timestamps = pd.to_datetime(frame["timestamp"], utc=True)
+            seconds = (timestamps - pd.Timestamp(0, tz="UTC")).dt.total_seconds().to_numpy(dtype=np.float64)
+            tickers = frame["ticker"].astype(str).to_numpy()
+            if self._has_names:
+                named = frame["full_name"].notna().to_numpy()
+                self._names.update(zip(tickers[named], frame["full_name"][named].astype(str)))
+            self._chunk = (seconds, tickers, frame["price"].to_numpy(dtype=np.float64))
+            self._position = 0
+            if self.start_time is None:
+                self.start_time = float(seconds[0])
+            return True
+        self._chunk = None
+        return False
+
+    def _peek_time(self):
+        """Returns the timestamp of the next unreplayed tick, or None at the end of the file."""
+        if self._chunk is not None and self._position >= len(self._chunk[0]):
+            self._next_chunk()
+        return None if self._chunk is None else float(self._chunk[0][self._position])
+
+    def _advance_to(self, moment):
+        """Applies every tick at or before `moment`. Caller holds the lock."""
+        while self._peek_time() is not None and self._peek_time() <= moment:
+            seconds, tickers, prices = self._chunk
+            end = self._position + int(np.searchsorted(seconds[self._position:], moment, side="right"))
+            end = max(end, self._position + 1)  # A tick out of order is applied when reached
+            self._latest.update(zip(tickers[self._position:end], zip(prices[self._position:end].tolist(), seconds[self._position:end].tolist())))
+            self.tick_count += end - self._position
+            self._position = end
+        self._clock = max(self._clock, moment)
+
+    def tickers(self):
+        """Returns the tickers replayed so far."""
+        with self._lock:
+            return list(self._latest)
+
+    def current_time(self):
+        """Returns the replay clock in epoch seconds."""
+        with self._lock:
+            return self._clock
+
+    @property
+    def finished(self):
+        """True once every tick in the file has been replayed."""
+        with self._lock:
+            return self._peek_time() is None
+
+    def rewind(self):
+        with self._lock:
+            self._chunks = self._read_chunks()
+            self._chunk = ((), (), ())
+            self._position = 0
+            self._latest = {}  # ticker -> (last replayed price, its timestamp)
+            self._names = {}
+            self._clock = -np.inf
+            self._started = None
+            self.start_time = None
+            self.tick_count = 0  # Ticks replayed so far
+            self._next_chunk()
+
+    def begin_cycle(self):
+        """In step mode, moves the clock to the next tick timestamp."""
+        if self.speed <= 0:
+            with self._lock:
+                upcoming = self._peek_time()
+                if upcoming is not None:
+                    self._advance_to(upcoming)
+
+    def get_current_prices(self, tickers):
+        with self._lock:
+            if self.speed > 0 and self.start_time is not None:
+                if self._started is None:
+                    self._started = time.monotonic()
+                self._advance_to(self.start_time + (time.monotonic() - self._started) * self.speed)
+            latest = {ticker: self._latest[ticker] for ticker in tickers if ticker in self._latest}
+        return {ticker: {'price': price, 'full_name': self._names.get(ticker, ticker), 'time': moment}
+                for ticker, (price, moment) in latest.items()}
+
+PROVIDERS = {
+    YahooPriceProvider.name: YahooPriceProvider,
+    ReplayPriceProvider.name: ReplayPriceProvider,
+    ScriptedPriceProvider.name: ScriptedPriceProvider,
+}
+
+def create_provider(name=None):
+    """
+    Builds the provider named by the price_provider setting (or `name`).
+
+    The replay provider reads the replay_file and replay_speed settings. Falls back to
+    Yahoo if the setting is unknown or the replay file cannot be loaded.
+    """
+    name = name or settings.get("price_provider") or YahooPriceProvider.name
+    if name == ReplayPriceProvider.name:
+        path = settings.get("replay_file")
+        try:
+            return ReplayPriceProvider(path, speed=settings.get_float("replay_speed", 1.0))
+        except Exception as e:
+            logger.error("Could not load replay file %s: %s. Using Yahoo prices.", path, e)
+            return YahooPriceProvider()
+    if name not in PROVIDERS:
+        logger.warning("Unknown price provider '%s'. Using Yahoo prices.", name)
+        return YahooPriceProvider()
+    return PROVIDERS[name]()
@@ -0,0 +1,198 @@
+import threading
+import time
+from collections import OrderedDict
+import logging
+import metrics
+import price_providers
+import settings
+
+logger = logging.getLogger(__name__)
+
+# Default number of seconds a fetched quote is served from memory
+DEFAULT_TTL = 15
+# Maximum number of tickers kept in memory before the least recently used are evicted
+DEFAULT_MAX_ENTRIES = 5000
+
+LOOKUPS = metrics.registry.counter("stockalert_quote_cache_lookups_total", "Quote cache lookups by outcome.", ("result",))
+
+class QuoteCache:
+    """
+    In-process quote store shared by the alerter, the dashboard and the UI.
+
+    Each ticker is cached for a TTL (globally or per ticker), the least recently
+    used tickers are evicted once max_entries is reached, and concurrent requests
+    for the same ticker are coalesced so only one network request goes out.
+    """
+
+    def __init__(self, fetcher, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self._fetcher = fetcher
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # ticker -> (fetched_at, quote)
+        self._ticker_ttls = {}
+        self._in_flight = {}  # ticker -> threading.Event set when its fetch finishes
+        self._fetch_listeners = []
+        self._lock = threading.Lock()
+
+    def add_fetch_listener(self, callback):
+        """
+        Registers callback(quotes, fetched_at) to run after every fetch from the price source.
+
+        Called on the fetching thread with only the newly fetched quotes (never cache
+        hits) and the wall-clock time of the fetch. A provider may still return a quote it
+        returned before, e.g. from the HTTP cache or a market that is closed; the quote's
+        own 'time', where present, tells them apart.
+        """
+        with self._lock:
+            if callback not in self._fetch_listeners:
+                self._fetch_listeners.append(callback)
+
+    def remove_fetch_listener(self, callback):
+        with self._lock:
+            if callback in self._fetch_listeners:
+                self._fetch_listeners.remove(callback)
+
+    def set_fetcher(self, fetcher, ttl=DEFAULT_TTL):
+        """Switches to a different price source and forgets everything cached from the old one."""
+        with self._lock:
+            self._fetcher = fetcher
+            self.ttl = ttl
+            self._entries.clear()
+
+    def set_ttl(self, ticker, ttl):
+        """Overrides the TTL for a single ticker. Pass None to restore the default."""
+        with self._lock:
+            if ttl is None:
+                self._ticker_ttls.pop(ticker, None)
+            else:
+                self._ticker_ttls[ticker] = ttl
+
+    def invalidate(self, tickers=None):
+        """Drops the given tickers from the cache, or everything if tickers is None."""
+        with self._lock:
+            if tickers is None:
+                self._entries.clear()
+            else:
+                for ticker in tickers:
+                    self._entries.pop(ticker, None)
+
+    def _lookup(self, ticker, max_age, now):
+        """Returns the cached quote if it is younger than max_age. Caller holds the lock."""
+        entry = self._entries.get(ticker)
+        if entry is None:
+            return None
+        fetched_at, quote = entry
+        if max_age is None:
+            max_age = self._ticker_ttls.get(ticker, self.ttl)
+        if now - fetched_at > max_age:
+            return None
+        self._entries.move_to_end(ticker)
+        return quote
+
+    def _store(self, quotes, now):
+        """Adds freshly fetched quotes and evicts the oldest entries. Caller holds the lock."""
+        for ticker, quote in quotes.items():
+            self._entries[ticker] = (now, quote)
+            self._entries.move_to_end(ticker)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_current_prices(self, tickers, max_age=None):
+        """
+        Returns quotes for the given tickers, fetching only those that are missing or stale.
+
+        Args:
+            tickers (list): A list of stock ticker symbols.
+            max_age (float, optional): Accept cached quotes up to this many seconds old.
+                Defaults to the ticker's TTL.
+
+        Returns:
+            dict: A dictionary mapping each ticker to {'price': ..., 'full_name': ...}.
+        """
+        if not tickers:
+            return {}
+
+        prices = {}
+        to_fetch = []
+        to_wait = {}
+        with self._lock:
+            now = time.monotonic()
+            for ticker in dict.fromkeys(tickers):
+                quote = self._lookup(ticker, max_age, now)
+                if quote is not None:
+                    prices[ticker] = quote
+                    LOOKUPS.inc(result="hit")
+                elif ticker in self._in_flight:
+                    # Another thread is already fetching this ticker; wait for its result
+                    to_wait[ticker] = self._in_flight[ticker]
+                else:
+                    self._in_flight[ticker] = threading.Event()
+                    to_fetch.append(ticker)
+
+        if to_wait:
+            LOOKUPS.inc(len(to_wait), result="coalesced")
+        if to_fetch:
+            LOOKUPS.inc(len(to_fetch), result="miss")
+            fetched = {}
+            try:
+                fetched = self._fetcher(to_fetch)
+            finally:
+                with self._lock:
+                    self._store(fetched, time.monotonic())
+                    for ticker in to_fetch:
+                        self._in_flight.pop(ticker).set()
+            prices.update(fetched)
+            if fetched:
+                fetched_at = time.time()
+                for listener in list(self._fetch_listeners):
+                    try:
+                        listener(fetched, fetched_at)
+                    except Exception as e:
+                        logger.exception("Error in quote fetch listener: %s", e)
+
+        for ticker, done in to_wait.items():
+            done.wait()
+            with self._lock:
+                entry = self._entries.get(ticker)
+            # A failed fetch stores nothing, so only accept an entry written after we started waiting
+            if entry is not None and entry[0] >= now:
+                prices[ticker] = entry[1]
+
+        return prices
+
+# Shared store used by every caller in the application
+_provider = price_providers.YahooPriceProvider()
+_follows_settings = False  # True when the provider came from settings and should follow changes to them
+shared_cache = QuoteCache(_provider.get_current_prices)
+
+PROVIDER_SETTINGS = ("price_provider", "replay_file", "replay_speed")
+
+def use_provider(provider=None):
+    """
+    Makes the shared cache fetch from a price provider.
+
+    Args:
+        provider (PriceProvider, optional): Defaults to the one chosen in settings, which
+            is then replaced whenever those settings change.
+    """
+    global _provider, _follows_settings
+    _follows_settings = provider is None
+    _provider = provider or price_providers.create_provider()
+    ttl = DEFAULT_TTL if _provider.cache_ttl is None else _provider.cache_ttl
+    shared_cache.set_fetcher(_provider.get_current_prices, ttl=ttl)
+    logger.info("Using the %s price provider.", _provider.name)
+    return _provider
+
+def _on_provider_setting(key, value, old):
+    if _follows_settings:
+        use_provider()
+
+settings.subscribe(_on_provider_setting, keys=PROVIDER_SETTINGS)
+
+def get_provider():
+    """Returns the price provider behind the shared cache."""
+    return _provider
+
+def get_current_prices(tickers, max_age=None):
+    """Fetches prices through the shared quote cache. See QuoteCache.get_current_prices."""
+    return shared_cache.get_current_prices(tickers, max_age=max_age)
@@ -0,0 +1,171 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+# --- Rate Limiting ---
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, holding at most `burst`.
+
+    Every caller that shares a bucket shares its budget, so concurrent workers
+    together never exceed the rate, while short bursts after idle time go out at once.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def configure(self, rate, burst):
+        with self._lock:
+            self._refill()
+            self.rate, self.burst = float(rate), float(burst)
+            self._tokens = min(self._tokens, self.burst)
+
+    def _refill(self):
+        """Adds the tokens earned since the last update. Caller holds the lock."""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout=None):
+        """
+        Takes one token, sleeping until one is available.
+
+        Args:
+            timeout (float, optional): Give up if no token is available within this many seconds.
+
+        Returns:
+            bool: True if a token was taken, False on timeout.
+        """
+        if self.rate <= 0:
+            return True  # Unlimited
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+# --- Backoff ---
+
+def parse_retry_after(value):
+    """Returns the seconds a Retry-After header asks us to wait (delta-seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max(0.0, (moment - datetime.now(timezone.utc)).total_seconds())
+
+def backoff_delay(attempt, base, cap, retry_after=None):
+    """
+    Returns how long to wait before retry number `attempt` (0 for the first retry).
+
+    Uses "full jitter" (a uniform draw up to base * 2^attempt, capped) so clients that
+    failed together do not retry together, and never less than the server's Retry-After.
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+# --- Circuit Breaker ---
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+class CircuitBreaker:
+    """
+    Stops calls to an upstream that keeps failing.
+
+    After `failure_threshold` consecutive failures the circuit opens and allow()
+    returns False for `reset_timeout` seconds (or as long as a Retry-After asked).
+    Then one trial call is let through: success closes the circuit, failure opens it
+    again with the timeout doubled, up to `max_reset_timeout`.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, max_reset_timeout=600):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_until = 0.0
+        self._current_timeout = reset_timeout
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() >= self._opened_until:
+                return HALF_OPEN
+            return self._state
+
+    def retry_in(self):
+        """Seconds until the circuit lets a trial call through (0 if it is not open)."""
+        with self._lock:
+            return max(0.0, self._opened_until - time.monotonic()) if self._state == OPEN else 0.0
+
+    def allow(self):
+        """Returns True if a call may go out now. While half-open, only one call at a time does."""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if time.monotonic() < self._opened_until:
+                    return False
+                self._state = HALF_OPEN
+                self._trial_in_flight = False
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._current_timeout = self.reset_timeout
+            self._trial_in_flight = False
+
+    def record_failure(self, retry_after=None):
+        """
+        Counts a failed call.
+
+        Args:
+            retry_after (float, optional): The upstream asked us to wait this long (e.g. a
+                429's Retry-After); the circuit opens for at least that long right away.
+        """
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN:
+                self._current_timeout = min(self.max_reset_timeout, self._current_timeout * 2)
+                self._open(self._current_timeout)
+            elif retry_after is not None:
+                self._open(max(retry_after, 0.0))
+            elif self._failures >= self.failure_threshold:
+                self._open(self._current_timeout)
+            self._trial_in_flight = False
+
+    def _open(self, seconds):
+        """Caller holds the lock."""
+        self._state = OPEN
+        self._opened_until = max(self._opened_until, time.monotonic() + seconds)
@@ -0,0 +1,126 @@
+import logging
+import threading
+import database as db
+
+logger = logging.getLogger(__name__)
+
+class SettingsStore:
+    """
+    In-memory copy of the settings table.
+
+    The table is read once; after that get() is a dict lookup. set() and set_many()
+    write through to the database and then call the subscribers of every key whose
+    value changed, on the calling thread, after the write has committed.
+    """
+
+    def __init__(self):
+        self._values = None
+        self._subscribers = []  # (callback, set of keys or None for all)
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        if self._values is None:
+            values = db.get_all_settings()
+            with self._lock:
+                if self._values is None:
+                    self._values = values
+
+    def get(self, key, default=None):
+        """Returns a setting's value as stored (a string), or `default` if it is not set."""
+        values = self._values
+        if values is None:
+            self._ensure_loaded()
+            values = self._values
+        value = values.get(key)
+        return default if value is None else value
+
+    def get_int(self, key, default=0):
+        try:
+            return int(float(self.get(key, default)))
+        except (TypeError, ValueError):
+            return default
+
+    def get_float(self, key, default=0.0):
+        try:
+            return float(self.get(key, default))
+        except (TypeError, ValueError):
+            return default
+
+    def set(self, key, value):
+        """Saves one setting and notifies its subscribers if the value changed."""
+        self.set_many({key: value})
+
+    def set_many(self, values):
+        """Saves several settings in one transaction and notifies subscribers of the changed ones."""
+        self._ensure_loaded()
+        values = {key: None if value is None else str(value) for key, value in values.items()}
+        db.save_settings(values)
+        with self._lock:
+            changes = [(key, value, self._values.get(key)) for key, value in values.items() if self._values.get(key) != value]
+            updated = dict(self._values)
+            updated.update(values)
+            self._values = updated  # Readers see the old or the new dict, never a half-updated one
+        self._notify(changes)
+
+    def reload(self):
+        """Re-reads the table, e.g. after another process changed it, and notifies subscribers."""
+        values = db.get_all_settings()
+        with self._lock:
+            old = self._values or {}
+            self._values = values
+        changes = [(key, values.get(key), old.get(key)) for key in values.keys() | old.keys() if values.get(key) != old.get(key)]
+        self._notify(changes)
+
+    def subscribe(self, callback, keys=None):
+        """
+        Calls callback(key, new_value, old_value) whenever one of `keys` (or any key) changes.
+
+        Returns:
+            callable: Removes the subscription when called.
+        """
+        entry = (callback, None if keys is None else frozenset(keys))
+        with self._lock:
+            self._subscribers.append(entry)
+
+        def unsubscribe():
+            with self._lock:
+                if entry in self._subscribers:
+                    self._subscribers.remove(entry)
+        return unsubscribe
+
+    def _notify(self, changes):
+        if not changes:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback, keys in subscribers:
+            for key, new_value, old_value in changes:
+                if keys is None or key in keys:
+                    try:
+                        callback(key, new_value, old_value)
+                    except Exception as e:
+                        logger.exception("Error in settings subscriber for %s: %s", key, e)
+
+# Shared settings for the whole application
+store = SettingsStore()
+
+def get(key, default=None):
+    return store.get(key, default)
+
+def get_int(key, default=0):
+    return store.get_int(key, default)
+
+def get_float(key, default=0.0):
+    return store.get_float(key, default)
+
+def set(key, value):
+    store.set(key, value)
+
+def set_many(values):
+    store.set_many(values)
+
+def subscribe(callback, keys=None):
+    return store.subscribe(callback, keys)
+
+def reload():
+    store.reload()
@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+import database as db
+
+logger = logging.getLogger(__name__)
+
+# Seconds before stored metadata is written again by a quote that confirms it, or
+# refetched by lookup()
+METADATA_TTL = 7 * 24 * 3600
+
+TickerMetadata = namedtuple("TickerMetadata", ["ticker", "long_name", "exchange", "currency", "timezone", "last_verified"])
+
+class MetadataCache:
+    """
+    Long name, exchange, currency and time zone per ticker, backed by the ticker_metadata table.
+
+    Filled as a side effect of ordinary quote fetches (Yahoo sends these fields with
+    every price), so it never costs a request of its own during a refresh. A row is
+    only written when its fields change or it has not been confirmed for the TTL.
+    """
+
+    def __init__(self, ttl=METADATA_TTL):
+        self.ttl = ttl
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        if self._entries is None:
+            rows = db.get_all_ticker_metadata()
+            with self._lock:
+                if self._entries is None:
+                    self._entries = {row[0]: TickerMetadata(*row) for row in rows}
+
+    def get(self, ticker):
+        """Returns the stored TickerMetadata for a ticker, or None. Never touches the network."""
+        self._ensure_loaded()
+        return self._entries.get(ticker)
+
+    def record_quotes(self, quotes, fetched_at=None):
+        """
+        Stores the metadata carried by freshly fetched quotes.
+
+        Args:
+            quotes (dict): Maps tickers to quote dicts as returned by get_current_prices.
+            fetched_at (float, optional): Epoch seconds of the fetch. Defaults to now.
+        """
+        self._ensure_loaded()
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        rows = []
+        with self._lock:
+            for ticker, data in quotes.items():
+                if not (data.get('currency') or data.get('exchange') or data.get('timezone')):
+                    continue  # The provider sends no listing data (e.g. scripted prices)
+                old = self._entries.get(ticker)
+                long_name = data.get('full_name') if data.get('full_name') != ticker else None
+                fields = (long_name, data.get('exchange'), data.get('currency'), data.get('timezone'))
+                if old is not None:
+                    # Keep what we know when a quote leaves a field out
+                    fields = tuple(new if new is not None else known for new, known in zip(fields, old[1:5]))
+                    if fields == tuple(old[1:5]) and fetched_at - old.last_verified < self.ttl:
+                        continue
+                entry = TickerMetadata(ticker, *fields, fetched_at)
+                self._entries[ticker] = entry
+                rows.append(tuple(entry))
+        if rows:
+            try:
+                db.save_ticker_metadata(rows)
+            except Exception as e:
+                logger.error("Error saving ticker metadata: %s", e)
+
+    def lookup(self, ticker, max_age=None):
+        """
+        Returns a ticker's metadata, fetching a quote first if none is stored or it is stale.
+
+        For places where one request is acceptable, such as adding a stock. Returns None
+        if the ticker is unknown to the price provider.
+        """
+        entry = self.get(ticker)
+        max_age = self.ttl if max_age is None else max_age
+        if entry is None or time.time() - entry.last_verified > max_age:
+            import quote_cache  # quote_cache imports the providers, which read from this module
+            quotes = quote_cache.get_current_prices([ticker], max_age=0)
+            self.record_quotes(quotes)
+            entry = self.get(ticker)
+            if entry is None and ticker in quotes:
+                # Priced, but the provider sends no listing data
+                entry = TickerMetadata(ticker, quotes[ticker].get('full_name'), None, None, None, time.time())
+        return entry
+
+    def timezone_for(self, ticker):
+        """Returns the exchange time zone Yahoo reported for a ticker, or None."""
+        entry = self.get(ticker)
+        return entry.timezone if entry else None
+
+# Shared metadata for the whole application
+cache = MetadataCache()
+
+def get(ticker):
+    return cache.get(ticker)
+
+def lookup(ticker, max_age=None):
+    return cache.lookup(ticker, max_age)
+
+def timezone_for(ticker):
+    return cache.timezone_for(ticker)
+
+def _on_fetch(quotes, fetched_at):
+    cache.record_quotes(quotes, fetched_at)
+
+def start():
+    """Starts recording the metadata of every quote fetched through the shared quote cache."""
+    import quote_cache
+    quote_cache.shared_cache.add_fetch_listener(_on_fetch)
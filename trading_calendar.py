@@ -0,0 +1,246 @@
+import json
+from datetime import date, datetime, time as dtime, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+import settings
+
+# --- Holiday Rules ---
+# Only holidays that follow fixed rules are computed here. Exchanges with lunar
+# holidays (e.g. Seollal and Chuseok on KRX) need those dates added through the
+# "market_holidays" setting, a JSON object such as {"KRX": ["2026-02-16"]}.
+
+def _nth_weekday(year, month, weekday, n):
+    """Returns the n-th given weekday (0=Monday) of a month; n=-1 for the last one."""
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year, month + 1, 1) - timedelta(days=1) if month < 12 else date(year, 12, 31)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+def _easter(year):
+    """Returns Easter Sunday (anonymous Gregorian algorithm)."""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+def _us_observed(day):
+    """NYSE rule: Saturday holidays move to Friday, Sunday holidays to Monday."""
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+def _us_holidays(year):
+    holidays = {
+        _nth_weekday(year, 1, 0, 3),   # Martin Luther King Jr. Day
+        _nth_weekday(year, 2, 0, 3),   # Washington's Birthday
+        _easter(year) - timedelta(days=2),  # Good Friday
+        _nth_weekday(year, 5, 0, -1),  # Memorial Day
+        _us_observed(date(year, 7, 4)),
+        _nth_weekday(year, 9, 0, 1),   # Labor Day
+        _nth_weekday(year, 11, 3, 4),  # Thanksgiving
+        _us_observed(date(year, 12, 25)),
+    }
+    if year >= 2022:
+        holidays.add(_us_observed(date(year, 6, 19)))  # Juneteenth
+    new_year = date(year, 1, 1)
+    if new_year.weekday() != 5:  # No Friday substitute when New Year's Day is a Saturday
+        holidays.add(_us_observed(new_year))
+    return holidays
+
+def _uk_holidays(year):
+    holidays = {
+        _easter(year) - timedelta(days=2),  # Good Friday
+        _easter(year) + timedelta(days=1),  # Easter Monday
+        _nth_weekday(year, 5, 0, 1),   # Early May bank holiday
+        _nth_weekday(year, 5, 0, -1),  # Spring bank holiday
+        _nth_weekday(year, 8, 0, -1),  # Summer bank holiday
+    }
+    # New Year, Christmas and Boxing Day move to the next free weekday
+    for day in (date(year, 1, 1), date(year, 12, 25), date(year, 12, 26)):
+        while day.weekday() >= 5 or day in holidays:
+            day += timedelta(days=1)
+        holidays.add(day)
+    return holidays
+
+def _europe_holidays(year):
+    return {
+        date(year, 1, 1),
+        _easter(year) - timedelta(days=2),  # Good Friday
+        _easter(year) + timedelta(days=1),  # Easter Monday
+        date(year, 5, 1),
+        date(year, 12, 25),
+        date(year, 12, 26),
+    }
+
+def _xetra_holidays(year):
+    return _europe_holidays(year) | {date(year, 12, 24), date(year, 12, 31)}
+
+def _krx_holidays(year):
+    # Fixed-date public holidays plus the year-end closing day
+    return {date(year, month, day) for month, day in
+            ((1, 1), (3, 1), (5, 5), (6, 6), (8, 15), (10, 3), (10, 9), (12, 25), (12, 31))}
+
+def _jpx_holidays(year):
+    offset = year - 1980
+    holidays = {
+        date(year, 1, 1), date(year, 1, 2), date(year, 1, 3), date(year, 12, 31),  # Exchange year-end break
+        _nth_weekday(year, 1, 0, 2),   # Coming of Age Day
+        date(year, 2, 11), date(year, 2, 23), date(year, 4, 29),
+        date(year, 5, 3), date(year, 5, 4), date(year, 5, 5),
+        _nth_weekday(year, 7, 0, 3),   # Marine Day
+        date(year, 8, 11),
+        _nth_weekday(year, 9, 0, 3),   # Respect for the Aged Day
+        _nth_weekday(year, 10, 0, 2),  # Sports Day
+        date(year, 11, 3), date(year, 11, 23),
+        date(year, 3, int(20.8431 + 0.242194 * offset - offset // 4)),  # Vernal Equinox Day
+        date(year, 9, int(23.2488 + 0.242194 * offset - offset // 4)),  # Autumnal Equinox Day
+    }
+    # A holiday on a Sunday is observed on the next day that is not already a holiday
+    for day in sorted(holidays):
+        if day.weekday() == 6:
+            substitute = day + timedelta(days=1)
+            while substitute in holidays:
+                substitute += timedelta(days=1)
+            holidays.add(substitute)
+    return holidays
+
+# --- Exchanges ---
+
+class Exchange:
+    """Regular trading sessions, time zone and holidays of one exchange."""
+
+    def __init__(self, code, tz_name, sessions, holiday_rule=None, weekdays=range(5), always_open=False):
+        self.code = code
+        self.tz = ZoneInfo(tz_name)
+        self.sessions = [(dtime(*start), dtime(*end)) for start, end in sessions]
+        self._holiday_rule = holiday_rule
+        self.weekdays = set(weekdays)
+        self.always_open = always_open
+
+    def is_holiday(self, day):
+        return day in _holidays(self.code, day.year)
+
+    def is_trading_day(self, day):
+        return day.weekday() in self.weekdays and not self.is_holiday(day)
+
+    def is_open(self, moment=None):
+        """Returns True if the exchange is in a regular session at `moment` (default now)."""
+        if self.always_open:
+            return True
+        local = (moment or datetime.now(timezone.utc)).astimezone(self.tz)
+        if not self.is_trading_day(local.date()):
+            return False
+        return any(start <= local.time() < end for start, end in self.sessions)
+
+    def next_open(self, moment=None):
+        """Returns the next session start after `moment` as an aware datetime, or `moment` if open."""
+        moment = moment or datetime.now(timezone.utc)
+        if self.is_open(moment):
+            return moment
+        local = moment.astimezone(self.tz)
+        day = local.date()
+        for _ in range(366):
+            if self.is_trading_day(day):
+                for start, _end in self.sessions:
+                    opening = datetime.combine(day, start, tzinfo=self.tz)
+                    if opening > local:
+                        return opening
+            day += timedelta(days=1)
+        return moment
+
+EXCHANGES = {
+    "US": Exchange("US", "America/New_York", [((9, 30), (16, 0))], _us_holidays),
+    "KRX": Exchange("KRX", "Asia/Seoul", [((9, 0), (15, 30))], _krx_holidays),
+    "JPX": Exchange("JPX", "Asia/Tokyo", [((9, 0), (11, 30)), ((12, 30), (15, 30))], _jpx_holidays),
+    "LSE": Exchange("LSE", "Europe/London", [((8, 0), (16, 30))], _uk_holidays),
+    "XETRA": Exchange("XETRA", "Europe/Berlin", [((9, 0), (17, 30))], _xetra_holidays),
+    "EURONEXT": Exchange("EURONEXT", "Europe/Paris", [((9, 0), (17, 30))], _europe_holidays),
+    "MIL": Exchange("MIL", "Europe/Rome", [((9, 0), (17, 30))], _europe_holidays),
+    "BME": Exchange("BME", "Europe/Madrid", [((9, 0), (17, 30))], _europe_holidays),
+    "FX": Exchange("FX", "UTC", [((0, 0), (23, 59, 59))]),
+    "24/7": Exchange("24/7", "UTC", [], always_open=True),
+}
+
+# Yahoo ticker suffix -> exchange code. Tickers without a suffix trade in the US.
+SUFFIXES = {
+    ".KS": "KRX", ".KQ": "KRX",
+    ".T": "JPX",
+    ".L": "LSE",
+    ".DE": "XETRA", ".F": "XETRA",
+    ".PA": "EURONEXT", ".AS": "EURONEXT", ".BR": "EURONEXT", ".LS": "EURONEXT",
+    ".MI": "MIL",
+    ".MC": "BME",
+}
+
+# Exchange time zone reported by Yahoo (exchangeTimezoneName) -> exchange code
+TIMEZONES = {
+    "America/New_York": "US",
+    "Asia/Seoul": "KRX",
+    "Asia/Tokyo": "JPX",
+    "Europe/London": "LSE",
+    "Europe/Berlin": "XETRA",
+    "Europe/Paris": "EURONEXT", "Europe/Amsterdam": "EURONEXT", "Europe/Brussels": "EURONEXT", "Europe/Lisbon": "EURONEXT",
+    "Europe/Rome": "MIL",
+    "Europe/Madrid": "BME",
+}
+
+@lru_cache(maxsize=256)
+def _holidays(code, year):
+    exchange = EXCHANGES[code]
+    holidays = set(exchange._holiday_rule(year)) if exchange._holiday_rule else set()
+    try:
+        extra = json.loads(settings.get("market_holidays") or "{}")
+    except ValueError:
+        extra = {}
+    holidays |= {date.fromisoformat(day) for day in extra.get(code, []) if day.startswith(str(year))}
+    return frozenset(holidays)
+
+def reload_holidays():
+    """Forgets cached holiday sets, e.g. after the market_holidays setting changed."""
+    _holidays.cache_clear()
+
+settings.subscribe(lambda key, value, old: reload_holidays(), keys=("market_holidays",))
+
+def exchange_for(ticker, timezone_name=None):
+    """
+    Returns the Exchange a Yahoo ticker trades on.
+
+    Args:
+        ticker (str): A Yahoo ticker such as 'AAPL', '005930.KS' or 'BTC-USD'.
+        timezone_name (str, optional): The exchangeTimezoneName Yahoo reported for the
+            ticker. Used when the suffix is not recognised.
+    """
+    ticker = ticker.upper()
+    if ticker.endswith("=X"):
+        return EXCHANGES["FX"]
+    if ticker.endswith("=F") or ticker.endswith("-USD") or ticker.endswith("-KRW"):
+        return EXCHANGES["24/7"]  # Futures and crypto trade (nearly) around the clock
+    if "." in ticker:
+        code = SUFFIXES.get(ticker[ticker.rindex("."):])
+        if code:
+            return EXCHANGES[code]
+    if timezone_name in TIMEZONES:
+        return EXCHANGES[TIMEZONES[timezone_name]]
+    if "." in ticker:
+        # Unknown market: never suspend polling for it
+        return EXCHANGES["24/7"]
+    return EXCHANGES["US"]
+
+def is_market_open(ticker, moment=None, timezone_name=None):
+    """Returns True if the ticker's market is in a regular trading session."""
+    return exchange_for(ticker, timezone_name).is_open(moment)
+
+def seconds_until_open(ticker, moment=None, timezone_name=None):
+    """Returns how many seconds until the ticker's market next opens (0 if it is open)."""
+    moment = moment or datetime.now(timezone.utc)
+    return max(0.0, (exchange_for(ticker, timezone_name).next_open(moment) - moment).total_seconds())
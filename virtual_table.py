@@ -0,0 +1,248 @@
+import re
+from tkinter import ttk
+
+DEFAULT_ROW_HEIGHT = 20
+# Rows scrolled per mouse wheel notch
+WHEEL_ROWS = 3
+
+# A displayed number, optionally with a currency prefix and a percent sign: "$-1,234.50", "₩900", "5.2%"
+_NUMBER = re.compile(r"^[^\d\-]*(-?[\d,]*\.?\d+)\s*%?$")
+_COMPARISON = re.compile(r"^(>=|<=|>|<|=)\s*(-?[\d,]*\.?\d+)$")
+
+def sort_value(value):
+    """Returns a sort key for a displayed cell. Numbers sort before text, text ignores case."""
+    if value is None:
+        return (2, 0.0, "")
+    if isinstance(value, (int, float)):
+        return (0, float(value), "")
+    text = str(value).strip()
+    match = _NUMBER.match(text)
+    if match:
+        try:
+            return (0, float(match.group(1).replace(",", "")), "")
+        except ValueError:
+            pass
+    return (1, 0.0, text.lower())
+
+def cell_matches(value, pattern):
+    """
+    Returns True if a displayed cell matches a filter pattern.
+
+    A pattern such as ">0", "<=-5" or "=100" compares numerically against cells that
+    hold a number; anything else is a case-insensitive substring match.
+    """
+    comparison = _COMPARISON.match(pattern)
+    if comparison:
+        kind, number, _ = sort_value(value)
+        if kind != 0:
+            return False
+        operator, limit = comparison.group(1), float(comparison.group(2).replace(",", ""))
+        return {">": number > limit, "<": number < limit, ">=": number >= limit,
+                "<=": number <= limit, "=": number == limit}[operator]
+    return pattern.lower() in str(value).lower()
+
+class VirtualTable(ttk.Frame):
+    """
+    A Treeview that renders only the rows currently on screen.
+
+    The rows live in an in-memory model keyed by a caller-chosen key (a ticker, an
+    alert ID). Sorting (click a heading) and filtering run on the model; the Treeview
+    holds one item per visible line, which is reused as the view scrolls, and an item
+    is only reconfigured when the row shown in it changes. Inserting or scrolling
+    through 10k rows therefore costs the same as through a screenful.
+    """
+
+    def __init__(self, master, columns, **kwargs):
+        super().__init__(master, **kwargs)
+        self.columns = tuple(columns)
+        self.tree = ttk.Treeview(self, columns=self.columns, show="headings", selectmode="browse")
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self._on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+        self.tree.pack(side="left", expand=True, fill="both")
+
+        self._rows = {}  # key -> (values, tags), in insertion order
+        self._view = []  # Keys that pass the filter, in display order
+        self._positions = {}  # key -> index in _view
+        self._rendered = []  # Treeview item (slot) -> (key, values, tags) it currently shows
+        self._offset = 0  # Index in _view of the first visible row
+        self._visible = 1
+        self._selected = None
+
+        self._titles = {column: column for column in self.columns}
+        self._sort_column = None
+        self._sort_descending = False
+        self._filter_pattern = ""
+        self._filter_column = None
+        for column in self.columns:
+            self.heading(column)
+
+        self.tree.bind("<Configure>", self._on_resize)
+        self.tree.bind("<<TreeviewSelect>>", self._on_select)
+        self.tree.bind("<MouseWheel>", lambda event: self._scroll_rows(-WHEEL_ROWS if event.delta > 0 else WHEEL_ROWS))
+        self.tree.bind("<Button-4>", lambda event: self._scroll_rows(-WHEEL_ROWS))
+        self.tree.bind("<Button-5>", lambda event: self._scroll_rows(WHEEL_ROWS))
+        self.tree.bind("<Up>", lambda event: self._move_selection(-1))
+        self.tree.bind("<Down>", lambda event: self._move_selection(1))
+        self.tree.bind("<Prior>", lambda event: self._move_selection(-self._visible))
+        self.tree.bind("<Next>", lambda event: self._move_selection(self._visible))
+        self.tree.bind("<Home>", lambda event: self._move_selection(-len(self._view)))
+        self.tree.bind("<End>", lambda event: self._move_selection(len(self._view)))
+
+    # --- Treeview Pass-Through ---
+
+    def heading(self, column, text=None):
+        """Sets a column's title. Clicking the heading sorts the model by that column."""
+        if text is not None:
+            self._titles[column] = text
+        title = self._titles[column]
+        if column == self._sort_column:
+            title += " ▼" if self._sort_descending else " ▲"
+        self.tree.heading(column, text=title, command=lambda: self.sort_by(column))
+
+    def column(self, column, option=None, **kwargs):
+        return self.tree.column(column, option, **kwargs)
+
+    def tag_configure(self, tag, **kwargs):
+        return self.tree.tag_configure(tag, **kwargs)
+
+    # --- Model ---
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def shown_count(self):
+        """Number of rows that pass the current filter."""
+        return len(self._view)
+
+    def set_rows(self, rows):
+        """
+        Replaces the model.
+
+        Args:
+            rows (dict): Maps each row key to (values, tags), in the default display order.
+        """
+        self._rows = dict(rows)
+        self._refresh_view()
+
+    def selected_key(self):
+        """Returns the key of the selected row, or None."""
+        return self._selected if self._selected in self._rows else None
+
+    def sort_by(self, column, descending=None):
+        """Sorts the model by a column; sorting by the same column again reverses the order."""
+        if descending is None:
+            descending = not self._sort_descending if column == self._sort_column else False
+        previous, self._sort_column, self._sort_descending = self._sort_column, column, descending
+        for name in {previous, column} - {None}:
+            self.heading(name)
+        self._refresh_view()
+
+    def set_filter(self, pattern, column=None):
+        """
+        Shows only the rows whose cell matches `pattern` (see cell_matches).
+
+        Args:
+            pattern (str): The filter; an empty pattern shows every row.
+            column (str, optional): Only match this column. Defaults to any column.
+        """
+        self._filter_pattern = (pattern or "").strip()
+        self._filter_column = column
+        self._offset = 0
+        self._refresh_view()
+
+    def _refresh_view(self):
+        keys = list(self._rows)
+        if self._filter_pattern:
+            pattern = self._filter_pattern
+            if self._filter_column in self.columns:
+                index = self.columns.index(self._filter_column)
+                keys = [key for key in keys if cell_matches(self._rows[key][0][index], pattern)]
+            else:
+                keys = [key for key in keys if any(cell_matches(value, pattern) for value in self._rows[key][0])]
+        if self._sort_column is not None:
+            index = self.columns.index(self._sort_column)
+            keys.sort(key=lambda key: sort_value(self._rows[key][0][index]), reverse=self._sort_descending)
+        self._view = keys
+        self._positions = {key: position for position, key in enumerate(keys)}
+        self._render()
+
+    # --- Rendering ---
+
+    def _render(self):
+        """Shows the visible window of the view, touching only the items whose row changed."""
+        self._offset = max(0, min(self._offset, len(self._view) - self._visible))
+        count = max(0, min(self._visible, len(self._view) - self._offset))
+        while len(self._rendered) < count:
+            self.tree.insert("", "end", iid=str(len(self._rendered)))
+            self._rendered.append(None)
+        while len(self._rendered) > count:
+            self._rendered.pop()
+            self.tree.delete(str(len(self._rendered)))
+
+        for slot in range(count):
+            key = self._view[self._offset + slot]
+            values, tags = self._rows[key]
+            row = (key, values, tags)
+            if self._rendered[slot] != row:
+                self.tree.item(str(slot), values=values, tags=tags)
+                self._rendered[slot] = row
+
+        position = self._positions.get(self._selected)
+        wanted = (str(position - self._offset),) if position is not None and 0 <= position - self._offset < count else ()
+        if tuple(self.tree.selection()) != wanted:
+            if wanted:
+                self.tree.selection_set(wanted)
+            else:
+                self.tree.selection_remove(self.tree.selection())
+
+        total = len(self._view)
+        if total:
+            self.scrollbar.set(self._offset / total, (self._offset + count) / total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def _on_resize(self, event):
+        try:
+            row_height = int(ttk.Style(self).lookup("Treeview", "rowheight") or DEFAULT_ROW_HEIGHT)
+        except (TypeError, ValueError):
+            row_height = DEFAULT_ROW_HEIGHT
+        # One line's worth of height goes to the headings
+        visible = max(1, event.height // row_height - 1)
+        if visible != self._visible:
+            self._visible = visible
+            self._render()
+
+    # --- Scrolling and Selection ---
+
+    def _scroll_rows(self, rows):
+        self._offset += rows
+        self._render()
+        return "break"  # Never let the Treeview scroll its few items itself
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self._offset = int(float(amount) * len(self._view))
+            self._render()
+        elif action == "scroll":
+            self._scroll_rows(int(amount) * (self._visible if unit == "pages" else 1))
+
+    def _on_select(self, event=None):
+        selection = self.tree.selection()
+        if selection:
+            slot = int(selection[0])
+            if slot < len(self._rendered) and self._rendered[slot] is not None:
+                self._selected = self._rendered[slot][0]
+
+    def _move_selection(self, rows):
+        if not self._view:
+            return "break"
+        position = self._positions.get(self._selected)
+        position = 0 if position is None else max(0, min(len(self._view) - 1, position + rows))
+        self._selected = self._view[position]
+        if position < self._offset:
+            self._offset = position
+        elif position >= self._offset + self._visible:
+            self._offset = position - self._visible + 1
+        self._render()
+        return "break"
@@ -1,5 +1,3 @@
-
-import yfinance as yf
 import os
 
 # Set the cache directory to the AppData folder
@@ -7,64 +5,407 @@ app_data_path = os.getenv('APPDATA')
 if not app_data_path:
     app_data_path = os.path.expanduser('~')
 cache_dir = os.path.join(app_data_path, 'StockAlert', 'yfinance_cache')
-os.makedirs(cache_dir, exist_ok=True)
-yf.set_tz_cache_location(cache_dir)
 
 
 import requests
+from requests.adapters import HTTPAdapter
+import logging
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import metrics
+import resilience
+import settings
+
+try:
+    import requests_cache
+except ImportError:  # Optional: without it every request goes to the network
+    requests_cache = None
+
+logger = logging.getLogger(__name__)
+
+# Number of tickers fetched in parallel by get_current_prices
+DEFAULT_MAX_WORKERS = 8
+# Requests per second allowed to each Yahoo host, shared by every caller, and the burst size
+DEFAULT_RATE_LIMIT = 5
+DEFAULT_RATE_BURST = 10
+# Longest a request waits for the rate limiter before giving up
+RATE_LIMIT_TIMEOUT = 30
+# Seconds to connect and to wait for a response
+REQUEST_TIMEOUT = (3.05, 10)
+# Retries of a 429, a 5xx or a connection failure; retries that would wait longer than
+# MAX_RETRY_DELAY are not made, so a fetch never blocks a cycle for long
+MAX_RETRIES = 2
+RETRY_BASE_DELAY = 0.5
+MAX_RETRY_DELAY = 5
+# Consecutive failures that open a host's circuit, and how long it stays open at first
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30
+CIRCUIT_MAX_RESET_TIMEOUT = 600
+RATE_LIMIT_SETTINGS = ("yahoo_rate_limit", "yahoo_rate_burst")
+# Number of symbols requested per call to the multi-symbol quote endpoint
+BATCH_CHUNK_SIZE = 50
+# How long to stop trying the quote endpoint after it refuses us (e.g. 401 without a crumb)
+BATCH_RETRY_AFTER = 3600
+
+# HTTP response cache, next to yfinance_cache. Only the chart and quote endpoints are cached.
+HTTP_CACHE_PATH = os.path.join(app_data_path, 'StockAlert', 'http_cache.sqlite')
+DEFAULT_CHART_TTL = 15
+DEFAULT_QUOTE_TTL = 15
+# After its TTL a response is still served for this long while a background request refreshes it
+DEFAULT_STALE_WHILE_REVALIDATE = 30
+HTTP_CACHE_SETTINGS = ("http_cache_enabled", "http_cache_chart_ttl", "http_cache_quote_ttl", "http_cache_stale_seconds")
+
+CHART_URL = "https://query1.finance.yahoo.com/v8/finance/chart/{ticker}"
+QUOTE_URL = "https://query1.finance.yahoo.com/v7/finance/quote"
+
+# Use a standard browser user-agent to avoid being blocked
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+FETCH_SECONDS = metrics.registry.histogram("stockalert_fetch_seconds", "Latency of Yahoo Finance requests.", ("endpoint",))
+FETCH_ERRORS = metrics.registry.counter("stockalert_fetch_errors_total", "Failed Yahoo Finance requests.", ("endpoint",))
+TICKER_FETCHES = metrics.registry.counter("stockalert_ticker_fetches_total", "Price lookups per ticker by outcome.", ("ticker", "result"))
+HTTP_CACHE_RESPONSES = metrics.registry.counter("stockalert_http_cache_responses_total", "Yahoo Finance responses by HTTP cache outcome.", ("endpoint", "result"))
+RETRIES = metrics.registry.counter("stockalert_fetch_retries_total", "Yahoo Finance requests retried, by reason.", ("host", "reason"))
+REJECTED = metrics.registry.counter("stockalert_fetch_rejected_total", "Yahoo Finance requests not sent, by reason.", ("host", "reason"))
+CIRCUIT_OPEN = metrics.registry.gauge("stockalert_circuit_open", "1 while a host's circuit breaker is failing requests fast.", ("host",))
+TICKER_LATENCY = metrics.registry.gauge("stockalert_ticker_fetch_seconds", "Latency of the request that last returned the ticker's price.", ("ticker",))
 
-def get_current_prices(tickers):
+_session = None
+_session_lock = threading.Lock()
+_host_buckets = {}
+_host_breakers = {}
+_host_registry_lock = threading.Lock()
+_batch_disabled_until = 0
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of sending a request while the host's circuit breaker is open."""
+
+class RateLimitTimeout(requests.exceptions.ConnectionError):
+    """Raised when the rate limiter cannot hand out a request slot within RATE_LIMIT_TIMEOUT."""
+
+def _host_controls(url):
+    """Returns the (TokenBucket, CircuitBreaker) shared by every request to the URL's host."""
+    host = urlparse(url).netloc
+    with _host_registry_lock:
+        if host not in _host_buckets:
+            _host_buckets[host] = resilience.TokenBucket(
+                settings.get_float("yahoo_rate_limit", DEFAULT_RATE_LIMIT), settings.get_float("yahoo_rate_burst", DEFAULT_RATE_BURST))
+            _host_breakers[host] = resilience.CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT, CIRCUIT_MAX_RESET_TIMEOUT)
+            CIRCUIT_OPEN.set(0, host=host)
+        return _host_buckets[host], _host_breakers[host]
+
+def _configure_rate_limits(key, value, old):
+    with _host_registry_lock:
+        buckets = list(_host_buckets.values())
+    for bucket in buckets:
+        bucket.configure(settings.get_float("yahoo_rate_limit", DEFAULT_RATE_LIMIT), settings.get_float("yahoo_rate_burst", DEFAULT_RATE_BURST))
+
+settings.subscribe(_configure_rate_limits, keys=RATE_LIMIT_SETTINGS)
+
+def circuit_retry_in(url=None):
+    """Seconds until the circuit for a URL's host (default the chart endpoint) lets requests through again."""
+    return _host_controls(url or CHART_URL)[1].retry_in()
+
+class ThrottledAdapter(HTTPAdapter):
     """
-    Fetches the current market price for a list of stock tickers by hitting the 
+    Rate-limits, retries and circuit-breaks requests per host.
+
+    Runs only for requests that actually go to the network, so responses served
+    from the HTTP cache cost no tokens. A 429 or 5xx is retried with jittered
+    exponential backoff that honors Retry-After; a 429 also opens the host's
+    circuit for the Retry-After period so no other thread keeps hitting it.
+    """
+
+    def send(self, request, **kwargs):
+        host = urlparse(request.url).netloc
+        bucket, breaker = _host_controls(request.url)
+        attempt = 0
+        while True:
+            # Fail fast while the circuit is open, without waiting for a token first
+            if breaker.retry_in() > 0:
+                REJECTED.inc(host=host, reason="circuit_open")
+                raise CircuitOpenError(f"{host} is failing; retrying in {breaker.retry_in():.0f}s", request=request)
+            if not bucket.acquire(timeout=RATE_LIMIT_TIMEOUT):
+                REJECTED.inc(host=host, reason="rate_limit")
+                raise RateLimitTimeout(f"No request slot for {host} within {RATE_LIMIT_TIMEOUT}s", request=request)
+            if not breaker.allow():
+                # Another thread holds the half-open trial request
+                REJECTED.inc(host=host, reason="circuit_open")
+                raise CircuitOpenError(f"{host} is failing; a trial request is in flight", request=request)
+
+            try:
+                response = super().send(request, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                breaker.record_failure()
+                CIRCUIT_OPEN.set(1 if breaker.retry_in() > 0 else 0, host=host)
+                if attempt >= MAX_RETRIES or breaker.retry_in() > 0:
+                    raise
+                RETRIES.inc(host=host, reason="connection")
+                time.sleep(resilience.backoff_delay(attempt, RETRY_BASE_DELAY, MAX_RETRY_DELAY))
+                attempt += 1
+                continue
+
+            if response.status_code != 429 and response.status_code < 500:
+                breaker.record_success()
+                CIRCUIT_OPEN.set(0, host=host)
+                return response
+
+            retry_after = resilience.parse_retry_after(response.headers.get("Retry-After"))
+            breaker.record_failure(retry_after if response.status_code == 429 else None)
+            CIRCUIT_OPEN.set(1 if breaker.retry_in() > 0 else 0, host=host)
+            delay = resilience.backoff_delay(attempt, RETRY_BASE_DELAY, MAX_RETRY_DELAY, retry_after)
+            if attempt >= MAX_RETRIES or delay > MAX_RETRY_DELAY or breaker.retry_in() > delay:
+                if response.status_code == 429:
+                    logger.warning("Yahoo is rate limiting us; pausing requests to %s for %.0fs.", host, max(delay, breaker.retry_in()))
+                return response
+            RETRIES.inc(host=host, reason=str(response.status_code))
+            response.close()
+            # A short Retry-After opened the circuit only for the time we wait here
+            time.sleep(delay)
+            attempt += 1
+
+def load_yfinance():
+    """
+    Imports yfinance with its time zone cache in the AppData folder.
+
+    This client talks to Yahoo over plain HTTP, so yfinance (and pandas with it) is
+    only loaded by the tools that need its downloads, such as the backtester.
+    """
+    import yfinance as yf
+    os.makedirs(cache_dir, exist_ok=True)
+    yf.set_tz_cache_location(cache_dir)
+    return yf
+
+def _endpoint_pattern(url):
+    """Turns an endpoint URL into a requests-cache URL pattern covering every ticker/query."""
+    parsed = urlparse(url)
+    path = parsed.path.split("{", 1)[0].rstrip("/")
+    return f"{parsed.netloc}{path}*"
+
+def _create_session():
+    """Builds a session, cached per endpoint if requests-cache is installed and enabled."""
+    if requests_cache is not None and settings.get("http_cache_enabled", "True") == "True":
+        session = requests_cache.CachedSession(
+            backend=requests_cache.SQLiteCache(HTTP_CACHE_PATH, wal=True),
+            expire_after=requests_cache.DO_NOT_CACHE,
+            urls_expire_after={
+                _endpoint_pattern(CHART_URL): settings.get_float("http_cache_chart_ttl", DEFAULT_CHART_TTL),
+                _endpoint_pattern(QUOTE_URL): settings.get_float("http_cache_quote_ttl", DEFAULT_QUOTE_TTL),
+            },
+            allowable_methods=('GET',),
+            # Expired entries with an ETag or Last-Modified are revalidated with a conditional request
+            cache_control=True,
+            stale_while_revalidate=settings.get_float("http_cache_stale_seconds", DEFAULT_STALE_WHILE_REVALIDATE),
+            stale_if_error=True,
+        )
+    else:
+        session = requests.Session()
+    session.headers.update(HEADERS)
+    # Keep enough pooled connections around for every worker thread
+    adapter = ThrottledAdapter(pool_connections=4, pool_maxsize=max(DEFAULT_MAX_WORKERS, 10))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def get_session():
+    """Returns the shared keep-alive session, creating it on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _create_session()
+        return _session
+
+def reset_session():
+    """Closes the shared session so the next request builds one from the current settings and URLs."""
+    global _session
+    with _session_lock:
+        session, _session = _session, None
+    if session is not None:
+        session.close()
+
+settings.subscribe(lambda key, value, old: reset_session(), keys=HTTP_CACHE_SETTINGS)
+
+def _record_cache_result(response, endpoint):
+    if getattr(response, 'from_cache', None) is None:
+        return  # Not a cached session
+    if not response.from_cache:
+        HTTP_CACHE_RESPONSES.inc(endpoint=endpoint, result="miss")
+    elif getattr(response, 'is_expired', False):
+        HTTP_CACHE_RESPONSES.inc(endpoint=endpoint, result="stale")
+    else:
+        HTTP_CACHE_RESPONSES.inc(endpoint=endpoint, result="hit")
+
+def _metadata(fields):
+    """Picks the quote time, currency, exchange and time zone out of a chart meta or quote object."""
+    return {
+        'time': _market_time(fields),
+        'currency': fields.get('currency'),
+        'exchange': fields.get('fullExchangeName') or fields.get('exchangeName') or fields.get('exchange'),
+        'timezone': fields.get('exchangeTimezoneName'),
+    }
+
+def _market_time(fields):
+    """Returns the epoch seconds of the last trade Yahoo reported, or None."""
+    value = fields.get('regularMarketTime')
+    if isinstance(value, dict):  # Formatted responses wrap numbers as {'raw': ..., 'fmt': ...}
+        value = value.get('raw')
+    try:
+        return float(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+def _fetch_chart_price(ticker_symbol):
+    """
+    Fetches the price and full name of one ticker from the chart endpoint.
+
+    Returns:
+        dict or None: {'price': ..., 'full_name': ...} plus the quote 'time' (epoch seconds)
+            and the 'currency', 'exchange' and 'timezone' metadata Yahoo reported, or None
+            if the lookup failed.
+    """
+    url = CHART_URL.format(ticker=ticker_symbol)
+    try:
+        started = time.perf_counter()
+        response = get_session().get(url, timeout=REQUEST_TIMEOUT)
+        latency = time.perf_counter() - started
+        FETCH_SECONDS.observe(latency, endpoint="chart")
+        _record_cache_result(response, "chart")
+        response.raise_for_status()  # Raise an exception for bad status codes
+
+        data = response.json()
+        # The most reliable field for the current price
+        meta = data['chart']['result'][0]['meta']
+        current_price = meta['regularMarketPrice']
+        full_name = meta.get('longName') or meta.get('shortName') or ticker_symbol # Fallback to ticker
+
+        if current_price:
+            TICKER_FETCHES.inc(ticker=ticker_symbol, result="ok")
+            TICKER_LATENCY.set(latency, ticker=ticker_symbol)
+            return {'price': current_price, 'full_name': full_name, **_metadata(meta)}
+        logger.warning("Could not find price for %s in API response.", ticker_symbol)
+
+    except CircuitOpenError as e:
+        # Not an error of this ticker; the breaker already logged why the host is paused
+        logger.debug("Skipped %s: %s", ticker_symbol, e)
+        TICKER_FETCHES.inc(ticker=ticker_symbol, result="skipped")
+        return None
+    except requests.exceptions.RequestException as e:
+        FETCH_ERRORS.inc(endpoint="chart")
+        logger.warning("Error fetching direct for %s: %s", ticker_symbol, e)
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        FETCH_ERRORS.inc(endpoint="chart")
+        logger.warning("Error parsing response for %s: Invalid ticker or API change? %s", ticker_symbol, e)
+    TICKER_FETCHES.inc(ticker=ticker_symbol, result="error")
+    return None
+
+def _fetch_quote_batch(symbols):
+    """
+    Fetches prices and full names for several tickers with one quote request.
+
+    Returns:
+        dict: A dictionary mapping each ticker that was found to
+            {'price': ..., 'full_name': ...} plus metadata, as for _fetch_chart_price.
+            Missing tickers are simply absent.
+    """
+    global _batch_disabled_until
+    prices = {}
+    try:
+        started = time.perf_counter()
+        response = get_session().get(QUOTE_URL, params={'symbols': ','.join(symbols)}, timeout=REQUEST_TIMEOUT)
+        latency = time.perf_counter() - started
+        FETCH_SECONDS.observe(latency, endpoint="quote")
+        _record_cache_result(response, "quote")
+        if response.status_code in (401, 403):
+            FETCH_ERRORS.inc(endpoint="quote")
+            # The endpoint wants a cookie/crumb; use the chart endpoint for a while
+            logger.warning("Batch quote endpoint refused the request (%s), using per-ticker requests.", response.status_code)
+            _batch_disabled_until = time.monotonic() + BATCH_RETRY_AFTER
+            return prices
+        response.raise_for_status()
+
+        for quote in response.json()['quoteResponse']['result']:
+            ticker_symbol = quote.get('symbol')
+            current_price = quote.get('regularMarketPrice')
+            if ticker_symbol in symbols and current_price:
+                full_name = quote.get('longName') or quote.get('shortName') or ticker_symbol
+                prices[ticker_symbol] = {'price': current_price, 'full_name': full_name, **_metadata(quote)}
+                TICKER_FETCHES.inc(ticker=ticker_symbol, result="ok")
+                TICKER_LATENCY.set(latency, ticker=ticker_symbol)
+
+    except CircuitOpenError as e:
+        logger.debug("Skipped batch quote for %d tickers: %s", len(symbols), e)
+    except requests.exceptions.RequestException as e:
+        FETCH_ERRORS.inc(endpoint="quote")
+        logger.warning("Error fetching batch quote for %d tickers: %s", len(symbols), e)
+    except (KeyError, TypeError, ValueError) as e:
+        FETCH_ERRORS.inc(endpoint="quote")
+        logger.warning("Error parsing batch quote response: API change? %s", e)
+    return prices
+
+def _map_concurrently(func, items, workers):
+    """Applies func to every item using up to `workers` threads and returns the results in order."""
+    if workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(workers, len(items)), thread_name_prefix="yf-fetch") as executor:
+        return list(executor.map(func, items))
+
+def get_current_prices(tickers, max_workers=None, batch=True, chunk_size=None):
+    """
+    Fetches the current market price for a list of stock tickers by hitting the
     Yahoo Finance API directly.
 
+    In batch mode the tickers are requested in chunks from the multi-symbol quote
+    endpoint, and any ticker the batch does not return falls back to the
+    per-ticker chart endpoint. Requests run concurrently on a bounded pool of
+    workers sharing one keep-alive session, so connections are reused.
+
     Args:
         tickers (list): A list of stock ticker symbols (e.g., ['AAPL', 'GOOGL']).
+        max_workers (int, optional): Maximum number of parallel requests.
+            Defaults to DEFAULT_MAX_WORKERS. Use 1 for sequential fetching.
+        batch (bool, optional): Use the multi-symbol quote endpoint first. Defaults to True.
+        chunk_size (int, optional): Symbols per batch request. Defaults to BATCH_CHUNK_SIZE.
 
     Returns:
-        dict: A dictionary mapping each ticker to its current price.
+        dict: A dictionary mapping each ticker to {'price': ..., 'full_name': ...}, plus
+            'time', 'currency', 'exchange' and 'timezone' when Yahoo reported them.
     """
     if not tickers:
         return {}
 
+    # Preserve the caller's order while dropping duplicates
+    unique_tickers = list(dict.fromkeys(tickers))
+    workers = max(1, max_workers or DEFAULT_MAX_WORKERS)
     prices = {}
-    # Use a standard browser user-agent to avoid being blocked
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
 
-    for ticker_symbol in tickers:
-        url = f"https://query1.finance.yahoo.com/v8/finance/chart/{ticker_symbol}"
-        try:
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()  # Raise an exception for bad status codes
-            
-            data = response.json()
-            # The most reliable field for the current price
-            current_price = data['chart']['result'][0]['meta']['regularMarketPrice']
-            full_name = data['chart']['result'][0]['meta'].get('longName', ticker_symbol) # Fallback to ticker
-            
-            if current_price:
-                prices[ticker_symbol] = {'price': current_price, 'full_name': full_name}
-            else:
-                print(f"Could not find price for {ticker_symbol} in API response.")
-
-            # Small delay to be respectful to the API
-            time.sleep(0.2)
-
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching direct for {ticker_symbol}: {e}")
-        except (KeyError, IndexError) as e:
-            print(f"Error parsing response for {ticker_symbol}: Invalid ticker or API change? {e}")
-            
+    if batch and len(unique_tickers) > 1 and time.monotonic() >= _batch_disabled_until:
+        size = max(1, chunk_size or BATCH_CHUNK_SIZE)
+        chunks = [unique_tickers[i:i + size] for i in range(0, len(unique_tickers), size)]
+        for chunk_prices in _map_concurrently(_fetch_quote_batch, chunks, workers):
+            prices.update(chunk_prices)
+
+    # Anything the batch did not return goes through the chart endpoint one by one
+    remaining = [ticker for ticker in unique_tickers if ticker not in prices]
+    retry_in = circuit_retry_in(CHART_URL)
+    if remaining and retry_in > 0:
+        # Fail the whole cycle fast instead of queueing a request per ticker behind the breaker
+        logger.warning("Yahoo Finance is unavailable; skipping %d tickers for %.0fs.", len(remaining), retry_in)
+        return prices
+    for ticker, result in zip(remaining, _map_concurrently(_fetch_chart_price, remaining, workers)):
+        if result:
+            prices[ticker] = result
+
     return prices
 
 if __name__ == '__main__':
     # Example usage:
     test_tickers = ['AAPL', 'MSFT', 'GOOGL']
     prices = get_current_prices(test_tickers)
-    
+
     if prices:
         for ticker, price in prices.items():
             print(f"{ticker}: ${price:.2f}")